@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'تكامل نظام البصمة ZK مع الاشتراكات',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.0.1',
     'summary': 'ربط أجهزة البصمة ZK-Teco مع نظام الاشتراكات لإدارة صلاحية الوصول',
     'description': """
 تكامل نظام البصمة ZK مع اشتراكات Odoo 18
@@ -38,6 +38,11 @@
         'views/res_partner_views.xml',
         'views/zk_device_views.xml',
         'views/sale_order_views.xml',
+        'views/zk_sync_job_views.xml',
+        'views/zk_attendance_views.xml',
+        'views/zk_device_group_views.xml',
+        'views/zk_device_user_views.xml',
+        'views/zk_device_snapshot_views.xml',
         'data/cron_data.xml',
     ],
     'external_dependencies': {
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from odoo import http
+from odoo.http import request
+
+from ..tools.metrics import device_metrics
+
+# العناوين المسموح لها بقراءة القياسات (الخادم نفسه فقط)
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+class ZKMetricsController(http.Controller):
+
+    @http.route('/zk_subscription_integration/metrics', type='http', auth='none', methods=['GET'], csrf=False)
+    def metrics(self, **kwargs):
+        """قياسات زمن عمليات أجهزة البصمة بتنسيق Prometheus، متاحة من الخادم المحلي فقط"""
+        if request.httprequest.remote_addr not in LOCAL_ADDRESSES:
+            return request.make_response('Forbidden', status=403)
+        return request.make_response(
+            device_metrics.render_prometheus(),
+            headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')],
+        )
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """علامة آخر بصمة مستوردة كانت تحفظ حسب ساعة الجهاز، يتم تحويلها إلى التوقيت العالمي"""
+    if not version:
+        return
+    cr.execute("""
+        UPDATE zk_device
+           SET attendance_hwm_timestamp = (attendance_hwm_timestamp AT TIME ZONE COALESCE(device_tz, 'UTC')) AT TIME ZONE 'UTC'
+         WHERE attendance_hwm_timestamp IS NOT NULL
+    """)
+    _logger.info("تم تحويل وقت آخر بصمة مستوردة إلى التوقيت العالمي في %d جهاز", cr.rowcount)
@@ -1,3 +1,11 @@
 from . import res_partner
 from . import zk_device
 from . import sale_order
+from . import zk_sync_job
+from . import zk_device_probe
+from . import zk_fingerprint_template
+from . import zk_attendance
+from . import zk_device_group
+from . import product_template
+from . import zk_device_user
+from . import zk_device_snapshot_restore
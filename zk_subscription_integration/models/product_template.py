@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    zk_device_group_ids = fields.Many2many(
+        'zk.device.group', 'product_template_zk_device_group_rel', 'product_tmpl_id', 'group_id',
+        string="مجموعات أجهزة البصمة",
+        help="الفروع التي يسمح هذا الاشتراك بدخولها، فارغ يعني جميع الأجهزة"
+    )
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
 from odoo import models, fields, api, _
 
 
@@ -44,108 +47,285 @@ class ResPartner(models.Model):
         help="يشير إلى ما إذا كان العميل لديه اشتراك نشط أم لا"
     )
     
-    @api.depends('sale_order_ids', 'sale_order_ids.next_invoice_date', 'sale_order_ids.subscription_state')
+    zk_template_ids = fields.One2many(
+        'zk.fingerprint.template', 'partner_id',
+        string="قوالب البصمات",
+        help="قوالب البصمات المخزنة مركزيًا لنشرها على جميع الأجهزة دون إعادة التسجيل"
+    )
+    
+    zk_device_user_ids = fields.One2many(
+        'zk.device.user', 'partner_id',
+        string="حالة البصمة في الأجهزة",
+        help="حالة العميل في كل جهاز حسب آخر قراءة لجداول الأجهزة"
+    )
+    
+    zk_device_group_ids = fields.Many2many(
+        'zk.device.group', 'res_partner_zk_device_group_rel', 'partner_id', 'group_id',
+        string="مجموعات أجهزة البصمة",
+        help="الفروع التي يسمح للعميل بدخولها إضافة إلى فروع منتجات اشتراكاته، فارغ مع منتجات بدون فروع يعني جميع الأجهزة"
+    )
+    
+    zk_state_changed_at = fields.Datetime(
+        string="آخر تغيير في حالة البصمة",
+        readonly=True,
+        index=True,
+        copy=False,
+        help="وقت آخر تغيير في حقول البصمة أو مجموعات الأجهزة، تستخدمه المزامنة التزايدية مع الأجهزة"
+    )
+    
+    access_valid_until = fields.Datetime(
+        string="صلاحية الوصول حتى",
+        compute='_compute_access_valid_until',
+        store=True,
+        index=True,
+        help="نهاية صلاحية وصول العميل حسب اشتراكاته المفتوحة، ويجب سحب البصمة بعد هذا الوقت"
+    )
+    
+    @api.depends('sale_order_ids', 'sale_order_ids.is_subscription', 'sale_order_ids.next_invoice_date',
+                 'sale_order_ids.end_date', 'sale_order_ids.subscription_state', 'sale_order_ids.state')
     def _compute_has_active_subscription(self):
-        """حساب ما إذا كان العميل لديه اشتراك نشط أم لا"""
-        today = fields.Date.today()
+        """حساب ما إذا كان العميل لديه اشتراك نشط أم لا (باستعلام مجمّع واحد لكل المجموعة)"""
+        active_ids = set(self._origin._get_partners_with_active_subscription().ids)
         for partner in self:
-            active_subscription = partner.sale_order_ids.filtered(
-                lambda s: s.is_subscription and 
-                          s.next_invoice_date and 
-                          s.next_invoice_date >= today and
-                          s.subscription_state == 'open'
-            )
-            partner.has_active_subscription = bool(active_subscription)
+            partner.has_active_subscription = partner._origin.id in active_ids
+    
+    @api.depends('sale_order_ids', 'sale_order_ids.is_subscription', 'sale_order_ids.next_invoice_date',
+                 'sale_order_ids.end_date', 'sale_order_ids.subscription_state', 'sale_order_ids.state')
+    def _compute_access_valid_until(self):
+        """حساب نهاية صلاحية الوصول من الاشتراكات المفتوحة (استعلام واحد لكل المجموعة)"""
+        valid_until = self._origin._get_access_valid_until()
+        for partner in self:
+            partner.access_valid_until = valid_until.get(partner._origin.id, False)
+    
+    def _get_access_valid_until(self):
+        """نهاية صلاحية الوصول لكل عميل في self: قاموس {معرف الشريك: وقت}
+        
+        هذا هو التعريف الوحيد للاشتراك النشط ويستخدمه حقلا access_valid_until وhas_active_subscription.
+        صلاحية كل اشتراك مفتوح تنتهي في نهاية يوم الفاتورة التالية، أو نهاية يوم تاريخ الانتهاء إن كان أقرب،
+        وصلاحية العميل هي أبعد صلاحية بين اشتراكاته. العميل بدون اشتراك مفتوح لا يظهر في القاموس.
+        """
+        valid_until = {}
+        if not self.ids:
+            return valid_until
+        subscriptions = self.env['sale.order'].search_read([
+            ('partner_id', 'in', self.ids),
+            ('is_subscription', '=', True),
+            ('subscription_state', '=', 'open'),
+            ('state', '!=', 'cancel'),
+            ('next_invoice_date', '!=', False),
+        ], ['partner_id', 'next_invoice_date', 'end_date'])
+        for sub in subscriptions:
+            last_day = sub['next_invoice_date']
+            if sub['end_date'] and sub['end_date'] < last_day:
+                last_day = sub['end_date']
+            until = datetime.combine(last_day + timedelta(days=1), time.min)
+            partner_id = sub['partner_id'][0]
+            if partner_id not in valid_until or valid_until[partner_id] < until:
+                valid_until[partner_id] = until
+        return valid_until
+    
+    @api.model
+    def _get_partners_to_revoke(self):
+        """العملاء الذين انتهت صلاحية وصولهم وما زالت بصماتهم مفعلة (استعلام نطاق على حقل مفهرس)
+        
+        يشمل العملاء بدون أي اشتراك مفتوح (صلاحية فارغة)، مثل من أغلقت أو ألغيت جميع اشتراكاتهم.
+        """
+        return self.search([
+            '|',
+            ('access_valid_until', '<=', fields.Datetime.now()),
+            ('access_valid_until', '=', False),
+            '|',
+            ('fingerprint_active', '=', True),
+            ('zk_status', '=', 'active'),
+            '|',
+            ('zk_biometric_id', '!=', False),
+            ('fingerprint_id', '!=', False),
+        ])
+    
+    def _get_partners_with_active_subscription(self):
+        """إرجاع الشركاء من self الذين لم تنته صلاحية وصولهم بعد (نفس تعريف access_valid_until)
+        
+        يتم ذلك باستعلام واحد لجميع الشركاء بدلاً من المرور على أوامر البيع لكل شريك.
+        """
+        now = fields.Datetime.now()
+        valid_until = self._get_access_valid_until()
+        return self.browse([partner_id for partner_id, until in valid_until.items() if until > now])
+    
+    def _get_zk_device_groups(self):
+        """مجموعات الأجهزة المخصصة لكل شريك من حقل الشريك ومن منتجات اشتراكاته المفتوحة
+        
+        يعيد قاموس {معرف الشريك: مجموعات الأجهزة}، والمجموعات الفارغة تعني جميع الأجهزة
+        """
+        groups = {partner.id: partner.zk_device_group_ids for partner in self}
+        if not self.ids:
+            return groups
+        lines = self.env['sale.order.line'].search_read([
+            ('order_id.partner_id', 'in', self.ids),
+            ('order_id.is_subscription', '=', True),
+            ('order_id.subscription_state', '=', 'open'),
+            ('product_id.product_tmpl_id.zk_device_group_ids', '!=', False),
+        ], ['order_partner_id', 'product_template_id'])
+        templates = self.env['product.template'].browse({line['product_template_id'][0] for line in lines})
+        group_by_template = {template.id: template.zk_device_group_ids for template in templates}
+        for line in lines:
+            partner_id = line['order_partner_id'][0]
+            if partner_id in groups:
+                groups[partner_id] |= group_by_template[line['product_template_id'][0]]
+        return groups
+    
+    # الحقول التي يؤدي تغييرها إلى تغيير حالة العميل في الأجهزة
+    _ZK_STATE_FIELDS = ('fingerprint_id', 'zk_biometric_id', 'fingerprint_active', 'zk_status',
+                        'has_fingerprint', 'zk_device_group_ids')
+    
+    def write(self, vals):
+        # كتابات المزامنة التزايدية نفسها (zk_skip_state_stamp) تعكس حالة الجهاز ولا تعتبر تغييرًا جديدًا
+        if not self.env.context.get('zk_skip_state_stamp') and any(field in vals for field in self._ZK_STATE_FIELDS):
+            vals = dict(vals, zk_state_changed_at=fields.Datetime.now())
+        res = super(ResPartner, self).write(vals)
+        if 'zk_device_group_ids' in vals:
+            # نشر العملاء النشطين على أجهزة مجموعاتهم الجديدة، وحذفهم من الأجهزة القديمة يتم بالمطابقة الدورية
+            active_partners = self.filtered(lambda p: p.fingerprint_active and p._get_zk_user_id())
+            if active_partners:
+                self.env['zk.sync.job']._enqueue(active_partners, 'enable')
+        return res
+    
+    @api.model
+    def _get_zk_changed_domain(self, since, until):
+        """نطاق العملاء الذين قد تكون حالة وصولهم تغيرت بين since وuntil
+        
+        يشمل: تغيير حقول البصمة أو المجموعات، أو تعديل أحد أوامر البيع الخاصة بالعميل (تجديد، إلغاء،
+        إغلاق)، أو انتهاء صلاحية الوصول خلال الفترة دون أي تعديل.
+        """
+        return [
+            '|', '|',
+            ('zk_state_changed_at', '>', since),
+            ('sale_order_ids.write_date', '>', since),
+            '&', ('access_valid_until', '>', since), ('access_valid_until', '<=', until),
+        ]
+    
+    def _get_zk_user_id(self):
+        """معرف المستخدم في جهاز البصمة (الحقل الجديد أولاً ثم القديم)"""
+        self.ensure_one()
+        return self.fingerprint_id or self.zk_biometric_id or False
+    
+    def _normalize_fingerprint_fields(self):
+        """توحيد الحقول القديمة والجديدة: تعيين has_fingerprint ونسخ zk_biometric_id إلى fingerprint_id
+        
+        كل مجموعة قيم متطابقة تكتب بعملية write واحدة.
+        """
+        self.filtered(
+            lambda p: not p.has_fingerprint and (p.zk_biometric_id or p.fingerprint_id)
+        ).write({'has_fingerprint': True})
+        partners_by_id = defaultdict(lambda: self.browse())
+        for partner in self.filtered(lambda p: not p.fingerprint_id and p.zk_biometric_id):
+            partners_by_id[partner.zk_biometric_id] |= partner
+        for biometric_id, partners in partners_by_id.items():
+            partners.write({'fingerprint_id': biometric_id})
+    
+    def _write_fingerprint_state(self, active):
+        """كتابة حالة البصمة (الحقل الجديد والقديم) بعملية write واحدة
+        
+        يتم تجاهل الشركاء الذين هم بالفعل على الحالة المطلوبة.
+        """
+        status = 'active' if active else 'disabled'
+        partners = self.filtered(lambda p: p.fingerprint_active != active or p.zk_status != status)
+        if partners:
+            partners.write({'fingerprint_active': active, 'zk_status': status})
+        return partners
             
     def action_enable_zk_biometric(self):
-        """تفعيل بصمة العميل في جميع أجهزة ZK المتصلة"""
-        self.ensure_one()
+        """تفعيل بصمة العملاء المحددين في جميع أجهزة ZK المتصلة (جلسة واحدة لكل جهاز)"""
+        return self._set_zk_biometric_state(True)
+        
+    def action_disable_zk_biometric(self):
+        """تعطيل بصمة العملاء المحددين في جميع أجهزة ZK المتصلة (جلسة واحدة لكل جهاز)"""
+        return self._set_zk_biometric_state(False)
+    
+    def _set_zk_biometric_state(self, active):
+        """تطبيق حالة البصمة على مجموعة عملاء من النموذج أو من قائمة العملاء
         
+        العملاء بدون معرف بصمة يتم استبعادهم، وتكتب حالة الباقين بعملية write واحدة،
+        ثم يتم دفع التغييرات لكل جهاز في جلسة واحدة. يعيد إشعارًا بملخص النتائج لكل جهاز.
+        """
         # التحقق من وجود معرف بصمة (حقل جديد أو قديم)
-        fingerprint_id = self.fingerprint_id or self.zk_biometric_id
-        if not fingerprint_id:
+        partners = self.filtered(lambda p: p.fingerprint_id or p.zk_biometric_id)
+        skipped = self - partners
+        if not partners:
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
                 'params': {
                     'title': _('خطأ'),
-                    'message': _('لم يتم تعيين معرّف البصمة لهذا العميل'),
+                    'message': _('لم يتم تعيين معرّف البصمة لهذا العميل') if len(self) == 1
+                               else _('لم يتم تعيين معرّف البصمة لأي من العملاء المحددين'),
                     'type': 'danger',
                 }
             }
         
-        # تحديث حالة البصمة في كلا الحقلين للتوافق
-        self.write({
-            'zk_status': 'active',
-            'fingerprint_active': True,
-            'has_fingerprint': True
-        })
+        # تحديث حالة البصمة في كلا الحقلين للتوافق، ونسخ المعرف القديم إلى الحقل الجديد
+        partners._write_fingerprint_state(active)
+        partners._normalize_fingerprint_fields()
         
-        # إذا لم يكن لديه حقل fingerprint_id فقم بتعيينه من الحقل القديم
-        if not self.fingerprint_id and self.zk_biometric_id:
-            self.fingerprint_id = self.zk_biometric_id
-        
-        # الاتصال بأجهزة ZK وتفعيل البصمة
+        # الاتصال بأجهزة ZK: جميع الأجهزة تعمل بالتوازي، كل جهاز في جلسة خاصة به لجميع العملاء
         devices = self.env['zk.device'].search([('active', '=', True)])
-        success_count = 0
+        if active:
+            results = devices._push_partner_states(enable_partners=partners)
+        else:
+            results = devices._push_partner_states(disable_partners=partners)
+        done_key = 'enabled' if active else 'disabled'
+        
+        lines = []
+        failed_devices = 0
         for device in devices:
-            # نمرر الشريك كاملاً بدلاً من معرف البصمة فقط
-            result = device.enable_user(self)
-            if result:
-                success_count += 1
-                
+            device_result = results.get(device.id)
+            if not device_result:
+                continue
+            done, failed = len(device_result[done_key]), len(device_result['failed'])
+            failed_devices += bool(failed)
+            lines.append(_('%s: %s ناجح، %s فشل') % (device.name, done, failed) if failed
+                         else _('%s: %s ناجح') % (device.name, done))
+        if skipped:
+            lines.append(_('تم تجاهل %s عميل بدون معرّف بصمة') % len(skipped))
+        if failed_devices:
+            lines.append(_('ستتم إعادة المحاولة تلقائيًا للعمليات الفاشلة'))
+        
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': _('تم التفعيل'),
-                'message': _('تم تفعيل البصمة في %s من أصل %s جهاز') % (success_count, len(devices)),
-                'type': 'success',
+                'title': (_('تم تفعيل البصمة لعدد %s عميل') if active else _('تم تعطيل البصمة لعدد %s عميل'))
+                         % len(partners),
+                'message': '\n'.join(lines) or _('لا توجد أجهزة نشطة'),
+                'type': 'warning' if failed_devices or skipped else 'success',
+                'sticky': bool(failed_devices),
             }
         }
-        
-    def action_disable_zk_biometric(self):
-        """تعطيل بصمة العميل في جميع أجهزة ZK المتصلة"""
+    
+    def action_push_zk_templates(self):
+        """نشر قوالب البصمات المخزنة للعميل على جميع أجهزة ZK النشطة"""
         self.ensure_one()
         
-        # التحقق من وجود معرف بصمة (حقل جديد أو قديم)
-        fingerprint_id = self.fingerprint_id or self.zk_biometric_id
-        if not fingerprint_id:
+        if not self.zk_template_ids:
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
                 'params': {
                     'title': _('خطأ'),
-                    'message': _('لم يتم تعيين معرّف البصمة لهذا العميل'),
+                    'message': _('لا توجد قوالب بصمات مخزنة لهذا العميل'),
                     'type': 'danger',
                 }
             }
-            
-        # تحديث حالة البصمة في كلا الحقلين للتوافق
-        self.write({
-            'zk_status': 'disabled',
-            'fingerprint_active': False
-        })
         
-        # إذا لم يكن لديه حقل fingerprint_id فقم بتعيينه من الحقل القديم
-        if not self.fingerprint_id and self.zk_biometric_id:
-            self.fingerprint_id = self.zk_biometric_id
-        
-        # الاتصال بأجهزة ZK وتعطيل البصمة
         devices = self.env['zk.device'].search([('active', '=', True)])
-        success_count = 0
-        for device in devices:
-            # نمرر الشريك كاملاً بدلاً من معرف البصمة فقط
-            result = device.disable_user(self)
-            if result:
-                success_count += 1
-                
+        results = devices.push_templates(self)
+        success_count = len([result for result in results.values() if result['enabled']])
+        
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': _('تم التعطيل'),
-                'message': _('تم تعطيل البصمة في %s من أصل %s جهاز') % (success_count, len(devices)),
+                'title': _('تم النشر'),
+                'message': _('تم نشر البصمات في %s من أصل %s جهاز') % (success_count, len(devices)),
                 'type': 'success',
             }
         }
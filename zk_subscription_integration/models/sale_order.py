@@ -21,111 +21,86 @@ class SaleOrder(models.Model):
         يمكن استدعاء هذه الدالة من إجراء مجدول (بدون معاملات) أو من زر في واجهة المستخدم (بمعامل إضافي).
         *args: تستخدم لقبول أي معاملات إضافية عند الاستدعاء من واجهة المستخدم
         """
-        today = fields.Date.today()
-        # البحث عن الاشتراكات المنتهية (أوامر البيع المتكررة)
-        expired_subscriptions = self.env['sale.order'].search([
-            ('is_subscription', '=', True),
-            ('subscription_state', '=', 'open'),
-            ('next_invoice_date', '<', today),
-        ])
+        # البحث عن العملاء الذين انتهت صلاحية وصولهم مباشرة عبر الحقل المفهرس access_valid_until
+        expired_partners = self.env['res.partner']._get_partners_to_revoke()
         
-        _logger.info("تم العثور على %s اشتراك منتهٍ للتحقق من البصمات", len(expired_subscriptions))
+        _logger.info("تم العثور على %s عميل انتهت صلاحية وصوله للتحقق من البصمات", len(expired_partners))
         
-        for subscription in expired_subscriptions:
-            partner = subscription.partner_id
-            if partner and partner.zk_biometric_id and partner.zk_status == 'active':
-                # تعطيل البصمة لأن الاشتراك منتهٍ
+        if expired_partners:
+            for partner in expired_partners:
                 _logger.info("تعطيل بصمة العميل %s (معرف البصمة: %s) بسبب انتهاء الاشتراك",
-                            partner.name, partner.zk_biometric_id)
-                
-                # تحديث حالة البصمة في سجل العميل
-                partner.write({'zk_status': 'disabled'})
-                
-                # تحديث حقول البصمة الجديدة
-                partner.write({
-                    'zk_status': 'disabled',
-                    'fingerprint_active': False
-                })
-                
-                # التأكد من وجود معرف بصمة في الحقول الجديدة
-                if not partner.fingerprint_id and partner.zk_biometric_id:
-                    partner.fingerprint_id = partner.zk_biometric_id
-                    partner.has_fingerprint = True
-                
-                # محاولة تعطيل البصمة في جميع الأجهزة المتصلة
-                devices = self.env['zk.device'].search([('active', '=', True)])
-                for device in devices:
-                    # تمرير كائن الشريك بدلاً من معرف البصمة فقط
-                    device.disable_user(partner)
+                            partner.name, partner._get_zk_user_id())
+            
+            # تحديث حالة البصمة وحقولها لجميع العملاء دفعة واحدة
+            expired_partners._write_fingerprint_state(False)
+            expired_partners._normalize_fingerprint_fields()
+            
+            # تعطيل البصمات في جميع الأجهزة المتصلة - جلسة واحدة لكل جهاز ومرة واحدة لكل عميل
+            devices = self.env['zk.device'].search([('active', '=', True)])
+            devices.disable_users(expired_partners)
         
         return True
     
     def write(self, vals):
-        """تجاوز دالة الكتابة لمراقبة التغييرات في حالة الاشتراك"""
-        # تسجيل التغييرات المطلوبة للتحليل لاحقًا
-        is_subscription_change = self.is_subscription and ('subscription_state' in vals or 'next_invoice_date' in vals)
+        """تجاوز دالة الكتابة لمراقبة التغييرات في حالة الاشتراك
         
+        يتم تحديث حالة بصمة العملاء فورًا، أما الأجهزة فلا يتم تسجيل أي مهمة لها إلا عند تأكيد
+        المعاملة وبصافي التغييرات فقط (انظر zk.sync.job._enqueue_on_commit)، لذلك لا تسبب العمليات
+        المجمعة مثل الفوترة أو التجديد الجماعي أي اتصال بالأجهزة لكل أمر على حدة.
+        """
         # التحقق من هل تمت إضافة حالة إلغاء
         is_cancellation = 'state' in vals and vals['state'] == 'cancel'
+        # تغييرات الاشتراك تخص أوامر الاشتراك فقط، والإلغاء يخص جميع الأوامر
+        if is_cancellation:
+            orders = self
+        elif any(field in vals for field in ('subscription_state', 'next_invoice_date', 'end_date')):
+            orders = self.filtered('is_subscription')
+        else:
+            orders = self.browse()
         
         # استدعاء الدالة الأصلية لتنفيذ التغييرات
         result = super(SaleOrder, self).write(vals)
         
         # التحقق مما إذا تم تجديد الاشتراك أو تغيرت حالته
-        if is_subscription_change or is_cancellation:
-            for subscription in self:
-                partner = subscription.partner_id
-                if partner and partner.zk_biometric_id:
-                    # تحديد ما إذا كان الاشتراك نشطًا الآن
-                    today = fields.Date.today()
-                    # إذا كان هناك إلغاء أو تعليق ، فهو غير نشط
-                    if subscription.state == 'cancel' or is_cancellation:
-                        is_active = False
-                    else:
-                        is_active = (subscription.next_invoice_date and 
-                                    subscription.next_invoice_date >= today and
-                                    subscription.subscription_state == 'open')
-                    
-                    if is_active and partner.zk_status == 'disabled':
-                        # تفعيل البصمة لأن الاشتراك تم تجديده
-                        _logger.info("تفعيل بصمة العميل %s (معرف البصمة: %s) بعد تجديد الاشتراك",
-                                    partner.name, partner.zk_biometric_id)
-                        
-                        # تحديث حالة البصمة في سجل العميل
-                        partner.write({
-                            'zk_status': 'active',
-                            'fingerprint_active': True,
-                            'has_fingerprint': True
-                        })
-                        
-                        # التأكد من وجود معرف بصمة في الحقول الجديدة
-                        if not partner.fingerprint_id and partner.zk_biometric_id:
-                            partner.fingerprint_id = partner.zk_biometric_id
-                        
-                        # محاولة تفعيل البصمة في جميع الأجهزة المتصلة
-                        devices = self.env['zk.device'].search([('active', '=', True)])
-                        for device in devices:
-                            # تمرير كائن الشريك بدلاً من معرف البصمة فقط
-                            device.enable_user(partner)
-                    elif not is_active and partner.zk_status == 'active':
-                        # تعطيل البصمة لأن الاشتراك لم يعد نشطًا
-                        _logger.info("تعطيل بصمة العميل %s (معرف البصمة: %s) بسبب إغلاق الاشتراك",
-                                    partner.name, partner.zk_biometric_id)
-                        
-                        # تحديث حالة البصمة في سجل العميل
-                        partner.write({
-                            'zk_status': 'disabled',
-                            'fingerprint_active': False
-                        })
-                        
-                        # التأكد من وجود معرف بصمة في الحقول الجديدة
-                        if not partner.fingerprint_id and partner.zk_biometric_id:
-                            partner.fingerprint_id = partner.zk_biometric_id
-                        
-                        # محاولة تعطيل البصمة في جميع الأجهزة المتصلة
-                        devices = self.env['zk.device'].search([('active', '=', True)])
-                        for device in devices:
-                            # تمرير كائن الشريك بدلاً من معرف البصمة فقط
-                            device.disable_user(partner)
+        if orders:
+            # الحالة المطلوبة لكل عميل من جميع اشتراكاته بنفس تعريف صلاحية الوصول المستخدم في المطابقة،
+            # فإلغاء أو إغلاق اشتراك لا يعطل عميلاً لديه اشتراك آخر ساري
+            partners = orders.partner_id.filtered('zk_biometric_id')
+            active_partners = partners._get_partners_with_active_subscription()
+            desired = {partner: partner in active_partners for partner in partners}
+            
+            partners_to_enable = self.env['res.partner']
+            partners_to_disable = self.env['res.partner']
+            for partner, is_active in desired.items():
+                if is_active and partner.zk_status == 'disabled':
+                    # تفعيل البصمة لأن الاشتراك تم تجديده
+                    _logger.info("تفعيل بصمة العميل %s (معرف البصمة: %s) بعد تجديد الاشتراك",
+                                partner.name, partner.zk_biometric_id)
+                    partners_to_enable |= partner
+                elif not is_active and partner.zk_status == 'active':
+                    # تعطيل البصمة لأن الاشتراك لم يعد نشطًا
+                    _logger.info("تعطيل بصمة العميل %s (معرف البصمة: %s) بسبب إغلاق الاشتراك",
+                                partner.name, partner.zk_biometric_id)
+                    partners_to_disable |= partner
+            
+            # حفظ الحالة الأولية قبل التغيير، وتسجيل المهام بصافي التغييرات عند تأكيد المعاملة
+            self.env['zk.sync.job']._enqueue_on_commit(partners_to_enable | partners_to_disable)
+            
+            # تحديث حالة البصمة في سجلات العملاء دفعة واحدة لكل حالة
+            if partners_to_enable:
+                partners_to_enable.write({
+                    'zk_status': 'active',
+                    'fingerprint_active': True,
+                    'has_fingerprint': True
+                })
+            if partners_to_disable:
+                partners_to_disable.write({
+                    'zk_status': 'disabled',
+                    'fingerprint_active': False
+                })
+            # التأكد من وجود معرف بصمة في الحقول الجديدة
+            for partner in partners_to_enable | partners_to_disable:
+                if not partner.fingerprint_id and partner.zk_biometric_id:
+                    partner.fingerprint_id = partner.zk_biometric_id
         
         return result
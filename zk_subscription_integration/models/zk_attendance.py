@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+
+class ZKAttendance(models.Model):
+    _name = 'zk.attendance'
+    _description = 'سجل حضور جهاز البصمة'
+    _order = 'timestamp desc, id desc'
+    _rec_name = 'user_id'
+
+    device_id = fields.Many2one('zk.device', string="الجهاز", required=True, index=True, ondelete='cascade')
+    user_id = fields.Char(string="معرّف البصمة", required=True, index=True)
+    uid = fields.Integer(string="الرقم الداخلي في الجهاز")
+    partner_id = fields.Many2one('res.partner', string="العميل", index=True, ondelete='set null')
+    timestamp = fields.Datetime(string="وقت البصمة", required=True, index=True)
+    status = fields.Integer(string="حالة التحقق")
+    punch = fields.Integer(string="نوع الحركة", help="0 دخول، 1 خروج حسب إعداد الجهاز")
+    source = fields.Selection([
+        ('pull', 'استيراد دوري'),
+        ('live', 'التقاط مباشر'),
+    ], string="المصدر", default='pull', required=True)
+    access_denied = fields.Boolean(string="محاولة دخول غير مصرح بها", index=True,
+                                   help="بصمة من عضو غير معروف أو انتهت صلاحية وصوله")
+
+    _sql_constraints = [
+        ('device_user_timestamp_uniq', 'unique(device_id, user_id, timestamp)',
+         'تم استيراد هذه البصمة من هذا الجهاز بالفعل'),
+    ]
+
+    @api.model
+    def _partners_by_user_id(self, user_ids):
+        """ربط معرفات البصمة بالعملاء باستعلام واحد"""
+        if not user_ids:
+            return {}
+        partners = self.env['res.partner'].search([
+            '|',
+            ('fingerprint_id', 'in', list(user_ids)),
+            ('zk_biometric_id', 'in', list(user_ids)),
+        ])
+        return {partner._get_zk_user_id(): partner.id for partner in partners}
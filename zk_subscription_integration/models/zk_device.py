@@ -2,17 +2,351 @@
 
 import logging
 import datetime
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from pytz import timezone, all_timezones
+from psycopg2 import errors
+from pytz import timezone, all_timezones, utc
 from zk import ZK
 from zk.exception import ZKErrorResponse, ZKNetworkError
+from zk.finger import Finger
+from zk.user import User
 from socket import timeout
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import config
+
+from ..tools.live_listener import LiveCaptureListener
+from ..tools.metrics import device_metrics, instrument, summarize_timings
+from ..tools.snapshot import detect_user_packet_size, dump_snapshot, load_snapshot, save_user_templates
+from ..tools.timeouts import (
+    MAX_SAMPLES, PendingSamples, derive_timeouts, record_samples, supports_socket_timeout, timeouts_changed,
+)
+from ..tools.user_cache import user_table_cache
 
 _logger = logging.getLogger(__name__)
 
+# العدد الافتراضي للأجهزة التي تتم معالجتها بالتوازي
+DEFAULT_MAX_WORKERS = 8
+# مهلة الفحص الافتراضية (ثانية) المستخدمة في التحقق الدوري من الاتصال
+DEFAULT_PROBE_TIMEOUT = 3
+# عدد سجلات الحضور التي يتم إدراجها في كل دفعة
+ATTENDANCE_BATCH_SIZE = 1000
+# الحد الأقصى للبصمات المحفوظة في الذاكرة لكل جهاز قبل تفريغها في قاعدة البيانات
+LIVE_BUFFER_SIZE = 5000
+# الفاصل الزمني (ثانية) بين عمليات تفريغ بصمات الالتقاط المباشر
+LIVE_FLUSH_INTERVAL = 1
+# أقصى مدة تشغيل للمستمعين في كل تنفيذ للإجراء المجدول (أقل من فاصل الإجراء المجدول)،
+# وتقلص تلقائيًا إلى ما يسمح به حد الوقت الحقيقي للإجراءات المجدولة
+LIVE_RUN_SECONDS = 280
+# الوقت المحجوز (ثانية) بعد انتهاء الاستماع لإيقاف المستمعين وتفريغ آخر البصمات
+LIVE_SHUTDOWN_RESERVE = 15
+# الفترة الافتراضية (ساعة) بين المطابقات الكاملة في وضع المزامنة التزايدية
+DEFAULT_FULL_RECONCILE_HOURS = 24
+# هامش (ثانية) يطرح من علامة المزامنة التزايدية لتغطية فروق الساعة بين خوادم Odoo وقاعدة البيانات
+SYNC_WATERMARK_MARGIN = 60
+# أقصى مدة (ثانية) لتشغيل عامل مزامنة واحد قبل ترك باقي الأجهزة للتشغيل التالي،
+# وتقلص تلقائيًا إلى ما يسمح به حد الوقت الحقيقي للإجراءات المجدولة
+SYNC_WORKER_RUN_SECONDS = 3000
+# الوقت المحجوز (ثانية) لإكمال مزامنة آخر جهاز تم حجزه قبل انتهاء المدة
+SYNC_WORKER_RESERVE = 60
+# الفترة الافتراضية (ساعة) بين قياسات سرعة البروتوكولين في الوضع التلقائي
+DEFAULT_TRANSPORT_RECHECK_HOURS = 24
+# نسبة التفوق المطلوبة في السرعة لاختيار UDP بدلاً من TCP (TCP أكثر موثوقية مع البيانات الكبيرة)
+UDP_PREFERENCE_MARGIN = 1.1
+# حدود المهلة التكيفية (ثانية): حد أدنى للأوامر الصغيرة وحد أعلى افتراضي للقراءات الكبيرة
+ADAPTIVE_MIN_TIMEOUT = 2
+DEFAULT_ADAPTIVE_MAX_TIMEOUT = 180
+# عدد الجلسات الفاشلة المتتالية قبل فتح قاطع الدائرة للجهاز
+BREAKER_FAILURE_THRESHOLD = 3
+# مدة الفتح الأساسية (ثانية) وتتضاعف مع كل فتح متتالٍ حتى الحد الأقصى
+BREAKER_BASE_DELAY = 60
+BREAKER_MAX_DELAY = 3600
+# مدة حجز الاتصال التجريبي (ثانية): إذا لم تسجل نتيجته خلالها (توقف المتصل) يمكن لمتصل آخر إعادة الاختبار
+BREAKER_TRIAL_SECONDS = 600
+
+
+def _cron_real_time_limit():
+    """حد الوقت الحقيقي (ثانية) الذي يوقف بعده الخادم الإجراء المجدول، أو 0 إذا لم يكن هناك حد
+    
+    limit_time_real_cron بقيمة سالبة (الافتراضي) يعني استخدام limit_time_real.
+    """
+    limit = config.get('limit_time_real_cron') or 0
+    if limit < 0:
+        limit = config.get('limit_time_real') or 0
+    return max(limit, 0)
+
+
+def _cron_run_seconds(maximum, reserve):
+    """مدة التشغيل المتاحة لإجراء مجدول طويل: لا تتجاوز maximum، وتنتهي قبل حد الوقت الحقيقي بمقدار reserve
+    
+    إذا كان الحد أصغر من الوقت المحجوز يتم استخدام نصف الحد.
+    """
+    limit = _cron_real_time_limit()
+    if not limit:
+        return maximum
+    return min(maximum, max(limit - reserve, limit / 2))
+
+
+# أزمنة الجلسات التي لم تحفظ بعد في latency_profile (لكل عملية Odoo)
+pending_samples = PendingSamples()
+
+
+class DeviceUnavailable(Exception):
+    """الجهاز متوقف مؤقتًا بواسطة قاطع الدائرة بعد فشل متكرر"""
+
+
+@contextmanager
+def _zk_session(zk):
+    """جلسة واحدة مع الجهاز: اتصال ثم قفل الجهاز للكتابة ثم إعادة تفعيله وقطع الاتصال"""
+    conn = zk.connect()
+    if not conn:
+        raise ZKNetworkError("تعذر الاتصال بالجهاز")
+    try:
+        # تعطيل الجهاز مؤقتًا للقراءة/الكتابة
+        conn.disable_device()
+        try:
+            yield conn
+        finally:
+            conn.enable_device()
+    finally:
+        try:
+            conn.disconnect()
+        except Exception as e:
+            _logger.warning("تعذر قطع الاتصال بالجهاز: %s", str(e))
+
+
+def _probe_device(zk, ip_address, port, protocol, probe_timeout):
+    """فحص جهاز واحد: تحقق سريع من الوصول ثم مصافحة البروتوكول، مع قياس زمن الاستجابة بالمللي ثانية"""
+    start = time.monotonic()
+    
+    def elapsed():
+        return (time.monotonic() - start) * 1000.0
+    
+    if protocol != 'udp':
+        # تحقق خفيف من إمكانية فتح اتصال TCP قبل المصافحة الكاملة
+        try:
+            sock = socket.create_connection((ip_address, port), timeout=probe_timeout)
+            sock.close()
+        except socket.timeout:
+            return {'outcome': 'timeout', 'latency': elapsed(), 'message': "انتهت مهلة فتح منفذ TCP"}
+        except OSError as e:
+            return {'outcome': 'unreachable', 'latency': elapsed(), 'message': str(e)}
+    try:
+        conn = zk.connect()
+        conn.disconnect()
+    except socket.timeout:
+        return {'outcome': 'timeout', 'latency': elapsed(), 'message': "انتهت مهلة مصافحة البروتوكول"}
+    except Exception as e:
+        return {'outcome': 'error', 'latency': elapsed(), 'message': str(e)}
+    return {'outcome': 'ok', 'latency': elapsed(), 'message': False}
+
+
+def _measure_user_read(zk):
+    """قياس زمن قراءة جدول المستخدمين كاملاً عبر اتصال واحد (بدون تعطيل الجهاز)
+    
+    يعيد (عدد المستخدمين, المدة بالثانية)
+    """
+    conn = zk.connect()
+    try:
+        start = time.monotonic()
+        users = _read_user_table(conn, fresh=True)
+        return len(users), time.monotonic() - start
+    finally:
+        try:
+            conn.disconnect()
+        except Exception as e:
+            _logger.warning("تعذر قطع الاتصال بالجهاز: %s", str(e))
+
+
+def _new_attendance_records(records, hwm_serial, hwm_timestamp):
+    """اختيار سجلات الحضور الجديدة فقط بناءً على علامة آخر استيراد (الترتيب في السجل ووقت آخر سجل)
+    
+    إذا كان السجل عند موضع العلامة ما زال يحمل نفس الوقت فالسجل لم يتغير ونأخذ ما بعده فقط،
+    وإلا (تم مسح ذاكرة الجهاز أو تغير السجل) نعتمد على الوقت وحده.
+    يعيد قائمة (الموضع في السجل, السجل)
+    """
+    indexed = list(enumerate(records))
+    if not hwm_timestamp:
+        return indexed
+    if 0 < hwm_serial <= len(records) and records[hwm_serial - 1].timestamp == hwm_timestamp:
+        return indexed[hwm_serial:]
+    return [(index, record) for index, record in indexed if record.timestamp > hwm_timestamp]
+
+
+def _diff_user_table(users, desired_active, desired_inactive):
+    """حساب الفرق الأدنى بين جدول مستخدمي الجهاز والحالة المطلوبة
+    
+    users: قاموس {معرف البصمة: مستخدم الجهاز}
+    desired_active: قاموس {معرف البصمة: الاسم} للمستخدمين الذين يجب أن يكونوا في الجهاز
+    desired_inactive: مجموعة معرفات البصمة للمستخدمين الذين يجب ألا يكونوا في الجهاز
+    المستخدمون غير المعروفين في Odoo (مثل المشرفين) لا يتم لمسهم.
+    يعيد (قاموس التفعيل, مجموعة التعطيل)
+    """
+    to_enable = {user_id: name for user_id, name in desired_active.items() if user_id not in users}
+    to_disable = {user_id for user_id in desired_inactive if user_id in users}
+    return to_enable, to_disable
+
+
+def _mirror_snapshot(conn, users):
+    """تسجيل جدول مستخدمين مقروء من الجهاز على كائن الاتصال لتحديث النسخة في قاعدة البيانات بعد الجلسة"""
+    conn.mirror_table = dict(users)
+    conn.mirror_delta = {}
+
+
+def _mirror_change(conn, user_id, user):
+    """تسجيل كتابة (user) أو حذف (None) تم في الجلسة على النسخة المنتظرة"""
+    table = getattr(conn, 'mirror_table', None)
+    if table is not None:
+        if user is None:
+            table.pop(user_id, None)
+        else:
+            table[user_id] = user
+    else:
+        if getattr(conn, 'mirror_delta', None) is None:
+            conn.mirror_delta = {}
+        conn.mirror_delta[user_id] = user
+
+
+def _save_removed_templates(conn, users):
+    """قراءة قوالب المستخدمين قبل حذفهم من الجهاز، لحفظها في المخزن المركزي بعد انتهاء الجلسة
+    
+    users: قاموس {معرف البصمة: مستخدم الجهاز} للمستخدمين الذين سيتم حذفهم
+    القوالب تسجل على conn.removed_templates كقاموس {معرف البصمة: [Finger]}. فشل القراءة لا يمنع الحذف
+    لأن سحب الوصول أهم من الاحتفاظ بالقوالب.
+    """
+    try:
+        fingers = conn.get_templates()
+    except Exception as e:
+        _logger.warning("تعذرت قراءة قوالب البصمات قبل حذف %d مستخدم: %s", len(users), str(e))
+        return
+    user_ids = {user.uid: user_id for user_id, user in users.items()}
+    removed = getattr(conn, 'removed_templates', None) or {}
+    for finger in fingers:
+        user_id = user_ids.get(finger.uid)
+        if user_id:
+            removed.setdefault(user_id, []).append(finger)
+    conn.removed_templates = removed
+
+
+def _read_user_table(conn, cache_key=None, ttl=0, fresh=False):
+    """قراءة جدول مستخدمي الجهاز كقاموس مفهرس بمعرف البصمة
+    
+    يتم استخدام الذاكرة المؤقتة إذا كانت صالحة، إلا إذا طُلبت قراءة جديدة (fresh).
+    كتاباتنا على الجهاز تحدّث الجدول المحفوظ مباشرة، أما تعديلات العمليات الأخرى أو التعديلات اليدوية
+    فيتم اكتشافها بقراءة عدد المستخدمين من الجهاز (أمر واحد صغير) ومقارنته بالجدول المحفوظ قبل استخدامه.
+    """
+    if cache_key and not fresh:
+        users = user_table_cache.get(cache_key)
+        if users is not None:
+            conn.read_sizes()
+            if conn.users == len(users):
+                _logger.info("استخدام جدول المستخدمين المحفوظ مؤقتًا (%d مستخدم)", len(users))
+                # تنسيق حزمة المستخدم يحدده get_users، لذلك نستعيده من الذاكرة المؤقتة
+                conn.user_packet_size = user_table_cache.packet_size(cache_key) or conn.user_packet_size
+                return users
+            _logger.info("عدد مستخدمي الجهاز (%d) لا يطابق الجدول المحفوظ (%d)، تتم قراءة الجدول من جديد",
+                         conn.users, len(users))
+            user_table_cache.invalidate(cache_key)
+    users = {str(user.user_id): user for user in conn.get_users()}
+    _mirror_snapshot(conn, users)
+    if cache_key:
+        user_table_cache.set(cache_key, users, ttl, packet_size=conn.user_packet_size)
+    return users
+
+
+def _apply_user_changes(conn, to_enable, to_disable, users=None, cache_key=None, ttl=0, templates=None,
+                        strict=False, refresh_templates=False):
+    """تطبيق مجموعة تغييرات على جدول مستخدمي جهاز متصل بقراءة واحدة للجدول
+    
+    لا تدعم أجهزة ZK حالة تعطيل للمستخدم، لذلك التفعيل يعني وجود المستخدم في الجهاز
+    والتعطيل يعني حذفه منه. المستخدم الموجود بالفعل مفعل، فلا تتم أي كتابة عليه ويبقى سجله
+    (الرقم الداخلي، البطاقة، الصلاحية، القوالب) كما هو.
+    users: جدول المستخدمين إذا كان قد قُرئ مسبقًا في نفس الجلسة من الجهاز نفسه
+    cache_key, ttl: مفتاح الذاكرة المؤقتة للجهاز ومدة صلاحيتها، ويتم تحديثها مع كل كتابة.
+    templates: قاموس {معرف البصمة: [(رقم الإصبع, صالح, القالب)]} لاستعادة البصمات المخزنة عند التفعيل
+    strict: التحقق من نجاح التفعيل بقراءة كاملة للجدول بعد الكتابة بدلاً من الاعتماد على تأكيد الجهاز
+    refresh_templates: إعادة كتابة القوالب المخزنة للمستخدمين الموجودين في الجهاز أيضًا
+    يعيد قاموس {معرف البصمة: نجاح العملية}
+    """
+    if not to_enable and not to_disable:
+        return {}
+    if users is None:
+        users = _read_user_table(conn, cache_key, ttl)
+    _logger.info("تم العثور على %d مستخدم في الجهاز", len(users))
+    results = {}
+    # نحدد الرقم الداخلي للمستخدمين الجدد بأنفسنا من الجدول (المطابق لعدد مستخدمي الجهاز)
+    next_uid = max([user.uid for user in users.values()] or [0]) + 1
+    
+    for user_id, name in to_enable.items():
+        existing = users.get(user_id)
+        fingers = templates.get(user_id) if templates else None
+        if existing and not (refresh_templates and fingers):
+            # المستخدم موجود، أي أنه مفعل بالفعل
+            results[user_id] = True
+            continue
+        try:
+            if existing:
+                # إعادة كتابة القوالب على نفس السجل دون حذفه
+                user = existing
+            else:
+                user = User(next_uid, name, 0, '', '', user_id, 0)
+                next_uid += 1
+            if fingers:
+                # كتابة المستخدم مع قوالب بصماته المخزنة دون الحاجة لإعادة التسجيل
+                conn.save_user_template(user, [Finger(user.uid, fid, valid, template) for fid, valid, template in fingers])
+            else:
+                conn.set_user(uid=user.uid, name=name, privilege=0, password='', group_id='', user_id=user_id, card=0)
+            # مكتبة ZK ترفع استثناء إذا لم يؤكد الجهاز الكتابة، فالتأكيد هنا هو تحقق الكتابة
+            results[user_id] = True
+            _mirror_change(conn, user_id, user)
+            if cache_key:
+                user_table_cache.put(cache_key, user)
+        except Exception as e:
+            _logger.error("خطأ أثناء محاولة تفعيل المستخدم %s: %s", user_id, str(e))
+            results[user_id] = False
+            if cache_key:
+                # قد يكون الجدول المحفوظ قديمًا، نلغيه لتتم القراءة من الجهاز في المرة القادمة
+                user_table_cache.invalidate(cache_key)
+    
+    # حذف المستخدم من الجهاز يحذف قوالبه أيضًا، فيتم حفظها أولاً لاستعادتها عند إعادة التفعيل
+    to_delete = {user_id: users[user_id] for user_id in to_disable if user_id in users}
+    if to_delete:
+        _save_removed_templates(conn, to_delete)
+    
+    for user_id in to_disable:
+        existing = users.get(user_id)
+        if not existing:
+            # المستخدم غير موجود في الجهاز، فهو معطل بالفعل
+            results[user_id] = True
+            continue
+        try:
+            conn.delete_user(uid=existing.uid)
+            results[user_id] = True
+            _mirror_change(conn, user_id, None)
+            if cache_key:
+                user_table_cache.discard(cache_key, user_id)
+        except Exception as e:
+            _logger.error("خطأ أثناء محاولة تعطيل المستخدم %s: %s", user_id, str(e))
+            results[user_id] = False
+            if cache_key:
+                user_table_cache.invalidate(cache_key)
+    
+    # الوضع الصارم: التحقق من نجاح التفعيل بقراءة واحدة للجدول بعد جميع التغييرات
+    if strict and any(results.get(user_id) for user_id in to_enable):
+        present = _read_user_table(conn, cache_key, ttl, fresh=True)
+        for user_id in to_enable:
+            if results.get(user_id) and user_id not in present:
+                _logger.warning("لم يتم العثور على المستخدم %s بعد محاولة التفعيل", user_id)
+                results[user_id] = False
+    return results
+
 
 class ZKDevice(models.Model):
     _name = 'zk.device'
@@ -33,22 +367,206 @@ class ZKDevice(models.Model):
     device_model = fields.Char(string="موديل الجهاز", tracking=True)
     device_serial = fields.Char(string="الرقم التسلسلي", tracking=True)
     password = fields.Char(string="كلمة المرور", tracking=True, help="حدد كلمة المرور إذا كان جهاز البصمة محميًا بكلمة مرور")
-    protocol = fields.Selection(selection=[('tcp', 'TCP'), ('udp', 'UDP')], 
+    protocol = fields.Selection(selection=[('tcp', 'TCP'), ('udp', 'UDP'), ('auto', 'تلقائي')], 
                               string='البروتوكول', required=True, default='tcp', tracking=True,
-                              help="UDP مناسب للأجهزة القديمة ذات كميات البيانات الصغيرة، يجب استخدام TCP مع الأجهزة التي تحتوي على كميات أكبر من البيانات")
+                              help="UDP مناسب للأجهزة القديمة ذات كميات البيانات الصغيرة، يجب استخدام TCP مع الأجهزة التي تحتوي على كميات أكبر من البيانات. "
+                                   "التلقائي: قياس سرعة قراءة جدول المستخدمين عبر البروتوكولين واختيار الأسرع الذي يعمل بشكل صحيح")
+    effective_protocol = fields.Selection(selection=[('tcp', 'TCP'), ('udp', 'UDP')], string='البروتوكول المستخدم',
+                                          default='tcp', readonly=True, tracking=True,
+                                          help="البروتوكول الذي تم اختياره بالقياس في الوضع التلقائي")
+    tcp_throughput = fields.Float(string="سرعة TCP (مستخدم/ثانية)", readonly=True, digits=(16, 1),
+                                  help="سرعة قراءة جدول المستخدمين في آخر قياس، صفر إذا فشلت القراءة")
+    udp_throughput = fields.Float(string="سرعة UDP (مستخدم/ثانية)", readonly=True, digits=(16, 1),
+                                  help="سرعة قراءة جدول المستخدمين في آخر قياس، صفر إذا فشلت القراءة")
+    transport_checked_at = fields.Datetime(string="آخر قياس للبروتوكولات", readonly=True, copy=False)
+    transport_recheck_interval = fields.Integer(string="إعادة القياس كل (ساعة)", default=DEFAULT_TRANSPORT_RECHECK_HOURS,
+                                                help="الفترة بين قياسات البروتوكولين في الوضع التلقائي (مع الفحص الدوري)")
     ommit_ping = fields.Boolean(string="تخطي فحص الاتصال (Ping)", default=True, tracking=True, 
                               help="عدم محاولة إرسال ping إلى عنوان IP قبل الاتصال بالجهاز")
     time_out = fields.Integer('مهلة الاتصال (ثانية)', default=60, tracking=True, help="حدد الوقت الذي تنتهي فيه الجلسة")
+    timeout_mode = fields.Selection([
+        ('fixed', 'ثابتة'),
+        ('adaptive', 'تكيفية'),
+    ], string="نوع المهلة", default='fixed', required=True, tracking=True,
+        help="التكيفية: مهلة لكل عملية تحسب من أزمنة الاستجابة الفعلية للجهاز، "
+             "وتستخدم مهلة الاتصال للعمليات التي ليس لها عينات كافية بعد")
+    adaptive_max_timeout = fields.Integer('الحد الأعلى للمهلة التكيفية (ثانية)', default=DEFAULT_ADAPTIVE_MAX_TIMEOUT,
+                                          tracking=True, help="أقصى مهلة يمكن أن تصل إليها أي عملية في الوضع التكيفي")
+    latency_profile = fields.Json(string="أزمنة العمليات المسجلة", readonly=True, copy=False,
+                                  help="آخر أزمنة ناجحة لكل عملية (ثانية)، تستخدم لحساب المهلة التكيفية")
+    adaptive_timeout_summary = fields.Text(string="المهلات المحسوبة", compute='_compute_adaptive_timeout_summary')
+    probe_timeout = fields.Integer('مهلة الفحص (ثانية)', default=DEFAULT_PROBE_TIMEOUT, tracking=True,
+                                   help="مهلة قصيرة تستخدم في التحقق الدوري من اتصال الجهاز بدلاً من مهلة الاتصال العادية")
+    last_probe_latency = fields.Float(string="زمن الاستجابة (مللي ثانية)", readonly=True, digits=(16, 1))
+    last_probe_date = fields.Datetime(string="آخر فحص", readonly=True)
+    probe_ids = fields.One2many('zk.device.probe', 'device_id', string="سجل الفحص")
+    device_user_count = fields.Integer(string="المستخدمون في الجهاز", compute='_compute_device_user_count')
+    device_tz = fields.Selection('_tz_get', string="المنطقة الزمنية للجهاز",
+                                 default=lambda self: self.env.user.tz or 'UTC',
+                                 help="المنطقة الزمنية لساعة الجهاز، تستخدم لتحويل أوقات البصمات إلى التوقيت العالمي")
+    attendance_hwm_timestamp = fields.Datetime(string="وقت آخر بصمة مستوردة", readonly=True,
+                                               help="وقت آخر سجل حضور تم استيراده (محفوظ بالتوقيت العالمي مثل باقي الأوقات)")
+    attendance_hwm_serial = fields.Integer(string="موضع آخر بصمة مستوردة", readonly=True,
+                                           help="ترتيب آخر سجل تم استيراده في ذاكرة الجهاز")
+    clear_attendance_after_import = fields.Boolean(string="مسح سجلات الجهاز بعد الاستيراد", default=False, tracking=True,
+                                                   help="مسح ذاكرة الحضور في الجهاز بعد تأكيد حفظ السجلات في Odoo")
+    sync_pending = fields.Boolean(string="بانتظار المزامنة الكاملة", readonly=True, index=True, copy=False,
+                                  help="تم طلب مزامنة كاملة للجهاز وسيتم تنفيذها بواسطة أول عامل مزامنة متاح")
+    sync_requested_at = fields.Datetime(string="وقت طلب المزامنة", readonly=True, copy=False)
+    sync_claimed_by = fields.Char(string="عامل المزامنة", readonly=True, copy=False,
+                                  help="عامل المزامنة الذي حجز الجهاز وينفذ مزامنته حاليًا")
+    sync_claimed_at = fields.Datetime(string="وقت حجز المزامنة", readonly=True, copy=False)
+    last_full_sync = fields.Datetime(string="آخر مزامنة كاملة", readonly=True, copy=False)
+    sync_mode = fields.Selection([
+        ('full', 'كاملة دائمًا'),
+        ('incremental', 'تزايدية'),
+    ], string="نوع المزامنة", default='incremental', required=True, tracking=True,
+        help="التزايدية: مزامنة العملاء الذين تغيرت حالة وصولهم منذ آخر مزامنة ناجحة فقط، "
+             "مع مطابقة كاملة دورية لتصحيح أي اختلاف آخر")
+    full_reconcile_interval = fields.Integer(string="المطابقة الكاملة كل (ساعة)", default=DEFAULT_FULL_RECONCILE_HOURS,
+                                             tracking=True)
+    sync_watermark = fields.Datetime(string="بداية آخر مزامنة ناجحة", readonly=True, copy=False,
+                                     help="التغييرات بعد هذا الوقت تدخل في المزامنة التزايدية التالية، وهو بداية آخر مزامنة ناجحة "
+                                          "أو بداية أقدم معاملة كانت مفتوحة عندها مع هامش لفروق الساعة")
+    breaker_state = fields.Selection([
+        ('closed', 'يعمل'),
+        ('open', 'متوقف مؤقتًا'),
+        ('half_open', 'قيد الاختبار'),
+    ], string="قاطع الدائرة", default='closed', required=True, readonly=True, index=True,
+        help="بعد فشل متكرر يتم إيقاف الاتصال بالجهاز مؤقتًا لتفشل العمليات فورًا دون انتظار المهلة، "
+             "ثم يسمح باتصال تجريبي واحد فقط بعد انتهاء مدة الإيقاف")
+    breaker_failures = fields.Integer(string="الفشل المتتالي", readonly=True)
+    breaker_trips = fields.Integer(string="مرات الإيقاف المتتالية", readonly=True)
+    breaker_open_until = fields.Datetime(string="متوقف حتى", readonly=True)
+    device_group_id = fields.Many2one('zk.device.group', string="مجموعة الأجهزة", index=True, tracking=True,
+                                      help="الفرع أو المنطقة التي ينتمي إليها الجهاز، الجهاز بدون مجموعة يقبل جميع الأعضاء")
+    live_capture = fields.Boolean(string="التقاط مباشر للبصمات", default=False, tracking=True,
+                                  help="الاحتفاظ باتصال دائم مع الجهاز لاستقبال البصمات لحظة حدوثها")
+    live_last_event = fields.Datetime(string="آخر بصمة مباشرة", readonly=True)
+    occupancy_count = fields.Integer(string="الحضور الحالي", compute='_compute_occupancy_count',
+                                     help="عدد الأعضاء الذين سجلوا دخولاً اليوم دون تسجيل خروج")
+    last_session_timing = fields.Text(string="توقيت آخر جلسة", readonly=True,
+                                      help="زمن كل عملية في آخر جلسة عمل مع الجهاز، مرتبة من الأبطأ")
+    last_session_date = fields.Datetime(string="تاريخ آخر جلسة", readonly=True)
+    strict_verification = fields.Boolean(string="تحقق كامل بعد الكتابة", default=False, tracking=True,
+                                         help="إعادة قراءة جدول المستخدمين كاملاً بعد التفعيل للتأكد من وجود المستخدمين، "
+                                              "بدلاً من الاعتماد على تأكيد الجهاز لكل عملية كتابة (أبطأ في الأجهزة الكبيرة)")
+    user_cache_ttl = fields.Integer('صلاحية ذاكرة المستخدمين (ثانية)', default=300, tracking=True,
+                                    help="مدة الاحتفاظ بجدول مستخدمي الجهاز في ذاكرة كل عملية، صفر لتعطيل الذاكرة المؤقتة. "
+                                         "قبل استخدام الجدول المحفوظ تتم مقارنة عدد مستخدمي الجهاز به، فأي إضافة أو حذف "
+                                         "من عملية أخرى أو يدويًا يؤدي إلى قراءة الجدول من جديد. المطابقة الكاملة تقرأ الجدول دائمًا")
+    
+    # الحقول التي يؤدي تغييرها إلى إلغاء جدول المستخدمين المحفوظ
+    _USER_CACHE_FIELDS = ('ip_address', 'port', 'protocol', 'effective_protocol', 'password', 'user_cache_ttl')
+    
+    def write(self, vals):
+        res = super(ZKDevice, self).write(vals)
+        if any(field in vals for field in self._USER_CACHE_FIELDS):
+            self.invalidate_user_cache()
+        return res
+    
+    def _compute_device_user_count(self):
+        groups = self.env['zk.device.user']._read_group(
+            [('device_id', 'in', self.ids), ('enabled', '=', True)], groupby=['device_id'], aggregates=['__count'])
+        counts = {device.id: count for device, count in groups}
+        for device in self:
+            device.device_user_count = counts.get(device.id, 0)
+    
+    def action_view_device_users(self):
+        """عرض نسخة جدول مستخدمي الجهاز المحفوظة دون الاتصال به"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('مستخدمو جهاز %s') % self.name,
+            'res_model': 'zk.device.user',
+            'view_mode': 'list',
+            'domain': [('device_id', '=', self.id)],
+            'context': {'search_default_present': 1},
+        }
+    
+    def _get_adaptive_timeouts(self, profile=None):
+        """مهلة كل عملية حسب أزمنة الجهاز المسجلة (أو ملف الأزمنة profile): قاموس {العملية: ثانية}"""
+        self.ensure_one()
+        ceiling = max(self.adaptive_max_timeout or DEFAULT_ADAPTIVE_MAX_TIMEOUT, ADAPTIVE_MIN_TIMEOUT)
+        return derive_timeouts(self.latency_profile if profile is None else profile, ADAPTIVE_MIN_TIMEOUT, ceiling)
+    
+    @api.depends('latency_profile', 'adaptive_max_timeout')
+    def _compute_adaptive_timeout_summary(self):
+        for device in self:
+            timeouts = device._get_adaptive_timeouts()
+            device.adaptive_timeout_summary = '\n'.join(
+                '%s: %.1f ث' % (operation, value) for operation, value in sorted(timeouts.items())
+            ) or False
+    
+    def action_reset_latency_profile(self):
+        """مسح أزمنة العمليات المسجلة لإعادة تعلم المهلات (مثلاً بعد تغيير الشبكة)"""
+        self.write({'latency_profile': False})
+        for device in self:
+            pending_samples.clear(device.id)
+        return True
+    
+    def _compute_occupancy_count(self):
+        """عدد الأعضاء الذين آخر حركة لهم اليوم على الجهاز هي دخول"""
+        today_start = datetime.combine(fields.Date.context_today(self), datetime.min.time())
+        attendances = self.env['zk.attendance'].search_read([
+            ('device_id', 'in', self.ids),
+            ('timestamp', '>=', today_start),
+            ('access_denied', '=', False),
+        ], ['device_id', 'user_id', 'punch'], order='timestamp asc')
+        last_punch = defaultdict(dict)
+        for att in attendances:
+            last_punch[att['device_id'][0]][att['user_id']] = att['punch']
+        for device in self:
+            device.occupancy_count = len([p for p in last_punch[device.id].values() if p != 1])
+    
+    @api.model
+    def _tz_get(self):
+        return [(tz, tz) for tz in sorted(all_timezones)]
+    
+    def _user_cache_key(self):
+        """مفتاح جدول مستخدمي الجهاز في الذاكرة المؤقتة"""
+        self.ensure_one()
+        return (self.env.cr.dbname, self.id)
+    
+    def invalidate_user_cache(self):
+        """إلغاء جدول المستخدمين المحفوظ مؤقتًا للأجهزة المحددة"""
+        for device in self:
+            user_table_cache.invalidate(device._user_cache_key())
+        return True
     
-    def _get_zk_connection(self):
-        """إنشاء اتصال مع جهاز البصمة"""
+    def action_invalidate_user_cache(self):
+        """زر لإلغاء الذاكرة المؤقتة يدويًا (مثلاً بعد تعديل المستخدمين مباشرة على الجهاز)"""
+        self.invalidate_user_cache()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('تم'),
+                'message': _('تم مسح جدول المستخدمين المحفوظ مؤقتًا'),
+                'type': 'success',
+            }
+        }
+    
+    def _get_transport(self):
+        """البروتوكول الفعلي للاتصال: المحدد يدويًا أو المختار بالقياس في الوضع التلقائي"""
+        self.ensure_one()
+        if self.protocol == 'auto':
+            return self.effective_protocol or 'tcp'
+        return self.protocol
+    
+    def _get_zk_connection(self, timeout=None, protocol=None):
+        """إنشاء اتصال مع جهاز البصمة
+        
+        timeout: مهلة بديلة عن مهلة الجهاز (مثل مهلة الفحص القصيرة)
+        protocol: بروتوكول بديل عن بروتوكول الجهاز (لقياس سرعة البروتوكولين)
+        """
         self.ensure_one()
         
         _logger.info("محاولة إنشاء اتصال مع جهاز %s على %s:%s", 
                    self.name, self.ip_address, self.port)
         
         force_udp = False
-        if self.protocol == 'udp':
+        if (protocol or self._get_transport()) == 'udp':
             force_udp = True
             _logger.info("استخدام بروتوكول UDP")
         else:
@@ -64,8 +582,9 @@ class ZKDevice(models.Model):
         if isinstance(password, str) and password.isdigit():
             password = int(password)
         
-        # التأكد من الطرف الزمني
-        timeout = self.time_out or 5
+        # التأكد من الطرف الزمني (المهلة الممررة صراحة مثل مهلة الفحص لها الأولوية على الوضع التكيفي)
+        explicit_timeout = bool(timeout)
+        timeout = timeout or self.time_out or 5
         
         _logger.info("إنشاء اتصال ZK مع الإعدادات: IP=%s, Port=%s, Timeout=%s, Force UDP=%s", 
                    ip_address, self.port, timeout, force_udp)
@@ -74,7 +593,14 @@ class ZKDevice(models.Model):
             # إنشاء كائن ZK
             zk = ZK(ip_address, port=self.port, timeout=timeout, 
                   password=password, force_udp=force_udp, ommit_ping=self.ommit_ping)
-            return zk
+            # قياس زمن كل عملية على الجهاز، مع مهلة لكل عملية في الوضع التكيفي
+            if self.timeout_mode == 'adaptive' and not explicit_timeout:
+                if supports_socket_timeout(zk):
+                    timeouts = self._get_adaptive_timeouts()
+                    _logger.info("المهلات التكيفية لجهاز %s: %s", self.name, timeouts)
+                    return instrument(zk, self.name, timeouts=timeouts, default_timeout=timeout)
+                _logger.warning("إصدار pyzk المثبت لا يدعم تغيير المهلة، يستخدم جهاز %s المهلة الثابتة", self.name)
+            return instrument(zk, self.name)
         except Exception as e:
             _logger.error("خطأ في إنشاء اتصال ZK: %s", str(e))
             raise
@@ -83,6 +609,9 @@ class ZKDevice(models.Model):
         """اختبار الاتصال بجهاز البصمة"""
         self.ensure_one()
         conn = None
+        # في الوضع التلقائي يتم اختيار البروتوكول بالقياس قبل الاختبار
+        if self.protocol == 'auto':
+            self._measure_transports()
         zk = self._get_zk_connection()
         
         try:
@@ -174,132 +703,23 @@ class ZKDevice(models.Model):
         _logger.info("محاولة تفعيل مستخدم على جهاز %s (الآيبي: %s - المنفذ: %s)",
                     self.name, self.ip_address, self.port)
         
-        # التحقق من نوع المعامل الممرر
-        if isinstance(partner_or_id, str):
-            # تم تمرير معرف البصمة فقط (نص)
-            user_id = partner_or_id
-            _logger.info("تم تمرير معرف البصمة كنص: %s", user_id)
-            # البحث عن الشريك بناءً على معرف البصمة
-            partner = self.env['res.partner'].search([
-                '|',
-                ('zk_biometric_id', '=', user_id),
-                ('fingerprint_id', '=', user_id)
-            ], limit=1)
-            if not partner:
-                _logger.warning("لم يتم العثور على شريك بمعرف البصمة %s", user_id)
-                # نحاول تفعيل المستخدم مباشرة باستخدام المعرف
-        else:
-            # تم تمرير كائن شريك كامل
-            partner = partner_or_id
-            _logger.info("تم تمرير كائن شريك: %s (الهوية: %s)", partner.name, partner.id)
-            # التحقق من وجود معرف بصمة
-            if not partner.fingerprint_id and not partner.zk_biometric_id:
-                _logger.warning("لا يمكن تفعيل المستخدم %s (الهوية: %s) - لا يوجد معرف بصمة", 
-                            partner.name, partner.id)
-                return False
-            user_id = partner.fingerprint_id or partner.zk_biometric_id
-            _logger.info("معرف البصمة المستخرج من الشريك: %s", user_id)
+        partner, user_id = self._resolve_partner_or_id(partner_or_id)
+        if not user_id:
+            return False
         
-        conn = None
-        zk = self._get_zk_connection()
-        _logger.info("تم تهيئة الاتصال بجهاز ZK: %s", self.name)
+        name = partner.name if partner and partner.name else "User " + str(user_id)
+        results = self._push_user_changes({user_id: name}, set())
+        success = results[self.id].get(user_id, False)
         
-        try:
-            _logger.info("محاولة الاتصال بجهاز ZK على %s:%s", self.ip_address, self.port)
-            conn = zk.connect()
-            
-            if not conn:
-                _logger.error("فشل الاتصال بجهاز %s (الآيبي: %s - المنفذ: %s) عند محاولة تفعيل المستخدم", 
-                              self.name, self.ip_address, self.port)
-                return False
-            
-            _logger.info("تم الاتصال بنجاح بجهاز %s", self.name)
-                
-            # تفعيل المستخدم - إجراء جديد باستخدام منهجية مختلفة
-            _logger.info("محاولة تفعيل المستخدم باستخدام الأمر المباشر للجهاز ZK")
-            
-            # تعطيل الجهاز للقراءة/الكتابة
-            _logger.info("تعطيل الجهاز مؤقتًا للكتابة")
-            conn.disable_device()
-            
-            try:
-                # التحقق من وجود المستخدم في الجهاز
-                _logger.info("التحقق من وجود المستخدم بمعرف %s", user_id)
-                users = conn.get_users()
-                _logger.info("تم العثور على %d مستخدم في الجهاز", len(users) if users else 0)
-                
-                # محاولة تفعيل المستخدم باستخدام طريقة جديدة
-                from zk.user import User
-                
-                # التحقق من وجود المستخدم في الجهاز
-                user_exists = False
-                for user in users:
-                    if str(user.user_id) == str(user_id):
-                        user_exists = True
-                        _logger.info("وجدنا المستخدم المطلوب في الجهاز: %s", user.user_id)
-                        # أزل المستخدم ثم أعد إنشاءه كنشط
-                        _logger.info("أزل المستخدم القديم لإعادة إنشاءه")
-                        conn.delete_user(user_id)
-                        break
-                
-                # إنشاء المستخدم من جديد
-                name = ""
-                if partner and partner.name:
-                    name = partner.name
-                elif not name:
-                    name = "User " + str(user_id)
-                    
-                _logger.info("إنشاء مستخدم جديد: ID=%s, الاسم=%s, نشط=True", user_id, name)
-                
-                # إنشاء مستخدم جديد بشكل مباشر
-                new_user = User(user_id=str(user_id), name=name, privilege=0, password='', group_id='', user_id_card='', card=0)
-                new_user.enabled = True
-                
-                # إرسال المستخدم إلى الجهاز
-                _logger.info("حفظ المستخدم الجديد في الجهاز")
-                conn.set_user(new_user)
-                
-                # التحقق من النجاح
-                _logger.info("التحقق من نجاح العملية")
-                users_after = conn.get_users()
-                success = False
-                
-                for user in users_after:
-                    if str(user.user_id) == str(user_id) and user.enabled:
-                        _logger.info("تم العثور على المستخدم وهو نشط الآن")
-                        success = True
-                        break
-                
-                if success:
-                    _logger.info("تم تفعيل المستخدم بنجاح")
-                else:
-                    _logger.warning("لم يتم العثور على المستخدم أو لم يتم تفعيله بعد محاولة التفعيل")
-                
-            except Exception as ex:
-                _logger.error("خطأ أثناء محاولة تفعيل المستخدم: %s", str(ex))
-                success = False
-                
-            _logger.info("إعادة تفعيل الجهاز")
-            conn.enable_device()
-            
-            if success:
-                _logger.info("تم تفعيل المستخدم %s (%s) في جهاز %s بنجاح", 
-                            partner.name if partner else user_id, user_id, self.name)
-                # تحديث حالة الشريك إذا كان موجودًا
-                if partner:
-                    partner.write({'fingerprint_active': True})
-                return True
-            else:
-                _logger.error("فشل تفعيل المستخدم %s في جهاز %s", user_id, self.name)
-                return False
-                
-        except Exception as e:
-            _logger.error("استثناء عند محاولة تفعيل المستخدم %s (%s) في جهاز %s: %s", 
-                         partner.name, user_id, self.name, str(e))
-            return False
-        finally:
-            if conn:
-                conn.disconnect()
+        if success:
+            _logger.info("تم تفعيل المستخدم %s (%s) في جهاز %s بنجاح", 
+                        partner.name if partner else user_id, user_id, self.name)
+            # تحديث حالة الشريك إذا كان موجودًا
+            if partner:
+                partner.write({'fingerprint_active': True})
+            return True
+        _logger.error("فشل تفعيل المستخدم %s في جهاز %s", user_id, self.name)
+        return False
     
     def disable_user(self, partner_or_id):
         """تعطيل مستخدم في جهاز البصمة
@@ -311,11 +731,28 @@ class ZKDevice(models.Model):
         _logger.info("محاولة تعطيل مستخدم على جهاز %s (الآيبي: %s - المنفذ: %s)",
                     self.name, self.ip_address, self.port)
         
-        # التحقق من نوع المعامل الممرر
+        partner, user_id = self._resolve_partner_or_id(partner_or_id)
+        if not user_id:
+            return False
+        
+        results = self._push_user_changes({}, {user_id})
+        success = results[self.id].get(user_id, False)
+        
+        if success:
+            _logger.info("تم تعطيل المستخدم %s (%s) في جهاز %s بنجاح", 
+                        partner.name if partner else user_id, user_id, self.name)
+            # تحديث حالة الشريك إذا كان موجودًا
+            if partner:
+                partner.write({'fingerprint_active': False})
+            return True
+        _logger.error("فشل تعطيل المستخدم %s في جهاز %s", user_id, self.name)
+        return False
+    
+    def _resolve_partner_or_id(self, partner_or_id):
+        """استخراج الشريك ومعرف البصمة من المعامل الممرر (كائن شريك أو معرف بصمة نصي)"""
         if isinstance(partner_or_id, str):
             # تم تمرير معرف البصمة فقط (نص)
             user_id = partner_or_id
-            _logger.info("تم تمرير معرف البصمة كنص: %s", user_id)
             # البحث عن الشريك بناءً على معرف البصمة
             partner = self.env['res.partner'].search([
                 '|',
@@ -323,94 +760,752 @@ class ZKDevice(models.Model):
                 ('fingerprint_id', '=', user_id)
             ], limit=1)
             if not partner:
+                # نحاول تنفيذ العملية مباشرة باستخدام المعرف
                 _logger.warning("لم يتم العثور على شريك بمعرف البصمة %s", user_id)
-                # سنحاول تعطيل المستخدم باستخدام المعرف مباشرة
-        else:
-            # تم تمرير كائن شريك كامل
-            partner = partner_or_id
-            _logger.info("تم تمرير كائن شريك: %s (الهوية: %s)", partner.name, partner.id)
-            # التحقق من وجود معرف بصمة
-            if not partner.fingerprint_id and not partner.zk_biometric_id:
+            return partner, user_id
+        
+        # تم تمرير كائن شريك كامل
+        partner = partner_or_id
+        user_id = partner._get_zk_user_id()
+        if not user_id:
+            _logger.warning("لا يمكن مزامنة المستخدم %s (الهوية: %s) - لا يوجد معرف بصمة", 
+                        partner.name, partner.id)
+        return partner, user_id
+    
+    def enable_users(self, partners):
+        """تفعيل مجموعة من الشركاء على كل جهاز في self
+        
+        تتم جميع التغييرات الخاصة بجهاز واحد داخل جلسة اتصال واحدة مع قراءة واحدة لجدول المستخدمين.
+        يعيد قاموس {معرف الجهاز: الشركاء الذين تم تفعيلهم بنجاح}
+        """
+        results = self._push_partner_states(enable_partners=partners)
+        return {device_id: result['enabled'] for device_id, result in results.items()}
+    
+    def disable_users(self, partners):
+        """تعطيل مجموعة من الشركاء على كل جهاز في self
+        
+        تتم جميع التغييرات الخاصة بجهاز واحد داخل جلسة اتصال واحدة مع قراءة واحدة لجدول المستخدمين.
+        يعيد قاموس {معرف الجهاز: الشركاء الذين تم تعطيلهم بنجاح}
+        """
+        results = self._push_partner_states(disable_partners=partners)
+        return {device_id: result['disabled'] for device_id, result in results.items()}
+    
+    def _push_partner_states(self, enable_partners=None, disable_partners=None, refresh_templates=False,
+                             replay_failures=True):
+        """دفع حالة مجموعة من الشركاء إلى أجهزة self مع تحديث حقل fingerprint_active دفعة واحدة
+        
+        refresh_templates: إعادة كتابة القوالب المخزنة حتى للمستخدمين الموجودين في الأجهزة
+        replay_failures: تسجيل العمليات الفاشلة أو المتخطاة (جهاز متوقف) في طابور المزامنة لإعادتها لاحقًا
+        يعيد قاموس {معرف الجهاز: {'enabled': شركاء, 'disabled': شركاء, 'failed': شركاء}}
+        """
+        Partner = self.env['res.partner']
+        enable_partners = enable_partners or Partner
+        disable_partners = disable_partners or Partner
+        
+        # ربط كل معرف بصمة بالشركاء الذين يحملونه
+        partners_by_user_id = defaultdict(lambda: Partner)
+        to_enable = {}
+        to_disable = set()
+        for partner in enable_partners:
+            user_id = partner._get_zk_user_id()
+            if not user_id:
+                _logger.warning("لا يمكن تفعيل المستخدم %s (الهوية: %s) - لا يوجد معرف بصمة", 
+                            partner.name, partner.id)
+                continue
+            to_enable[user_id] = partner.name or "User " + user_id
+            partners_by_user_id[user_id] |= partner
+        for partner in disable_partners:
+            user_id = partner._get_zk_user_id()
+            if not user_id:
                 _logger.warning("لا يمكن تعطيل المستخدم %s (الهوية: %s) - لا يوجد معرف بصمة", 
                             partner.name, partner.id)
-                return False
-            user_id = partner.fingerprint_id or partner.zk_biometric_id
-            _logger.info("معرف البصمة المستخرج من الشريك: %s", user_id)
+                continue
+            to_disable.add(user_id)
+            partners_by_user_id[user_id] |= partner
         
-        conn = None
-        zk = self._get_zk_connection()
-        _logger.info("تم تهيئة الاتصال بجهاز ZK: %s", self.name)
+        # التفعيل يقتصر على أجهزة مجموعات العضو، أما السحب فيرسل لجميع الأجهزة لأن العضو قد يكون
+        # ما زال مسجلاً في جهاز من تخصيص سابق (ولا توجد كتابة على جهاز لا يحتوي العضو)
+        device_ids_by_partner = self._get_partner_device_ids(enable_partners)
+        enable_device_ids = defaultdict(set)
+        for partner in enable_partners:
+            user_id = partner._get_zk_user_id()
+            if user_id:
+                enable_device_ids[user_id] |= device_ids_by_partner[partner.id]
+        
+        # قوالب البصمات المخزنة لاستعادتها عند التفعيل دون إعادة التسجيل
+        templates = self.env['zk.fingerprint.template']._get_templates_by_user_id(enable_partners)
+        raw_results = self._push_user_changes(to_enable, to_disable, templates=templates,
+                                              refresh_templates=refresh_templates,
+                                              enable_device_ids=enable_device_ids)
+        
+        results = {}
+        enabled_partners = Partner
+        disabled_partners = Partner
+        for device_id, user_results in raw_results.items():
+            device_result = {'enabled': Partner, 'disabled': Partner, 'failed': Partner}
+            for user_id, success in user_results.items():
+                if not success:
+                    device_result['failed'] |= partners_by_user_id[user_id]
+                elif user_id in to_enable:
+                    device_result['enabled'] |= partners_by_user_id[user_id]
+                else:
+                    device_result['disabled'] |= partners_by_user_id[user_id]
+            enabled_partners |= device_result['enabled']
+            disabled_partners |= device_result['disabled']
+            results[device_id] = device_result
+        
+        # تحديث حالة الشركاء بعملية كتابة واحدة لكل حالة، مع تجاهل من هم عليها بالفعل
+        enabled_partners.filtered(lambda p: not p.fingerprint_active).write({'fingerprint_active': True})
+        disabled_partners.filtered('fingerprint_active').write({'fingerprint_active': False})
+        
+        if replay_failures:
+            failed_partners = Partner
+            for device_result in results.values():
+                failed_partners |= device_result['failed']
+            if failed_partners:
+                SyncJob = self.env['zk.sync.job']
+                SyncJob._enqueue(failed_partners & enable_partners, 'enable')
+                SyncJob._enqueue(failed_partners & disable_partners, 'disable')
+        return results
+    
+    def _push_user_changes(self, to_enable, to_disable, templates=None, refresh_templates=False,
+                           enable_device_ids=None):
+        """تطبيق التغييرات على كل جهاز في self بجلسة واحدة لكل جهاز
+        
+        to_enable: قاموس {معرف البصمة: الاسم} للمستخدمين المطلوب تفعيلهم
+        to_disable: مجموعة معرفات البصمة للمستخدمين المطلوب تعطيلهم
+        templates: قوالب البصمات المخزنة لكل معرف بصمة (اختياري)
+        refresh_templates: إعادة كتابة القوالب للمستخدمين الموجودين في الجهاز
+        enable_device_ids: قاموس {معرف البصمة: مجموعة معرفات الأجهزة} لحصر التفعيل في الأجهزة المخصصة
+        للعضو، وبدونه يتم التفعيل على جميع أجهزة self
+        الأجهزة التي لا يوجد لها أي تغيير لا يتم الاتصال بها.
+        يعيد قاموس {معرف الجهاز: {معرف البصمة: نجاح العملية}}
+        """
+        changes = {}
+        for device in self:
+            device_enable = to_enable
+            if enable_device_ids is not None:
+                device_enable = {user_id: name for user_id, name in to_enable.items()
+                                 if device.id in enable_device_ids.get(user_id, ())}
+            changes[device.id] = (device_enable, to_disable)
+        results = {device_id: {} for device_id, (enable, disable) in changes.items() if not enable and not disable}
+        devices = self.filtered(lambda d: d.id not in results)
+        if not devices:
+            return results
+        
+        cache_params = {device.id: (device._user_cache_key(), device.user_cache_ttl) for device in devices}
+        strict_ids = set(devices.filtered('strict_verification').ids)
+        
+        def job(device_id, zk):
+            cache_key, ttl = cache_params[device_id]
+            device_enable, device_disable = changes[device_id]
+            with _zk_session(zk) as conn:
+                return _apply_user_changes(conn, device_enable, device_disable, cache_key=cache_key, ttl=ttl,
+                                           templates=templates, strict=device_id in strict_ids,
+                                           refresh_templates=refresh_templates)
+        
+        _logger.info("تطبيق %d تفعيل و%d تعطيل على %d جهاز",
+                    len(to_enable), len(to_disable), len(devices))
+        for device_id, (success, result) in devices._fan_out(job).items():
+            if not success:
+                user_table_cache.invalidate(cache_params[device_id][0])
+                device_enable, device_disable = changes[device_id]
+                result = dict.fromkeys(list(device_enable) + list(device_disable), False)
+            results[device_id] = result
+        return results
+    
+    def _get_partner_device_ids(self, partners):
+        """الأجهزة من self التي يحتاجها كل شريك حسب مجموعات الأجهزة المخصصة له
         
+        الشريك بدون مجموعات يحتاج جميع الأجهزة، والجهاز بدون مجموعة يقبل جميع الأعضاء.
+        يعيد قاموس {معرف الشريك: مجموعة معرفات الأجهزة}
+        """
+        groups_by_partner = partners._get_zk_device_groups()
+        all_ids = set(self.ids)
+        ungrouped_ids = set(self.filtered(lambda d: not d.device_group_id).ids)
+        ids_by_group = defaultdict(set)
+        for device in self.filtered('device_group_id'):
+            ids_by_group[device.device_group_id.id].add(device.id)
+        result = {}
+        for partner in partners:
+            groups = groups_by_partner.get(partner.id)
+            if not groups:
+                result[partner.id] = all_ids
+                continue
+            device_ids = set(ungrouped_ids)
+            for group in groups:
+                device_ids |= ids_by_group[group.id]
+            result[partner.id] = device_ids
+        return result
+    
+    def _get_desired_partners(self, partners):
+        """الشركاء من partners الذين يجب أن يكونوا موجودين في هذا الجهاز: اشتراك نشط والجهاز مخصص لهم
+        
+        هذه هي الحالة المطلوبة التي تطبقها المطابقة، ويقارن بها اختلاف نسخة جدول المستخدمين.
+        """
+        self.ensure_one()
+        device_ids_by_partner = self._get_partner_device_ids(partners)
+        return partners.filtered(lambda p: p.has_active_subscription and self.id in device_ids_by_partner[p.id])
+    
+    @api.model
+    def _get_max_workers(self):
+        """الحد الأقصى لعدد الأجهزة التي تتم معالجتها بالتوازي (1 يعني التنفيذ المتسلسل)"""
+        value = self.env['ir.config_parameter'].sudo().get_param(
+            'zk_subscription_integration.max_workers', DEFAULT_MAX_WORKERS)
         try:
-            _logger.info("محاولة الاتصال بجهاز ZK على %s:%s", self.ip_address, self.port)
-            conn = zk.connect()
-            
-            if not conn:
-                _logger.error("فشل الاتصال بجهاز %s (الآيبي: %s - المنفذ: %s) عند محاولة تعطيل المستخدم", 
-                              self.name, self.ip_address, self.port)
-                return False
-            
-            _logger.info("تم الاتصال بنجاح بجهاز %s", self.name)
-            
-            # محاولة تعطيل المستخدم بشكل مباشر
-            _logger.info("محاولة تعطيل المستخدم باستخدام الأمر المباشر للجهاز ZK")
-            
-            # نهج مباشر: إما حذف المستخدم أو تعطيله
-            _logger.info("تعطيل الجهاز مؤقتًا للكتابة")
-            conn.disable_device()
-            
+            return max(1, int(value))
+        except (TypeError, ValueError):
+            return DEFAULT_MAX_WORKERS
+    
+    def _breaker_may_retry(self, now):
+        """فحص للقراءة فقط: الجهاز غير متوقف بقاطع الدائرة أو انتهت مدة إيقافه (دون حجز الاتصال التجريبي)"""
+        self.ensure_one()
+        return self.breaker_state == 'closed' or not self.breaker_open_until or self.breaker_open_until <= now
+    
+    def _breaker_allows(self, now):
+        """هل يسمح قاطع الدائرة بالاتصال بالجهاز الآن؟
+        
+        بعد انتهاء مدة الإيقاف يسمح باتصال تجريبي واحد فقط: يتم حجز الانتقال إلى حالة الاختبار بتحديث ذري
+        مع SKIP LOCKED، ومن لا يحصل عليه يعامل الجهاز كمتوقف حتى تسجل نتيجة الاختبار.
+        الحجز ينتهي بعد BREAKER_TRIAL_SECONDS حتى لا يبقى الجهاز قيد الاختبار إذا توقف المتصل قبل تسجيل النتيجة.
+        """
+        self.ensure_one()
+        if self.breaker_state == 'closed':
+            return True
+        if self.breaker_open_until and self.breaker_open_until > now:
+            return False
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute("""
+                    UPDATE zk_device
+                       SET breaker_state = 'half_open', breaker_open_until = %s
+                     WHERE id = (
+                            SELECT id FROM zk_device
+                             WHERE id = %s AND breaker_state != 'closed'
+                               AND (breaker_open_until IS NULL OR breaker_open_until <= %s)
+                               FOR UPDATE SKIP LOCKED)
+                 RETURNING id
+                """, (now + timedelta(seconds=BREAKER_TRIAL_SECONDS), self.id, now))
+                claimed = bool(self.env.cr.fetchone())
+        except errors.SerializationFailure:
+            # متصل آخر حجز الاختبار وأكده بعد بداية هذه المعاملة
+            claimed = False
+        self.invalidate_recordset(['breaker_state', 'breaker_open_until'])
+        if claimed:
+            _logger.info("اتصال تجريبي بجهاز %s بعد انتهاء مدة الإيقاف", self.name)
+        return claimed
+    
+    def _breaker_record(self, outcomes):
+        """تحديث قاطع الدائرة لكل جهاز حسب نتيجة جلسته
+        
+        outcomes: قاموس {معرف الجهاز: نجاح الجلسة}
+        """
+        now = fields.Datetime.now()
+        for device in self.browse(list(outcomes)):
+            if outcomes[device.id]:
+                if device.breaker_state != 'closed' or device.breaker_failures:
+                    if device.breaker_state != 'closed':
+                        _logger.info("عاد جهاز %s للعمل، تم إغلاق قاطع الدائرة", device.name)
+                    device.write({'breaker_state': 'closed', 'breaker_failures': 0, 'breaker_trips': 0,
+                                  'breaker_open_until': False})
+                continue
+            failures = device.breaker_failures + 1
+            if device.breaker_state == 'half_open' or failures >= BREAKER_FAILURE_THRESHOLD:
+                trips = device.breaker_trips + 1
+                delay = min(BREAKER_BASE_DELAY * 2 ** (trips - 1), BREAKER_MAX_DELAY)
+                _logger.warning("إيقاف الاتصال بجهاز %s لمدة %d ثانية بعد %d فشل متتالٍ",
+                                device.name, delay, failures)
+                device.write({
+                    'breaker_state': 'open',
+                    'breaker_failures': failures,
+                    'breaker_trips': trips,
+                    'breaker_open_until': now + timedelta(seconds=delay),
+                })
+            else:
+                device.write({'breaker_failures': failures})
+    
+    def action_reset_breaker(self):
+        """إعادة تشغيل الاتصال بالجهاز يدويًا قبل انتهاء مدة الإيقاف"""
+        self.write({'breaker_state': 'closed', 'breaker_failures': 0, 'breaker_trips': 0,
+                    'breaker_open_until': False})
+        return True
+    
+    def _fan_out(self, job, timeout=None, use_breaker=True, protocol=None, bookkeeping=True):
+        """تنفيذ job(device_id, zk) على كل جهاز في self بالتوازي عبر مجموعة عمال محدودة
+        
+        يتم إنشاء كائن الاتصال لكل جهاز في الخيط الرئيسي، بينما يتم تنفيذ عمليات الشبكة فقط
+        داخل العمال دون أي وصول إلى قاعدة البيانات، لذلك يحدد أبطأ جهاز الزمن الكلي وليس مجموع الأجهزة.
+        الأجهزة المتوقفة بقاطع الدائرة تفشل فورًا بالاستثناء DeviceUnavailable دون أي اتصال.
+        use_breaker: تطبيق قاطع الدائرة وتحديثه بنتيجة الجلسات
+        protocol: فرض بروتوكول معين بدلاً من بروتوكول كل جهاز
+        bookkeeping: تسجيل نتائج الجلسات (التوقيت ونسخة الجدول والقوالب وقاطع الدائرة)، ويتم تعطيله
+        لجلسات القياس حتى لا تختلط توقيتات البروتوكول المفروض بملف أداء الجهاز
+        يعيد قاموس {معرف الجهاز: (نجاح, النتيجة أو الاستثناء)}
+        """
+        results = {}
+        connections = {}
+        names = {}
+        now = fields.Datetime.now()
+        for device in self:
+            names[device.id] = device.name
+            if use_breaker and not device._breaker_allows(now):
+                results[device.id] = (False, DeviceUnavailable(
+                    _('الجهاز %s متوقف مؤقتًا حتى %s بعد فشل متكرر') % (device.name, device.breaker_open_until)))
+                continue
             try:
-                # طريقة 1: محاولة حذف المستخدم من الجهاز
-                _logger.info("محاولة حذف المستخدم بمعرف %s من الجهاز", user_id)
-                success = conn.delete_user(user_id=str(user_id))
-                _logger.info("نتيجة محاولة الحذف: %s", success)
-                
-                # طريقة 2: إذا لم ينجح الحذف، نحاول تعطيل المستخدم
-                if not success:
-                    _logger.info("التحقق من وجود المستخدم بمعرف %s", user_id)
-                    users = conn.get_users()
-                    _logger.info("تم العثور على %d مستخدم في الجهاز", len(users) if users else 0)
-                    
-                    # التحقق من وجود المستخدم ومحاولة تعديله
-                    from zk.user import User
-                    for user in users:
-                        if str(user.user_id) == str(user_id):
-                            _logger.info("وجدنا المستخدم المطلوب وسنقوم بتعطيله: %s", user.user_id)
-                            # إنشاء نسخة معدلة من المستخدم وتعطيلها
-                            user.enabled = False
-                            conn.set_user(user)
-                            success = True
-                            _logger.info("تم تعديل حالة المستخدم إلى معطل")
-                            break
-                
-                if not success:
-                    _logger.warning("لم يتم العثور على المستخدم لتعطيله")
-                
-            except Exception as ex:
-                _logger.error("خطأ أثناء محاولة تعطيل المستخدم: %s", str(ex))
-                success = False
-            
-            _logger.info("إعادة تفعيل الجهاز")
-            conn.enable_device()
-            
-            if success:
-                _logger.info("تم تعطيل المستخدم %s (%s) في جهاز %s بنجاح", 
-                            partner.name if partner else user_id, user_id, self.name)
-                # تحديث حالة الشريك إذا كان موجودًا
-                if partner:
-                    partner.write({'fingerprint_active': False})
+                connections[device.id] = device._get_zk_connection(timeout=timeout, protocol=protocol)
+            except Exception as e:
+                results[device.id] = (False, e)
+        
+        def run(device_id, zk):
+            try:
+                return True, job(device_id, zk)
+            except Exception as e:
+                _logger.error("فشلت الجلسة مع جهاز %s: %s", names[device_id], str(e))
+                return False, e
+        
+        max_workers = min(self._get_max_workers(), len(connections))
+        if max_workers <= 1:
+            for device_id, zk in connections.items():
+                results[device_id] = run(device_id, zk)
+            if bookkeeping:
+                self.sudo()._after_fan_out(connections, results, use_breaker)
+            return results
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='zk_device') as executor:
+            futures = {
+                executor.submit(run, device_id, zk): device_id
+                for device_id, zk in connections.items()
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        if bookkeeping:
+            self.sudo()._after_fan_out(connections, results, use_breaker)
+        return results
+    
+    def _after_fan_out(self, connections, results, use_breaker):
+        """تحديثات قاعدة البيانات في الخيط الرئيسي بعد انتهاء جلسات الأجهزة
+        
+        يتم استدعاؤها بصلاحيات المدير (sudo) لأنها سجلات تقنية (التوقيت ونسخة الجدول والقوالب وقاطع الدائرة)
+        يجب تحديثها أيضًا عندما ينفذ العملية مستخدم مبيعات لديه صلاحية القراءة فقط على هذه النماذج.
+        """
+        self._record_session_timings(connections)
+        self._update_user_mirror(connections)
+        self._store_removed_templates(connections)
+        if use_breaker:
+            self._breaker_record({device_id: results[device_id][0] for device_id in connections})
+    
+    def _store_removed_templates(self, connections):
+        """حفظ قوالب المستخدمين الذين تم حذفهم في الجلسات في المخزن المركزي
+        
+        الحفظ بصلاحيات المدير، فالمستخدم قد حذف بالفعل من الجهاز ويجب ألا تضيع قوالبه إذا كان
+        المستخدم الحالي لا يملك صلاحية الكتابة على المخزن (مثل مستخدم المبيعات عند تعطيل عميل).
+        """
+        Template = self.env['zk.fingerprint.template'].sudo()
+        for device_id, zk in connections.items():
+            removed = getattr(zk, 'removed_templates', None)
+            if removed:
+                count = Template._store_fingers(removed, self.browse(device_id))
+                _logger.info("تم حفظ %d قالب بصمة للمستخدمين المحذوفين من جهاز %s", count, self.browse(device_id).name)
+    
+    def _update_user_mirror(self, connections):
+        """تحديث نسخة جداول المستخدمين في قاعدة البيانات بما قرئ أو كتب في جلسات الأجهزة
+        
+        connections: قاموس {معرف الجهاز: كائن ZK} بعد انتهاء الجلسات
+        """
+        DeviceUser = self.env['zk.device.user']
+        for device_id, zk in connections.items():
+            table = getattr(zk, 'mirror_table', None)
+            delta = getattr(zk, 'mirror_delta', None)
+            if table is not None:
+                DeviceUser._apply_snapshot(self.browse(device_id), table, full=True)
+            elif delta:
+                DeviceUser._apply_snapshot(self.browse(device_id), delta, full=False)
+            zk.mirror_table = None
+            zk.mirror_delta = None
+    
+    def _record_session_timings(self, connections):
+        """حفظ ملخص توقيت الجلسة على كل جهاز وتصدير القياسات إلى ملف إن كان مفعلاً
+        
+        connections: قاموس {معرف الجهاز: كائن ZK} بعد انتهاء الجلسات
+        جلسات الفحص (اتصال وقطع فقط) لا تستبدل ملخص آخر جلسة عمل.
+        أزمنة العمليات الناجحة تجمع في الذاكرة ولا تحفظ في latency_profile إلا عند تغير ملموس في المهلات
+        المشتقة أو بعد تجمع نافذة عينات كاملة، حتى لا يعاد كتابة سجل الجهاز بعد كل جلسة.
+        """
+        now = fields.Datetime.now()
+        for device_id, zk in connections.items():
+            timings = getattr(zk, 'operation_timings', None)
+            if not timings:
+                continue
+            device = self.browse(device_id)
+            vals = {}
+            pending = pending_samples.add(device_id, timings)
+            profile = record_samples(device.latency_profile, pending)
+            if (len([ok for _operation, _duration, ok in pending if ok]) >= MAX_SAMPLES
+                    or timeouts_changed(device._get_adaptive_timeouts(), device._get_adaptive_timeouts(profile))):
+                vals['latency_profile'] = profile
+                pending_samples.clear(device_id)
+            if not all(operation in ('connect', 'disconnect') for operation, _d, _ok in timings):
+                vals.update({
+                    'last_session_timing': summarize_timings(timings),
+                    'last_session_date': now,
+                })
+            if vals:
+                device.write(vals)
+        metrics_dir = self.env['ir.config_parameter'].sudo().get_param('zk_subscription_integration.metrics_dir')
+        if metrics_dir:
+            try:
+                device_metrics.write_textfile(metrics_dir)
+            except OSError as e:
+                _logger.warning("تعذر كتابة ملف القياسات في %s: %s", metrics_dir, str(e))
+    
+    def pull_templates(self):
+        """تنزيل قوالب البصمات من أجهزة self وحفظها في المخزن المركزي
+        
+        يتم تنزيل جدول المستخدمين وجميع القوالب في جلسة واحدة لكل جهاز.
+        يعيد عدد القوالب التي تم حفظها
+        """
+        def job(device_id, zk):
+            with _zk_session(zk) as conn:
+                users = conn.get_users()
+                _mirror_snapshot(conn, {str(user.user_id): user for user in users})
+                fingers = conn.get_templates()
+            user_ids = {user.uid: str(user.user_id) for user in users}
+            return [(user_ids.get(finger.uid), finger) for finger in fingers]
+        
+        Template = self.env['zk.fingerprint.template']
+        results = self._fan_out(job)
+        stored = 0
+        for device in self:
+            success, result = results[device.id]
+            if not success:
+                continue
+            fingers_by_user_id = defaultdict(list)
+            for user_id, finger in result:
+                if user_id:
+                    fingers_by_user_id[user_id].append(finger)
+            count = Template._store_fingers(fingers_by_user_id, device)
+            _logger.info("تم حفظ %d قالب بصمة من جهاز %s", count, device.name)
+            stored += count
+        return stored
+    
+    def action_pull_templates(self):
+        """زر لتنزيل قوالب البصمات من الجهاز إلى المخزن المركزي"""
+        count = self.pull_templates()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('تم التنزيل'),
+                'message': _('تم حفظ %s قالب بصمة في المخزن المركزي') % count,
+                'type': 'success',
+            }
+        }
+    
+    def export_snapshot(self):
+        """حفظ لقطة مضغوطة لجدول مستخدمي الجهاز وقوالبه كمرفق على الجهاز
+        
+        يتم تنزيل المستخدمين والقوالب في جلسة واحدة (قراءتان كاملتان للجدولين فقط).
+        يعيد المرفق الذي تم إنشاؤه
+        """
+        self.ensure_one()
+        
+        def job(device_id, zk):
+            with _zk_session(zk) as conn:
+                users = _read_user_table(conn, fresh=True)
+                fingers = conn.get_templates()
+            return list(users.values()), fingers, conn.user_packet_size
+        
+        success, result = self._fan_out(job)[self.id]
+        if not success:
+            raise UserError(_('تعذر قراءة جدول المستخدمين من جهاز %s: %s') % (self.name, str(result)))
+        users, fingers, packet_size = result
+        now = fields.Datetime.now()
+        data = dump_snapshot(users, fingers, {
+            'device': self.name,
+            'serial': self.device_serial or False,
+            'date': fields.Datetime.to_string(now),
+            'packet_size': int(packet_size),
+        })
+        attachment = self.env['ir.attachment'].create({
+            'name': 'zk_snapshot_%s_%s.json.gz' % (self.name, now.strftime('%Y%m%d_%H%M%S')),
+            'raw': data,
+            'mimetype': 'application/gzip',
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+        _logger.info("لقطة جهاز %s: %d مستخدم و%d قالب (%d بايت)",
+                     self.name, len(users), len(fingers), len(data))
+        return attachment
+    
+    def restore_snapshot(self, data, overwrite=False):
+        """كتابة لقطة على الجهاز في جلسة واحدة بذاكرات كتابة كبيرة بدلاً من مستخدم تلو الآخر
+        
+        المستخدمون يكتبون بأرقامهم الداخلية كما في اللقطة، ويستبدل أي مستخدم في الجهاز بنفس الرقم،
+        لذلك يتم رفض الاستعادة على جهاز غير فارغ إلا مع overwrite.
+        بعد الكتابة يتم قراءة الجدول مرة واحدة للتحقق وتحديث نسخة المستخدمين.
+        يعيد (عدد المستخدمين المكتوبين, عدد المستخدمين في الجهاز بعد الاستعادة, المستخدمون الذين تم استبدالهم)
+        """
+        self.ensure_one()
+        meta, user_templates = load_snapshot(data)
+        _logger.info("استعادة لقطة جهاز %s (%s) على جهاز %s: %d مستخدم",
+                     meta.get('device'), meta.get('date'), self.name, len(user_templates))
+        snapshot_uids = {user.uid for user, _fingers in user_templates}
+        
+        def job(device_id, zk):
+            with _zk_session(zk) as conn:
+                # حجم سجل المستخدم يحدد قبل أي كتابة، حتى في الجهاز الفارغ حيث لا يكشفه get_users
+                existing = detect_user_packet_size(conn, meta.get('packet_size'))
+                if existing and not overwrite:
+                    return None, existing
+                written = save_user_templates(conn, user_templates)
+                users = _read_user_table(conn, fresh=True)
+            return (written, len(users)), existing
+        
+        self.invalidate_user_cache()
+        success, result = self._fan_out(job)[self.id]
+        if not success:
+            raise UserError(_('فشلت استعادة اللقطة على جهاز %s: %s') % (self.name, str(result)))
+        counts, existing = result
+        if counts is None:
+            raise UserError(_('جهاز %s يحتوي على %s مستخدم، والاستعادة تستبدل المستخدمين الذين لهم نفس الأرقام الداخلية. '
+                              'فعّل خيار استبدال المستخدمين الحاليين للمتابعة.') % (self.name, len(existing)))
+        overwritten = [user for user in existing if user.uid in snapshot_uids]
+        if overwritten:
+            _logger.warning("الاستعادة على جهاز %s استبدلت %d مستخدم: %s", self.name, len(overwritten),
+                            ', '.join(str(user.user_id) for user in overwritten))
+        return counts[0], counts[1], overwritten
+    
+    def action_export_snapshot(self):
+        """زر لحفظ لقطة من الجهاز كمرفق يمكن استعادته على جهاز بديل"""
+        attachment = self.export_snapshot()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('تم حفظ اللقطة'),
+                'message': _('تم حفظ لقطة الجهاز في المرفق %s') % attachment.name,
+                'type': 'success',
+            }
+        }
+    
+    def action_open_restore_snapshot(self):
+        """فتح معالج استعادة لقطة على هذا الجهاز"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('استعادة لقطة'),
+            'res_model': 'zk.device.snapshot.restore',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {'default_device_id': self.id},
+        }
+    
+    def push_templates(self, partners):
+        """نشر قوالب البصمات المخزنة للشركاء النشطين على جميع أجهزة self (جلسة واحدة لكل جهاز)
+        
+        الشركاء غير النشطين لا يتم نشرهم لأن وجود المستخدم في الجهاز يعني السماح له بالدخول،
+        وستتم استعادة قوالبهم تلقائيًا عند إعادة التفعيل.
+        """
+        partners = partners.filtered(lambda p: p.fingerprint_active and p.zk_template_ids)
+        return self._push_partner_states(enable_partners=partners, refresh_templates=True)
+    
+    def ingest_attendance(self):
+        """استيراد سجلات الحضور الجديدة فقط من الجهاز وإدراجها على دفعات
+        
+        يعتمد الاستيراد على علامة آخر سجل تم استيراده (الوقت والموضع)، لذلك يتناسب عمل قاعدة البيانات
+        مع عدد البصمات الجديدة فقط.
+        يعيد (عدد السجلات المستوردة, عدد السجلات في ذاكرة الجهاز)
+        """
+        self.ensure_one()
+        
+        def job(device_id, zk):
+            with _zk_session(zk) as conn:
+                return conn.get_attendance()
+        
+        success, records = self._fan_out(job)[self.id]
+        if not success:
+            raise UserError(_('تعذر قراءة سجلات الحضور من جهاز %s: %s') % (self.name, str(records)))
+        
+        # أوقات سجلات الجهاز حسب ساعته، والعلامة محفوظة بالتوقيت العالمي
+        hwm_timestamp = self._utc_to_device_time(self.attendance_hwm_timestamp)
+        new_records = _new_attendance_records(records, self.attendance_hwm_serial, hwm_timestamp)
+        _logger.info("جهاز %s: %d سجل في الذاكرة منها %d جديد", self.name, len(records), len(new_records))
+        imported = self.env['zk.attendance']
+        if new_records:
+            imported = self._store_attendance([record for _index, record in new_records])
+            last_index, last_record = new_records[-1]
+            self.write({
+                'attendance_hwm_serial': last_index + 1,
+                'attendance_hwm_timestamp': self._device_time_to_utc(last_record.timestamp),
+            })
+        return len(imported), len(records)
+    
+    def _device_time_to_utc(self, timestamp):
+        """تحويل وقت حسب ساعة الجهاز (بدون منطقة زمنية) إلى التوقيت العالمي كما يحفظه Odoo"""
+        device_tz = timezone(self.device_tz or 'UTC')
+        return device_tz.localize(timestamp).astimezone(utc).replace(tzinfo=None)
+    
+    def _utc_to_device_time(self, timestamp):
+        """تحويل وقت محفوظ بالتوقيت العالمي إلى ساعة الجهاز للمقارنة بسجلاته"""
+        if not timestamp:
+            return timestamp
+        return utc.localize(timestamp).astimezone(timezone(self.device_tz or 'UTC')).replace(tzinfo=None)
+    
+    def _store_attendance(self, records, source='pull'):
+        """تحويل سجلات حضور الجهاز إلى سجلات zk.attendance وإدراجها على دفعات
+        
+        يتم تحويل الأوقات من المنطقة الزمنية للجهاز إلى التوقيت العالمي، واستبعاد السجلات المستوردة مسبقًا.
+        يعيد سجلات الحضور التي تم إنشاؤها
+        """
+        self.ensure_one()
+        Attendance = self.env['zk.attendance']
+        if not records:
+            return Attendance
+        partner_ids = Attendance._partners_by_user_id({str(record.user_id) for record in records})
+        # الاستبعاد المسبق لما تم استيراده بالفعل (من الاستيراد الدوري أو الالتقاط المباشر)
+        first_ts = self._device_time_to_utc(min(record.timestamp for record in records))
+        existing = {
+            (att.user_id, att.timestamp)
+            for att in Attendance.search([('device_id', '=', self.id), ('timestamp', '>=', first_ts)])
+        }
+        vals_list = []
+        for record in records:
+            user_id = str(record.user_id)
+            timestamp = self._device_time_to_utc(record.timestamp)
+            if (user_id, timestamp) in existing:
+                continue
+            existing.add((user_id, timestamp))
+            vals_list.append({
+                'device_id': self.id,
+                'user_id': user_id,
+                'uid': int(record.uid) if str(record.uid).isdigit() else 0,
+                'partner_id': partner_ids.get(user_id, False),
+                'timestamp': timestamp,
+                'status': record.status,
+                'punch': record.punch,
+                'source': source,
+            })
+        for start in range(0, len(vals_list), ATTENDANCE_BATCH_SIZE):
+            Attendance |= Attendance.create(vals_list[start:start + ATTENDANCE_BATCH_SIZE])
+        return Attendance
+    
+    def _clear_attendance_buffer(self, expected_count):
+        """مسح ذاكرة الحضور في الجهاز فقط إذا لم تصل بصمات جديدة منذ القراءة"""
+        self.ensure_one()
+        
+        def job(device_id, zk):
+            with _zk_session(zk) as conn:
+                conn.read_sizes()
+                if conn.records != expected_count:
+                    return False
+                conn.clear_attendance()
                 return True
-            else:
-                _logger.error("فشل تعطيل المستخدم %s في جهاز %s", user_id, self.name)
-                return False
-                
-        except Exception as e:
-            _logger.error("استثناء عند محاولة تعطيل المستخدم %s (%s) في جهاز %s: %s", 
-                          partner.name, user_id, self.name, str(e))
-            return False
+        
+        success, cleared = self._fan_out(job)[self.id]
+        if success and cleared:
+            self.write({'attendance_hwm_serial': 0})
+            _logger.info("تم مسح ذاكرة الحضور في جهاز %s بعد الاستيراد", self.name)
+            return True
+        _logger.info("لم يتم مسح ذاكرة الحضور في جهاز %s (وصلت بصمات جديدة أو فشل الاتصال)", self.name)
+        return False
+    
+    def action_ingest_attendance(self):
+        """زر لاستيراد سجلات الحضور الجديدة من الجهاز"""
+        count, _total = self.ingest_attendance()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('اكتمل الاستيراد'),
+                'message': _('تم استيراد %s سجل حضور جديد من جهاز %s') % (count, self.name),
+                'type': 'success',
+            }
+        }
+    
+    @api.model
+    def _cron_ingest_attendance(self):
+        """إجراء مجدول لاستيراد سجلات الحضور الجديدة من جميع الأجهزة النشطة
+        
+        يتم تأكيد (commit) استيراد كل جهاز على حدة قبل مسح ذاكرته عند تفعيل هذا الخيار.
+        """
+        for device in self.search([('active', '=', True)]):
+            try:
+                count, total = device.ingest_attendance()
+                self.env.cr.commit()
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.error("خطأ في استيراد الحضور من جهاز %s: %s", device.name, str(e))
+                continue
+            if device.clear_attendance_after_import and total:
+                device._clear_attendance_buffer(total)
+                self.env.cr.commit()
+        return True
+    
+    @api.model
+    def _cron_run_live_listeners(self):
+        """إجراء مجدول يشغل مستمعي الالتقاط المباشر للأجهزة المفعلة
+        
+        يعمل داخل عامل الإجراءات المجدولة بعيدًا عن عمال خدمة الطلبات. كل جهاز له خيط شبكة خاص،
+        بينما يقوم هذا الخيط بتفريغ البصمات كل ثانية في قاعدة البيانات على دفعات.
+        """
+        devices = self.search([('active', '=', True), ('live_capture', '=', True)])
+        if not devices:
+            return True
+        
+        listeners = {}
+        for device in devices:
+            try:
+                zk = device._get_zk_connection()
+            except Exception as e:
+                _logger.error("تعذر تهيئة الالتقاط المباشر لجهاز %s: %s", device.name, str(e))
+                continue
+            listener = LiveCaptureListener(device.name, zk, LIVE_BUFFER_SIZE)
+            listener.start()
+            listeners[device.id] = listener
+        
+        deadline = time.monotonic() + _cron_run_seconds(LIVE_RUN_SECONDS, LIVE_SHUTDOWN_RESERVE)
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(LIVE_FLUSH_INTERVAL)
+                self._flush_live_events(listeners)
         finally:
-            if conn:
-                conn.disconnect()
+            for listener in listeners.values():
+                listener.stop()
+            for listener in listeners.values():
+                listener.join(timeout=5)
+            self._flush_live_events(listeners)
+        return True
+    
+    @api.model
+    def _flush_live_events(self, listeners):
+        """حفظ البصمات المتراكمة لدى المستمعين على دفعات وإطلاق تنبيهات الدخول غير المصرح"""
+        now = fields.Datetime.now()
+        for device_id, listener in listeners.items():
+            events = listener.drain()
+            if not events:
+                continue
+            device = self.browse(device_id)
+            try:
+                attendances = device._store_attendance(events, source='live')
+                denied = attendances.filtered(
+                    lambda a: not a.partner_id
+                    or not a.partner_id.access_valid_until
+                    or a.partner_id.access_valid_until <= now
+                )
+                if denied:
+                    denied.write({'access_denied': True})
+                    names = ', '.join(denied.mapped(lambda a: a.partner_id.name or a.user_id))
+                    device.message_post(body=_('محاولة دخول من أعضاء غير مصرح لهم: %s') % names)
+                device.write({'live_last_event': now})
+                if listener.dropped:
+                    _logger.warning("تم تجاوز سعة ذاكرة الالتقاط المباشر لجهاز %s وفقد %d بصمة",
+                                    device.name, listener.dropped)
+                    listener.dropped = 0
+                self.env.cr.commit()
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.error("خطأ في حفظ بصمات الالتقاط المباشر لجهاز %s: %s", device.name, str(e))
     
     def sync_partner_fingerprint(self, partner):
         """مزامنة حالة بصمة الشريك مع جهاز البصمة"""
@@ -447,51 +1542,140 @@ class ZKDevice(models.Model):
         # لا يلزم تغيير إذا كانت حالة البصمة متطابقة مع حالة الاشتراك
         return True
     
-    def sync_all_users(self):
-        """مزامنة جميع المستخدمين مع حالة اشتراكاتهم"""
+    def _needs_full_reconcile(self, now):
+        """هل يجب أن تكون المزامنة التالية مطابقة كاملة بدلاً من تزايدية"""
         self.ensure_one()
-        _logger.info("بدأ عملية مزامنة جميع المستخدمين على جهاز %s", self.name)
+        if self.sync_mode == 'full' or not self.sync_watermark or not self.last_full_sync:
+            return True
+        interval = timedelta(hours=self.full_reconcile_interval or DEFAULT_FULL_RECONCILE_HOURS)
+        return self.last_full_sync + interval <= now
+    
+    @api.model
+    def _next_sync_watermark(self, started_at):
+        """علامة المزامنة التالية: بداية المزامنة أو بداية أقدم معاملة مفتوحة في قاعدة البيانات أيهما أقدم
         
-        # البحث عن الشركاء الذين لديهم بصمات - سواء بالطريقة القديمة أو الجديدة
-        # الطريقة القديمة - استخدام حقل zk_biometric_id
-        partners_old = self.env['res.partner'].search([('zk_biometric_id', '!=', False)])
-        # الطريقة الجديدة - استخدام حقل fingerprint_id
-        partners_new = self.env['res.partner'].search([('fingerprint_id', '!=', False)])
+        أوقات التغيير (zk_state_changed_at وwrite_date) تكتب داخل معاملات قد لا يتم تأكيدها إلا بعد
+        انتهاء المزامنة، فلا تراها المزامنة الحالية. لذلك تبدأ المزامنة التالية من بداية أقدم معاملة
+        كانت مفتوحة، مع هامش لفروق الساعة، فتتداخل الفترات بدلاً من تخطي هذه التغييرات.
+        """
+        self.env.cr.execute("""
+            SELECT min(xact_start) AT TIME ZONE 'UTC'
+              FROM pg_stat_activity
+             WHERE datname = current_database() AND xact_start IS NOT NULL
+        """)
+        oldest = self.env.cr.fetchone()[0]
+        watermark = min(started_at, oldest) if oldest else started_at
+        return watermark - timedelta(seconds=SYNC_WATERMARK_MARGIN)
+    
+    def action_full_sync(self):
+        """زر للمطابقة الكاملة مع الجهاز بغض النظر عن نوع المزامنة"""
+        return self.sync_all_users(full=True)
+    
+    def sync_all_users(self, full=None):
+        """مزامنة جميع المستخدمين مع حالة اشتراكاتهم
         
-        # دمج النتائج وإزالة التكرار
-        partners = partners_old | partners_new
+        تتم المزامنة بالمطابقة: قراءة جدول مستخدمي الجهاز مرة واحدة، وبناء الحالة المطلوبة
+        من الشركاء في استعلام واحد، ثم تطبيق الفرق الأدنى فقط (إضافة أو حذف) على الجهاز.
+        بهذا يتم أيضًا تصحيح أي تعديل يدوي تم على الجهاز.
+        full: مطابقة كاملة أو تزايدية، وبدونه يتم الاختيار حسب نوع المزامنة وموعد المطابقة الكاملة.
+        المزامنة التزايدية تقتصر على العملاء الذين تغيرت حالة وصولهم منذ آخر مزامنة ناجحة، وتستخدم
+        جدول المستخدمين المحفوظ مؤقتًا، ولا تتصل بالجهاز أصلاً إذا لم يتغير أحد.
+        يتم رفع UserError إذا فشلت الجلسة مع الجهاز، حتى يبقى الجهاز بانتظار المزامنة لدى عمال المزامنة.
+        """
+        self.ensure_one()
+        # العلامة التالية تحسب قبل القراءة، فلا يضيع أي تغيير يحدث أثناء المزامنة أو لم يتم تأكيده بعد
+        started_at = fields.Datetime.now()
+        watermark = self._next_sync_watermark(started_at)
+        if full is None:
+            full = self._needs_full_reconcile(started_at)
+        _logger.info("بدأ عملية مزامنة %s للمستخدمين على جهاز %s", 'كاملة' if full else 'تزايدية', self.name)
         
+        # البحث عن الشركاء الذين لديهم بصمات - سواء بالطريقة القديمة أو الجديدة
+        domain = [
+            '|',
+            ('zk_biometric_id', '!=', False),
+            ('fingerprint_id', '!=', False),
+        ]
+        if not full:
+            domain += self.env['res.partner']._get_zk_changed_domain(self.sync_watermark, started_at)
+        partners = self.env['res.partner'].search(domain)
+        if not full and partners:
+            # نفس المعرف قد يحمله أكثر من شريك، فيتم تضمينهم جميعًا حتى لا يحذف عضو نشط بسبب شريك آخر
+            user_ids = list({partner._get_zk_user_id() for partner in partners})
+            partners |= self.env['res.partner'].search([
+                '|',
+                ('fingerprint_id', 'in', user_ids),
+                ('zk_biometric_id', 'in', user_ids),
+            ])
         _logger.info("تم العثور على %d شريك لديهم بصمات", len(partners))
+        if not full and not partners:
+            self.write({'sync_watermark': watermark})
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('اكتملت المزامنة'),
+                    'message': _('لا توجد تغييرات منذ آخر مزامنة'),
+                    'type': 'success',
+                }
+            }
         
-        success_count = 0
-        disabled_count = 0
+        # كتابات المزامنة نفسها على الشركاء لا تعتبر تغييرًا، حتى لا تعيد المزامنة التالية معالجتهم
+        partners = partners.with_context(zk_skip_state_stamp=True)
+        # إجبار إعادة حساب حالة الاشتراك النشط
+        partners._compute_has_active_subscription()
+        partners._normalize_fingerprint_fields()
         
+        # الحالة المطلوبة في الجهاز: الأعضاء النشطون المخصصون لهذا الجهاز فقط، وغير المخصصين يتم حذفهم منه
+        desired_partners = self._get_desired_partners(partners)
+        desired_active = {}
+        desired_inactive = set()
         for partner in partners:
-            # إجبار إعادة حساب حالة الاشتراك النشط
-            partner._compute_has_active_subscription()
-            
-            # إذا لم يكن لديه حقل has_fingerprint، نقوم بتعيينه بناءً على وجود معرف البصمة
-            if not partner.has_fingerprint and (partner.zk_biometric_id or partner.fingerprint_id):
-                partner.has_fingerprint = True
-                
-            # التأكد من أن معرف البصمة موجود ومنسق
-            if not partner.fingerprint_id and partner.zk_biometric_id:
-                partner.fingerprint_id = partner.zk_biometric_id
-                
-            if partner.has_active_subscription and (not partner.fingerprint_active):
-                # تفعيل المستخدم إذا كان لديه اشتراك نشط وبصمته معطلة
-                if self.enable_user(partner):
-                    success_count += 1
-            elif not partner.has_active_subscription and partner.fingerprint_active:
-                # تعطيل المستخدم إذا لم يكن لديه اشتراك نشط وبصمته مفعلة
-                if self.disable_user(partner):
-                    disabled_count += 1
-            
-            # تحديث حالة zk_status للتوافق مع النظام القديم
-            if partner.fingerprint_active != (partner.zk_status == 'active'):
-                partner.zk_status = 'active' if partner.fingerprint_active else 'disabled'
+            user_id = partner._get_zk_user_id()
+            if partner in desired_partners:
+                desired_active[user_id] = partner.name or "User " + user_id
+            else:
+                desired_inactive.add(user_id)
+        # إذا تكرر المعرف لأكثر من شريك يكفي أن يكون أحدهم نشطًا
+        desired_inactive -= set(desired_active)
+        
+        device_name = self.name
+        cache_key, ttl = self._user_cache_key(), self.user_cache_ttl
+        strict = self.strict_verification
+        
+        def job(device_id, zk):
+            with _zk_session(zk) as conn:
+                # المطابقة الكاملة تعتمد دائمًا على قراءة جديدة للجدول لاكتشاف التعديلات اليدوية
+                users = _read_user_table(conn, cache_key, ttl, fresh=full)
+                to_enable, to_disable = _diff_user_table(users, desired_active, desired_inactive)
+                _logger.info("فرق المطابقة على جهاز %s: %d إضافة و%d حذف",
+                            device_name, len(to_enable), len(to_disable))
+                return to_enable, _apply_user_changes(conn, to_enable, to_disable, users=users,
+                                                      cache_key=cache_key, ttl=ttl, strict=strict)
         
-        self.write({'last_sync': fields.Datetime.now()})
+        success, result = self._fan_out(job)[self.id]
+        if not success:
+            raise UserError(_('تعذرت المزامنة مع جهاز البصمة %s: %s') % (self.name, str(result)))
+        to_enable, user_results = result
+        success_count = len([user_id for user_id, ok in user_results.items() if ok and user_id in to_enable])
+        disabled_count = len([user_id for user_id, ok in user_results.items() if ok and user_id not in to_enable])
+        
+        # مواءمة حالة الشركاء في Odoo مع حالة الجهاز بعد المطابقة
+        failed = {user_id for user_id, ok in user_results.items() if not ok}
+        # حالة البصمة تتبع الاشتراك وليس تخصيص الجهاز، فالعضو غير المخصص لهذا الجهاز قد يكون نشطًا في غيره
+        synced = partners.filtered(lambda p: p._get_zk_user_id() not in failed)
+        active = synced.filtered('has_active_subscription')
+        inactive = synced - active
+        active._write_fingerprint_state(True)
+        inactive._write_fingerprint_state(False)
+        
+        vals = {'last_sync': fields.Datetime.now()}
+        # العملاء الذين فشلت مزامنتهم يبقون ضمن التغييرات، فلا تتقدم العلامة إلا عند نجاح الجميع
+        if not failed:
+            vals['sync_watermark'] = watermark
+            if full:
+                vals['last_full_sync'] = started_at
+        self.write(vals)
         
         return {
             'type': 'ir.actions.client',
@@ -510,32 +1694,155 @@ class ZKDevice(models.Model):
         _logger.info("بدء التحقق من اتصال أجهزة البصمة")
         devices = self.search([('active', '=', True)])
         
-        connected_count = 0
-        disconnected_count = 0
+        results = devices._probe()
+        connected_count = len([r for r in results.values() if r['outcome'] == 'ok'])
         
-        for device in devices:
-            try:
-                # محاولة الاتصال بالجهاز
-                zk = device._get_zk_connection()
-                conn = zk.connect()
-                if conn:
-                    conn.disconnect()
-                    if device.connection_status != 'connected':
-                        device.write({'connection_status': 'connected', 'last_sync': fields.Datetime.now()})
-                    connected_count += 1
-                else:
-                    if device.connection_status != 'disconnected':
-                        device.write({'connection_status': 'disconnected'})
-                    disconnected_count += 1
-            except Exception as e:
-                _logger.warning("خطأ في الاتصال بجهاز %s: %s", device.name, str(e))
-                if device.connection_status != 'disconnected':
-                    device.write({'connection_status': 'disconnected'})
-                disconnected_count += 1
+        # إعادة قياس البروتوكولين للأجهزة التلقائية عند حلول موعدها أو عند فشل البروتوكول الحالي
+        # الأجهزة التي لا تستجيب أصلاً (لا يمكن الوصول أو انتهاء المهلة) لا يتم قياسها، لأن القياس
+        # يستخدم مهلة الاتصال الكاملة لكل بروتوكول ولن يفيد في اختيار أي منهما
+        now = fields.Datetime.now()
+        due = devices.filtered(lambda d: d.protocol == 'auto' and results[d.id]['outcome'] not in ('unreachable', 'timeout') and (
+            not d.transport_checked_at
+            or results[d.id]['outcome'] != 'ok'
+            or d.transport_checked_at + timedelta(hours=d.transport_recheck_interval or DEFAULT_TRANSPORT_RECHECK_HOURS) <= now
+        ))
+        if due:
+            due._measure_transports()
+        disconnected_count = len(results) - connected_count
+        
+        # حذف سجلات الفحص القديمة
+        self.env['zk.device.probe']._gc_probes()
         
         _logger.info("اكتمل التحقق من اتصال أجهزة البصمة: %s متصل، %s غير متصل", 
                    connected_count, disconnected_count)
         return True
+    
+    def _measure_transports(self):
+        """قياس سرعة قراءة جدول المستخدمين عبر TCP ثم UDP لكل جهاز واختيار البروتوكول الأسرع الموثوق
+        
+        يعتبر البروتوكول موثوقًا إذا نجحت القراءة وأعادت نفس عدد المستخدمين الذي أعاده البروتوكول الآخر
+        (أو نجح وحده). يتم اختيار UDP فقط إذا كان أسرع بوضوح، وإذا فشل البروتوكولان يبقى الاختيار السابق.
+        الأجهزة المتوقفة بقاطع الدائرة يتم تخطيها دون حجز اتصال تجريبي، وجلسات القياس لا تسجل في
+        ملف التوقيت أو نسخة الجدول أو قاطع الدائرة.
+        يعيد قاموس {معرف الجهاز: {'tcp': (عدد, ثانية) أو None, 'udp': ...}}
+        """
+        now = fields.Datetime.now()
+        devices = self.filtered(lambda d: d._breaker_may_retry(now))
+        
+        def job(device_id, zk):
+            return _measure_user_read(zk)
+        
+        measurements = {device.id: {} for device in devices}
+        # بروتوكول واحد في كل مرة حتى لا يتنافس القياسان على نفس الجهاز
+        for protocol in ('tcp', 'udp'):
+            for device_id, (success, result) in devices._fan_out(job, use_breaker=False, protocol=protocol,
+                                                                    bookkeeping=False).items():
+                measurements[device_id][protocol] = result if success else None
+        
+        for device in devices:
+            measured = measurements[device.id]
+            throughput = {}
+            for protocol, result in measured.items():
+                if result:
+                    count, duration = result
+                    throughput[protocol] = count / max(duration, 0.001)
+            counts = {result[0] for result in measured.values() if result}
+            if len(counts) > 1:
+                # قراءة ناقصة: البروتوكول الذي أعاد عددًا أقل غير موثوق لهذا الجهاز
+                best_count = max(counts)
+                throughput = {protocol: value for protocol, value in throughput.items()
+                              if measured[protocol][0] == best_count}
+            vals = {
+                'tcp_throughput': throughput.get('tcp', 0.0),
+                'udp_throughput': throughput.get('udp', 0.0),
+                'transport_checked_at': now,
+            }
+            if throughput:
+                choice = 'tcp'
+                if 'tcp' not in throughput or throughput.get('udp', 0.0) > throughput['tcp'] * UDP_PREFERENCE_MARGIN:
+                    choice = 'udp'
+                if choice != device.effective_protocol:
+                    _logger.info("جهاز %s: التحويل إلى بروتوكول %s (TCP %.0f، UDP %.0f مستخدم/ثانية)",
+                                 device.name, choice.upper(), vals['tcp_throughput'], vals['udp_throughput'])
+                    vals['effective_protocol'] = choice
+            else:
+                _logger.warning("جهاز %s: فشل قياس البروتوكولين، يبقى البروتوكول %s",
+                                device.name, (device.effective_protocol or 'tcp').upper())
+            device.write(vals)
+        return measurements
+    
+    def action_measure_transports(self):
+        """قياس سرعة البروتوكولين يدويًا وعرض النتيجة"""
+        self.ensure_one()
+        measured = self._measure_transports().get(self.id)
+        if not measured or not any(measured.values()):
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('خطأ'),
+                    'message': _('تعذرت قراءة جدول المستخدمين من جهاز %s عبر أي من البروتوكولين') % self.name,
+                    'type': 'danger',
+                }
+            }
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('قياس البروتوكولات'),
+                'message': _('TCP: %.0f مستخدم/ثانية، UDP: %.0f مستخدم/ثانية، البروتوكول المختار: %s') % (
+                    self.tcp_throughput, self.udp_throughput, self.effective_protocol.upper()),
+                'type': 'success',
+            }
+        }
+    
+    def _probe(self):
+        """فحص جميع الأجهزة في self بالتوازي وتسجيل زمن الاستجابة ونتيجة كل فحص
+        
+        يبدأ كل فحص بتحقق سريع من إمكانية الوصول إلى منفذ TCP قبل مصافحة البروتوكول الكاملة،
+        ويستخدم مهلة الفحص القصيرة بدلاً من مهلة الجهاز العادية.
+        يعيد قاموس {معرف الجهاز: {'outcome': ..., 'latency': ..., 'message': ...}}
+        """
+        targets = {device.id: (device.ip_address, device.port, device._get_transport()) for device in self}
+        zk_timeout = {device.id: device.probe_timeout or DEFAULT_PROBE_TIMEOUT for device in self}
+        
+        def job(device_id, zk):
+            ip_address, port, protocol = targets[device_id]
+            return _probe_device(zk, ip_address, port, protocol, zk_timeout[device_id])
+        
+        results = {}
+        # نجمع الأجهزة حسب مهلة الفحص لإنشاء كائنات الاتصال بالمهلة المناسبة
+        for probe_timeout in set(zk_timeout.values()):
+            devices = self.filtered(lambda d: zk_timeout[d.id] == probe_timeout)
+            for device_id, (success, result) in devices._fan_out(job, timeout=probe_timeout, use_breaker=False).items():
+                if not success:
+                    result = {'outcome': 'error', 'latency': 0.0, 'message': str(result)}
+                results[device_id] = result
+        
+        # الفحص الدوري يتجاوز قاطع الدائرة، ونتيجته تغلقه عند عودة الجهاز أو تمدد إيقافه
+        self._breaker_record({device_id: result['outcome'] == 'ok' for device_id, result in results.items()})
+        
+        now = fields.Datetime.now()
+        self.env['zk.device.probe'].create([{
+            'device_id': device_id,
+            'date': now,
+            'outcome': result['outcome'],
+            'latency': result['latency'],
+            'message': result['message'],
+        } for device_id, result in results.items()])
+        
+        for device in self:
+            result = results[device.id]
+            vals = {'last_probe_latency': result['latency'], 'last_probe_date': now}
+            status = 'connected' if result['outcome'] == 'ok' else 'disconnected'
+            if device.connection_status != status:
+                vals['connection_status'] = status
+                if status == 'connected':
+                    vals['last_sync'] = now
+            if result['outcome'] != 'ok':
+                _logger.warning("خطأ في الاتصال بجهاز %s: %s", device.name, result['message'])
+            device.write(vals)
+        return results
         
     @api.model
     def _cron_sync_fingerprints_with_subscriptions(self):
@@ -544,33 +1851,15 @@ class ZKDevice(models.Model):
         وتفعيلها عندما تكون الاشتراكات نشطة"""
         _logger.info("بدء مزامنة البصمات مع حالة الاشتراك")
         
-        # 1. أولاً: نتحقق مباشرة من الاشتراكات المنتهية لتعطيل البصمات المرتبطة بها
-        today = fields.Date.today()
-        _logger.info("البحث عن الاشتراكات المنتهية بتاريخ %s", today)
-        
-        # البحث عن الاشتراكات المنتهية (بناءً على تاريخ الانتهاء أو حالة الاشتراك)
-        expired_subscriptions = self.env['sale.order'].search([
-            ('is_subscription', '=', True),
-            ('state', '=', 'sale'),
-            '|',
-            ('subscription_state', '=', '6_churn'),  # إما أن الاشتراك منتهٍ صراحةً
-            '&',  # أو أن تاريخ الانتهاء قد حل
-            ('end_date', '!=', False),
-            ('end_date', '<', today)
-        ])
-        
-        _logger.info("تم العثور على %d اشتراك منتهي", len(expired_subscriptions))
-        
-        # تجميع الشركاء المرتبطين بالاشتراكات المنتهية
-        partners_with_expired_subs = self.env['res.partner']
-        for sub in expired_subscriptions:
-            partners_with_expired_subs |= sub.partner_id
-            _logger.info("الاشتراك %s للشريك %s منتهٍ (تاريخ الانتهاء: %s، الحالة: %s)", 
-                       sub.name, sub.partner_id.name, sub.end_date, sub.subscription_state)
+        # 1. أولاً: نتحقق مباشرة من العملاء الذين انتهت صلاحية وصولهم لتعطيل بصماتهم
+        # استعلام نطاق واحد على الحقل المفهرس access_valid_until بدلاً من المرور على أوامر البيع
+        partners_with_expired_subs = self.env['res.partner']._get_partners_to_revoke()
+        _logger.info("تم العثور على %d عميل انتهت صلاحية وصوله", len(partners_with_expired_subs))
         
         # تعطيل البصمات للشركاء الذين انتهت اشتراكاتهم
         disabled_count = 0
-        devices = self.search([('connection_status', '=', 'connected')])
+        # الأجهزة المتوقفة بقاطع الدائرة تفشل فورًا، ويتم تسجيل عملياتها في الطابور لإعادتها لاحقًا
+        devices = self.search([('active', '=', True)])
         
         # البحث عن الشركاء الذين لديهم بصمات بطريقة متوافقة
         fingerprint_partners = partners_with_expired_subs.filtered(
@@ -578,45 +1867,87 @@ class ZKDevice(models.Model):
                       (p.zk_biometric_id and p.zk_status == 'active')
         )
         
-        for partner in fingerprint_partners:
-            # تحقق من عدم وجود اشتراكات أخرى نشطة
-            partner._compute_has_active_subscription()
-            if not partner.has_active_subscription:
-                _logger.info("تعطيل بصمة الشريك %s بسبب انتهاء الاشتراك", partner.name)
-                
-                # التأكد من وجود الحقول المطلوبة
-                if not partner.has_fingerprint and partner.zk_biometric_id:
-                    partner.has_fingerprint = True
-                
-                if not partner.fingerprint_id and partner.zk_biometric_id:
-                    partner.fingerprint_id = partner.zk_biometric_id
-                
-                # تحديث حالة البصمة
-                partner.write({
-                    'fingerprint_active': False,
-                    'zk_status': 'disabled'
-                })
-                
-                # مزامنة مع أجهزة البصمة
-                for device in devices:
-                    try:
-                        if device.disable_user(partner):
-                            disabled_count += 1
-                            break  # إذا نجحت على جهاز واحد، لا داعي للاستمرار
-                    except Exception as e:
-                        _logger.error("خطأ في مزامنة بصمة الشريك %s على الجهاز %s: %s", 
-                                    partner.name, device.name, str(e))
+        # تحقق من عدم وجود اشتراكات أخرى نشطة - استعلام واحد لجميع الشركاء
+        fingerprint_partners._compute_has_active_subscription()
+        
+        partners_to_disable = fingerprint_partners.filtered(lambda p: not p.has_active_subscription)
+        for partner in partners_to_disable:
+            _logger.info("تعطيل بصمة الشريك %s بسبب انتهاء الاشتراك", partner.name)
+        
+        # التأكد من وجود الحقول المطلوبة وتحديث حالة البصمة دفعة واحدة
+        partners_to_disable._normalize_fingerprint_fields()
+        partners_to_disable._write_fingerprint_state(False)
+        
+        # مزامنة مع أجهزة البصمة - جلسة واحدة لكل جهاز لجميع الشركاء
+        if partners_to_disable and devices:
+            results = devices.disable_users(partners_to_disable)
+            disabled_partners = self.env['res.partner']
+            for partners_done in results.values():
+                disabled_partners |= partners_done
+            disabled_count = len(disabled_partners)
         
         # 2. ثم: نتحقق من جميع الشركاء الذين لديهم بصمات
         _logger.info("التحقق من جميع الشركاء الذين لديهم بصمات")
         partners_with_fingerprints = self.env['res.partner'].search([('has_fingerprint', '=', True)])
         
-        # للمزامنة الكاملة، نقوم بتشغيل sync_all_users على كل جهاز متصل
-        for device in devices:
+        # المزامنة الكاملة: كل جهاز غير متوقف بقاطع الدائرة يصبح وحدة عمل مستقلة ينفذها أول عامل متاح
+        now = fields.Datetime.now()
+        devices_to_sync = devices.filtered(lambda d: d._breaker_may_retry(now))
+        devices_to_sync.filtered(lambda d: not d.sync_pending).write({'sync_pending': True, 'sync_requested_at': now})
+        workers = self.env['ir.cron'].sudo().search([('code', 'like', '_cron_sync_device_worker')])
+        for worker in workers:
+            worker._trigger()
+        
+        _logger.info("تم طلب المزامنة الكاملة لعدد %d جهاز عبر %d عامل مزامنة", len(devices_to_sync), len(workers))
+        return True
+    
+    @api.model
+    def _cron_sync_device_worker(self):
+        """عامل مزامنة: حجز جهاز بانتظار المزامنة ومزامنته ثم تأكيد النتيجة، وتكرار ذلك حتى انتهاء الأجهزة
+        
+        يتم حجز الجهاز بتسجيل العامل ووقت الحجز عليه في استعلام واحد مع SKIP LOCKED ثم التأكيد (commit)
+        مباشرة، فلا يبقى قفل الصف مفتوحًا أثناء الاتصال بالجهاز، ويمكن تشغيل عدة عمال في نفس الوقت
+        دون أن يأخذ عاملان نفس الجهاز. الجهاز يبقى بانتظار المزامنة حتى نجاحها، فإذا فشلت أو توقف العامل
+        يتم تحرير الحجز (أو ينتهي بعد حد الوقت الحقيقي للإجراءات المجدولة) ليأخذه عامل آخر.
+        """
+        deadline = time.monotonic() + _cron_run_seconds(SYNC_WORKER_RUN_SECONDS, SYNC_WORKER_RESERVE)
+        # حجز أقدم من أطول مدة يمكن أن يعيشها عامل يعني أن العامل توقف قبل تحريره
+        claim_expiry = timedelta(seconds=(_cron_real_time_limit() or SYNC_WORKER_RUN_SECONDS) + SYNC_WORKER_RESERVE)
+        worker = '%s:%s:%s' % (socket.gethostname(), os.getpid(), threading.get_ident())
+        # الأجهزة التي فشلت في هذا التشغيل لا تتم إعادتها فيه، وتبقى بانتظار التشغيل التالي
+        attempted = []
+        synced = 0
+        while time.monotonic() < deadline:
+            now = fields.Datetime.now()
+            self.env.cr.execute("""
+                UPDATE zk_device
+                   SET sync_claimed_by = %s, sync_claimed_at = %s
+                 WHERE id = (
+                        SELECT id FROM zk_device
+                         WHERE sync_pending AND active AND NOT (id = ANY(%s))
+                           AND (sync_claimed_at IS NULL OR sync_claimed_at < %s)
+                         ORDER BY sync_requested_at, id
+                         LIMIT 1
+                         FOR UPDATE SKIP LOCKED)
+             RETURNING id
+            """, (worker, now, attempted, now - claim_expiry))
+            row = self.env.cr.fetchone()
+            self.env.cr.commit()
+            if not row:
+                break
+            device = self.browse(row[0])
+            device.invalidate_recordset(['sync_claimed_by', 'sync_claimed_at'])
+            attempted.append(device.id)
             try:
                 device.sync_all_users()
+                device.write({'sync_pending': False, 'sync_claimed_by': False, 'sync_claimed_at': False})
+                self.env.cr.commit()
+                synced += 1
             except Exception as e:
+                self.env.cr.rollback()
                 _logger.error("خطأ في مزامنة المستخدمين على الجهاز %s: %s", device.name, str(e))
-        
-        _logger.info("اكتملت مزامنة البصمات مع حالة الاشتراك")
+                device.write({'sync_claimed_by': False, 'sync_claimed_at': False})
+                self.env.cr.commit()
+        if synced:
+            _logger.info("عامل المزامنة: تمت مزامنة %d جهاز", synced)
         return True
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class ZKDeviceGroup(models.Model):
+    _name = 'zk.device.group'
+    _description = 'مجموعة أجهزة بصمة'
+    _order = 'name'
+
+    name = fields.Char(string="اسم المجموعة", required=True, help="الفرع أو المنطقة التي تضم مجموعة من الأجهزة")
+    active = fields.Boolean(string="نشط", default=True)
+    device_ids = fields.One2many('zk.device', 'device_group_id', string="الأجهزة")
+    device_count = fields.Integer(string="عدد الأجهزة", compute='_compute_device_count')
+    description = fields.Text(string="الوصف")
+
+    _sql_constraints = [
+        ('name_unique', 'unique(name)', 'اسم مجموعة الأجهزة يجب أن يكون فريدًا'),
+    ]
+
+    def _compute_device_count(self):
+        for group in self:
+            group.device_count = len(group.device_ids)
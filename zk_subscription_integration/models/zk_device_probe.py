@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+# عدد الأيام التي يحتفظ فيها بسجل الفحص
+PROBE_RETENTION_DAYS = 30
+
+
+class ZKDeviceProbe(models.Model):
+    _name = 'zk.device.probe'
+    _description = 'سجل فحص اتصال جهاز البصمة'
+    _order = 'date desc, id desc'
+
+    device_id = fields.Many2one('zk.device', string="الجهاز", required=True, index=True, ondelete='cascade')
+    date = fields.Datetime(string="التاريخ", required=True, default=fields.Datetime.now, index=True)
+    outcome = fields.Selection([
+        ('ok', 'متصل'),
+        ('unreachable', 'لا يمكن الوصول'),
+        ('timeout', 'انتهت المهلة'),
+        ('error', 'خطأ'),
+    ], string="النتيجة", required=True)
+    latency = fields.Float(string="زمن الاستجابة (مللي ثانية)", digits=(16, 1))
+    message = fields.Char(string="الرسالة")
+
+    @api.model
+    def _gc_probes(self):
+        """حذف سجلات الفحص الأقدم من مدة الاحتفاظ"""
+        limit = fields.Datetime.now() - timedelta(days=PROBE_RETENTION_DAYS)
+        self.search([('date', '<', limit)]).unlink()
+        return True
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import base64
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+
+
+class ZKDeviceSnapshotRestore(models.TransientModel):
+    _name = 'zk.device.snapshot.restore'
+    _description = 'استعادة لقطة جهاز بصمة'
+
+    device_id = fields.Many2one('zk.device', string="الجهاز", required=True,
+                                help="الجهاز الذي سيتم تجهيزه باللقطة (عادةً جهاز بديل جديد)")
+    attachment_id = fields.Many2one('ir.attachment', string="اللقطة",
+                                    domain=[('res_model', '=', 'zk.device'), ('mimetype', '=', 'application/gzip')],
+                                    help="لقطة محفوظة من أحد الأجهزة")
+    snapshot_file = fields.Binary(string="ملف لقطة", help="أو رفع ملف لقطة تم تنزيله سابقًا")
+    snapshot_filename = fields.Char(string="اسم الملف")
+    overwrite = fields.Boolean(string="استبدال المستخدمين الحاليين",
+                               help="الاستعادة على جهاز غير فارغ تستبدل المستخدمين الذين لهم نفس الأرقام الداخلية في اللقطة")
+
+    def action_restore(self):
+        self.ensure_one()
+        if self.snapshot_file:
+            data = base64.b64decode(self.snapshot_file)
+        elif self.attachment_id:
+            data = self.attachment_id.raw
+        else:
+            raise UserError(_('يرجى اختيار لقطة أو رفع ملف لقطة'))
+        try:
+            written, present, overwritten = self.device_id.restore_snapshot(data, overwrite=self.overwrite)
+        except (OSError, ValueError) as e:
+            raise UserError(_('ملف اللقطة غير صالح: %s') % str(e))
+        message = _('تمت كتابة %s مستخدم على جهاز %s، ويحتوي الجهاز الآن على %s مستخدم') % (
+            written, self.device_id.name, present)
+        if overwritten:
+            message += '\n' + _('تم استبدال %s مستخدم كانوا على الجهاز: %s') % (
+                len(overwritten), ', '.join('%s (%s)' % (user.name, user.user_id) for user in overwritten))
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('تمت الاستعادة'),
+                'message': message,
+                'type': 'warning' if overwritten else 'success',
+                'sticky': bool(overwritten),
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from odoo import models, fields, api
+
+
+def _content_hash(user):
+    """بصمة محتوى سجل مستخدم الجهاز لاكتشاف أي تعديل عليه"""
+    content = '|'.join(str(value) for value in (
+        user.uid, user.name, user.privilege, user.password, user.group_id, user.card,
+    ))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ZKDeviceUser(models.Model):
+    _name = 'zk.device.user'
+    _description = 'نسخة جدول مستخدمي جهاز البصمة'
+    _order = 'device_id, user_id'
+    _rec_name = 'user_id'
+
+    device_id = fields.Many2one('zk.device', string="الجهاز", required=True, index=True, ondelete='cascade')
+    user_id = fields.Char(string="معرّف البصمة", required=True, index=True)
+    uid = fields.Integer(string="الرقم الداخلي في الجهاز")
+    name = fields.Char(string="الاسم في الجهاز")
+    partner_id = fields.Many2one('res.partner', string="العميل", index=True, ondelete='set null')
+    enabled = fields.Boolean(string="موجود في الجهاز", default=True, index=True,
+                             help="وجود المستخدم في الجهاز يعني السماح له بالدخول")
+    last_seen = fields.Datetime(string="آخر ظهور", help="آخر قراءة لجدول الجهاز ظهر فيها المستخدم")
+    content_hash = fields.Char(string="بصمة المحتوى")
+    drift = fields.Boolean(string="اختلاف عن Odoo", compute='_compute_drift', store=True, index=True,
+                           help="حالة المستخدم في الجهاز تختلف عن الحالة المطلوبة حسب اشتراك العميل ومجموعات الأجهزة المخصصة له")
+
+    _sql_constraints = [
+        ('device_user_uniq', 'unique(device_id, user_id)', 'المستخدم مسجل بالفعل لهذا الجهاز'),
+    ]
+
+    @api.depends('enabled', 'partner_id', 'partner_id.has_active_subscription', 'partner_id.zk_device_group_ids',
+                 'partner_id.sale_order_ids.subscription_state', 'partner_id.sale_order_ids.order_line.product_id',
+                 'device_id.device_group_id')
+    def _compute_drift(self):
+        """المقارنة بنفس الحالة المطلوبة التي تطبقها المطابقة (zk.device._get_desired_partners)"""
+        self.drift = False
+        for device in self.device_id:
+            records = self.filtered(lambda r: r.device_id == device and r.partner_id)
+            desired = device._get_desired_partners(records.partner_id)
+            for record in records:
+                record.drift = record.enabled != (record.partner_id in desired)
+
+    @api.model
+    def _apply_snapshot(self, device, users, full):
+        """تحديث النسخة من جدول مستخدمي جهاز قرئ أو عُدل في جلسة
+
+        users: قاموس {معرف البصمة: مستخدم الجهاز أو None إذا تم حذفه}
+        full: القاموس يمثل الجدول كاملاً، فالمستخدمون غير الموجودين فيه تم حذفهم من الجهاز
+        الكتابة مجمعة: تحديث آخر ظهور للسجلات غير المتغيرة بعملية واحدة، وإنشاء الجديدة دفعة واحدة.
+        """
+        now = fields.Datetime.now()
+        existing = {record.user_id: record for record in self.search([('device_id', '=', device.id)])}
+        partner_ids = self.env['zk.attendance']._partners_by_user_id(
+            [user_id for user_id, user in users.items() if user is not None])
+
+        unchanged = self.browse()
+        removed = self.browse()
+        to_create = []
+        for user_id, user in users.items():
+            record = existing.get(user_id)
+            if user is None:
+                if record and record.enabled:
+                    removed |= record
+                continue
+            vals = {
+                'uid': user.uid,
+                'name': user.name,
+                'content_hash': _content_hash(user),
+                'partner_id': partner_ids.get(user_id, False),
+                'enabled': True,
+                'last_seen': now,
+            }
+            if not record:
+                vals.update({'device_id': device.id, 'user_id': user_id})
+                to_create.append(vals)
+            elif (record.enabled and record.content_hash == vals['content_hash']
+                  and record.partner_id.id == vals['partner_id']):
+                unchanged |= record
+            else:
+                record.write(vals)
+        if full:
+            removed |= self.browse([
+                record.id for user_id, record in existing.items() if user_id not in users and record.enabled
+            ])
+        if unchanged:
+            unchanged.write({'last_seen': now})
+        if removed:
+            removed.write({'enabled': False})
+        if to_create:
+            self.create(to_create)
+        return True
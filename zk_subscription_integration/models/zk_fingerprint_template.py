@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import logging
+import zlib
+from collections import defaultdict
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class ZKFingerprintTemplate(models.Model):
+    _name = 'zk.fingerprint.template'
+    _description = 'قالب بصمة'
+    _order = 'partner_id, fid'
+
+    partner_id = fields.Many2one('res.partner', string="العميل", required=True, index=True, ondelete='cascade')
+    fid = fields.Integer(string="رقم الإصبع", required=True, help="رقم الإصبع في الجهاز (0-9)")
+    valid = fields.Integer(string="صالح", default=1)
+    template = fields.Binary(string="القالب (مضغوط)", attachment=False, required=True)
+    size = fields.Integer(string="حجم القالب (بايت)", readonly=True)
+    source_device_id = fields.Many2one('zk.device', string="الجهاز المصدر", ondelete='set null')
+
+    _sql_constraints = [
+        ('partner_fid_uniq', 'unique(partner_id, fid)', 'يوجد قالب مخزن لهذا الإصبع بالفعل لهذا العميل'),
+    ]
+
+    @api.model
+    def _pack(self, raw):
+        """ضغط القالب الخام لتخزينه"""
+        return base64.b64encode(zlib.compress(raw))
+
+    def _get_raw_template(self):
+        """استرجاع القالب الخام كما يفهمه الجهاز"""
+        self.ensure_one()
+        return zlib.decompress(base64.b64decode(self.template))
+
+    @api.model
+    def _store_fingers(self, fingers_by_user_id, device):
+        """حفظ أو تحديث قوالب البصمات المنزلة من جهاز
+        
+        fingers_by_user_id: قاموس {معرف البصمة: [Finger]}
+        يعيد عدد القوالب التي تم حفظها
+        """
+        if not fingers_by_user_id:
+            return 0
+        user_ids = list(fingers_by_user_id)
+        partners = self.env['res.partner'].search([
+            '|',
+            ('fingerprint_id', 'in', user_ids),
+            ('zk_biometric_id', 'in', user_ids),
+        ])
+        partner_by_user_id = {partner._get_zk_user_id(): partner for partner in partners}
+        existing = {
+            (template.partner_id.id, template.fid): template
+            for template in self.search([('partner_id', 'in', partners.ids)])
+        }
+        
+        to_create = []
+        count = 0
+        for user_id, fingers in fingers_by_user_id.items():
+            partner = partner_by_user_id.get(user_id)
+            if not partner:
+                continue
+            for finger in fingers:
+                vals = {
+                    'valid': finger.valid,
+                    'template': self._pack(finger.template),
+                    'size': finger.size,
+                    'source_device_id': device.id,
+                }
+                template = existing.get((partner.id, finger.fid))
+                if template:
+                    template.write(vals)
+                else:
+                    vals.update(partner_id=partner.id, fid=finger.fid)
+                    to_create.append(vals)
+                count += 1
+        self.create(to_create)
+        return count
+
+    @api.model
+    def _get_templates_by_user_id(self, partners):
+        """قوالب البصمات المخزنة للشركاء باستعلام واحد
+        
+        يعيد قاموس {معرف البصمة: [(رقم الإصبع, صالح, القالب الخام)]}
+        """
+        result = defaultdict(list)
+        if not partners:
+            return result
+        for template in self.search([('partner_id', 'in', partners.ids)]):
+            user_id = template.partner_id._get_zk_user_id()
+            if user_id:
+                result[user_id].append((template.fid, template.valid, template._get_raw_template()))
+        return result
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+
+_logger = logging.getLogger(__name__)
+
+# عدد المحاولات قبل اعتبار المهمة فاشلة نهائيًا
+MAX_ATTEMPTS = 8
+# زمن الانتظار الأساسي (ثانية) قبل إعادة المحاولة، ويتضاعف مع كل محاولة فاشلة
+RETRY_BASE_DELAY = 60
+# الحد الأقصى لزمن الانتظار بين المحاولات (ثانية)
+RETRY_MAX_DELAY = 6 * 3600
+# الحد الأقصى لعدد المهام المعالجة في كل تشغيل للإجراء المجدول
+BATCH_SIZE = 1000
+# مفتاح حالة العملاء الأولية في بيانات ما قبل تأكيد المعاملة
+PRECOMMIT_STATES_KEY = 'zk_subscription_integration.initial_partner_states'
+
+
+class ZKSyncJob(models.Model):
+    _name = 'zk.sync.job'
+    _description = 'مهمة مزامنة بصمة'
+    _order = 'next_attempt, id'
+
+    partner_id = fields.Many2one('res.partner', string="العميل", required=True, index=True, ondelete='cascade')
+    action = fields.Selection([
+        ('enable', 'تفعيل'),
+        ('disable', 'تعطيل'),
+    ], string="الإجراء", required=True)
+    state = fields.Selection([
+        ('pending', 'بانتظار التنفيذ'),
+        ('done', 'تم'),
+        ('failed', 'فشل'),
+    ], string="الحالة", default='pending', required=True, index=True)
+    attempts = fields.Integer(string="عدد المحاولات", default=0, readonly=True)
+    next_attempt = fields.Datetime(string="المحاولة التالية", default=fields.Datetime.now, index=True)
+    last_error = fields.Text(string="آخر خطأ", readonly=True)
+
+    @api.model
+    def _enqueue(self, partners, action):
+        """تسجيل الحالة المطلوبة لمجموعة من العملاء دون أي اتصال بالأجهزة
+        
+        إذا كانت هناك مهمة معلقة للعميل يتم تحديثها بدلاً من إنشاء مهمة جديدة،
+        بحيث تتجمع التغييرات المتتالية في عملية واحدة على الأجهزة.
+        """
+        if not partners:
+            return self.browse()
+        jobs = self.sudo()
+        pending = jobs.search([('partner_id', 'in', partners.ids), ('state', '=', 'pending')])
+        now = fields.Datetime.now()
+        pending.write({'action': action, 'attempts': 0, 'next_attempt': now, 'last_error': False})
+        new_partners = partners - pending.partner_id
+        created = jobs.create([{
+            'partner_id': partner.id,
+            'action': action,
+            'next_attempt': now,
+        } for partner in new_partners])
+        
+        # تشغيل معالج الطابور بعد تأكيد المعاملة لتقليل زمن الانتظار
+        cron = self.env.ref('zk_subscription_integration.ir_cron_process_zk_sync_jobs', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+        return pending | created
+
+    @api.model
+    def _enqueue_on_commit(self, partners):
+        """تسجيل حالة بصمة العملاء قبل تغييرها، وتأجيل إنشاء المهام إلى ما قبل تأكيد المعاملة
+        
+        يجب الاستدعاء قبل تغيير الحالة. يتم حفظ الحالة الأولى فقط لكل عميل خلال المعاملة،
+        وعند التأكيد تتم مقارنتها بالحالة النهائية: العميل الذي تغيرت حالته ثم عادت كما كانت
+        لا ينتج أي مهمة، والتراجع عن المعاملة يلغي كل شيء لأن المهام لا تنشأ إلا مع التأكيد.
+        """
+        precommit = self.env.cr.precommit
+        initial_states = precommit.data.get(PRECOMMIT_STATES_KEY)
+        if initial_states is None:
+            initial_states = precommit.data[PRECOMMIT_STATES_KEY] = {}
+            precommit.add(self._flush_partner_states)
+        for partner in partners:
+            initial_states.setdefault(partner.id, partner.zk_status)
+
+    @api.model
+    def _flush_partner_states(self):
+        """تحويل صافي تغييرات حالة العملاء في المعاملة إلى مهام مزامنة (دفعة واحدة لكل إجراء)"""
+        initial_states = self.env.cr.precommit.data.pop(PRECOMMIT_STATES_KEY, {})
+        # العملاء المحذوفون أو الذين تم التراجع عن إنشائهم داخل نقطة حفظ لا يتم إرسالهم
+        partners = self.env['res.partner'].browse(list(initial_states)).exists()
+        changed = partners.filtered(lambda p: p.zk_status != initial_states[p.id])
+        if not changed:
+            return
+        enable_partners = changed.filtered(lambda p: p.zk_status == 'active')
+        _logger.info("تسجيل صافي تغييرات البصمة في المعاملة: %d عميل من أصل %d (%d تفعيل، %d تعطيل)",
+                   len(changed), len(initial_states), len(enable_partners), len(changed - enable_partners))
+        self._enqueue(enable_partners, 'enable')
+        self._enqueue(changed - enable_partners, 'disable')
+        # خطافات ما قبل التأكيد تعمل بعد تفريغ ORM، لذلك يتم تفريغ المهام المنشأة صراحة
+        self.env.flush_all()
+
+    @api.model
+    def _cron_process_jobs(self):
+        """إجراء مجدول لتفريغ طابور مهام المزامنة مع إعادة المحاولة بتأخير متزايد"""
+        now = fields.Datetime.now()
+        jobs = self.search([
+            ('state', '=', 'pending'),
+            ('next_attempt', '<=', now),
+        ], limit=BATCH_SIZE)
+        if not jobs:
+            return True
+        
+        # دمج المهام الخاصة بنفس العميل: آخر مهمة هي الحالة المطلوبة
+        latest = {}
+        for job in jobs.sorted('id'):
+            latest[job.partner_id.id] = job
+        superseded = jobs - self.browse([job.id for job in latest.values()])
+        superseded.write({'state': 'done'})
+        jobs -= superseded
+        
+        enable_jobs = jobs.filtered(lambda j: j.action == 'enable')
+        disable_jobs = jobs - enable_jobs
+        _logger.info("معالجة %d مهمة مزامنة بصمة (%d تفعيل، %d تعطيل)",
+                   len(jobs), len(enable_jobs), len(disable_jobs))
+        
+        devices = self.env['zk.device'].search([('active', '=', True)])
+        results = devices._push_partner_states(enable_partners=enable_jobs.partner_id,
+                                               disable_partners=disable_jobs.partner_id,
+                                               replay_failures=False)
+        
+        failed_partners = self.env['res.partner']
+        for result in results.values():
+            failed_partners |= result['failed']
+        
+        failed_jobs = jobs.filtered(lambda j: j.partner_id in failed_partners)
+        (jobs - failed_jobs).write({'state': 'done', 'last_error': False})
+        for job in failed_jobs:
+            job._schedule_retry(_('فشلت المزامنة مع جهاز واحد أو أكثر'))
+        return True
+
+    def _schedule_retry(self, error):
+        """جدولة إعادة المحاولة بتأخير أسي، أو اعتبار المهمة فاشلة بعد تجاوز الحد الأقصى"""
+        for job in self:
+            attempts = job.attempts + 1
+            if attempts >= MAX_ATTEMPTS:
+                job.write({'state': 'failed', 'attempts': attempts, 'last_error': error})
+                _logger.error("فشلت مهمة مزامنة بصمة العميل %s نهائيًا بعد %d محاولة",
+                              job.partner_id.name, attempts)
+                continue
+            delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+            job.write({
+                'attempts': attempts,
+                'next_attempt': fields.Datetime.now() + timedelta(seconds=delay),
+                'last_error': error,
+            })
+
+    def action_retry(self):
+        """إعادة المهام الفاشلة إلى الطابور"""
+        self.write({'state': 'pending', 'attempts': 0, 'next_attempt': fields.Datetime.now()})
+        return True
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from . import test_device_sync
+from . import test_device_snapshot
+from . import test_attendance
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import TransactionCase, new_test_user
+
+from ..tools.fake_device import FakeZKDevice
+from ..tools.user_cache import user_table_cache
+
+
+class ZKFakeDeviceCase(TransactionCase):
+    """حالة اختبار أساسية: جهاز بصمة وهمي محلي مرتبط بسجل zk.device
+
+    صلاحية وصول الأعضاء يحددها الاختبار مباشرة (self.valid_until) بدلاً من إنشاء اشتراكات،
+    والأجهزة الأخرى في قاعدة البيانات يتم إيقافها حتى لا تصلها أي عملية.
+    الجهاز الوهمي يبدأ كل اختبار فارغًا كجهاز جديد، ومستخدم المبيعات (self.salesman) يمثل من يستخدم
+    أزرار العميل فعليًا بصلاحية القراءة فقط على نماذج الأجهزة.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['zk.device'].search([]).write({'active': False})
+        cls.fake = cls._start_fake()
+        cls.device = cls._create_device(cls.fake, 'Fake ZK')
+        cls.salesman = new_test_user(cls.env, login='zk_salesman', groups='sales_team.group_sale_salesman')
+
+    @classmethod
+    def _start_fake(cls, **kwargs):
+        fake = FakeZKDevice(**kwargs).start()
+        cls.addClassCleanup(fake.stop)
+        return fake
+
+    @classmethod
+    def _create_device(cls, fake, name):
+        return cls.env['zk.device'].create({
+            'name': name,
+            'ip_address': '127.0.0.1',
+            'port': fake.port,
+            'protocol': fake.protocol,
+            'ommit_ping': True,
+            'time_out': 5,
+        })
+
+    def setUp(self):
+        super().setUp()
+        self._reset_fake(self.fake)
+        user_table_cache.invalidate()
+        self.addCleanup(user_table_cache.invalidate)
+        # {معرف الشريك: نهاية صلاحية الوصول} بدلاً من الاشتراكات
+        self.valid_until = {}
+        valid_until = self.valid_until
+        self.patch(type(self.env['res.partner']), '_get_access_valid_until',
+                   lambda partners: {pid: until for pid, until in valid_until.items() if pid in partners.ids})
+
+    def _reset_fake(self, fake):
+        with fake._lock:
+            fake.users.clear()
+            fake.templates.clear()
+            fake.attendance.clear()
+        fake.reset_counters()
+
+    def _create_member(self, user_id, active=True):
+        """إنشاء عميل بمعرف بصمة وصلاحية وصول سارية أو منتهية"""
+        partner = self.env['res.partner'].create({
+            'name': 'Member %s' % user_id,
+            'fingerprint_id': user_id,
+            'has_fingerprint': True,
+        })
+        self._set_access(partner, active)
+        return partner
+
+    def _set_access(self, partners, active, until=None):
+        """تعديل صلاحية وصول العملاء وإعادة حساب الحقول المخزنة التي تعتمد عليها"""
+        for partner in partners:
+            if active:
+                self.valid_until[partner.id] = until or fields.Datetime.now() + timedelta(days=30)
+            elif until:
+                self.valid_until[partner.id] = until
+            else:
+                self.valid_until.pop(partner.id, None)
+        partners._compute_access_valid_until()
+        partners._compute_has_active_subscription()
+
+    def _device_users(self, fake=None):
+        """جدول الجهاز الوهمي: قاموس {معرف البصمة: (الرقم الداخلي, الاسم)}"""
+        fake = fake or self.fake
+        with fake._lock:
+            return {user[6]: (user[0], user[3]) for user in fake.users.values()}
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from odoo.tests import tagged
+
+from .common import ZKFakeDeviceCase
+
+
+@tagged('post_install', '-at_install')
+class TestAttendanceIngest(ZKFakeDeviceCase):
+
+    def test_high_water_mark_stored_in_utc(self):
+        """علامة آخر بصمة تحفظ بالتوقيت العالمي، ولا يعاد استيراد ما سبق استيراده"""
+        self.device.write({'device_tz': 'Asia/Riyadh'})
+        self._create_member('100')
+        self.fake.add_users([('100', 'Member 100')])
+        self.fake.add_attendance('100', datetime(2026, 1, 10, 8, 0, 0))
+        self.fake.add_attendance('100', datetime(2026, 1, 10, 17, 30, 0))
+
+        self.assertEqual(self.device.ingest_attendance(), (2, 2))
+        self.assertEqual(self.device.attendance_hwm_timestamp, datetime(2026, 1, 10, 14, 30, 0))
+
+        self.fake.add_attendance('100', datetime(2026, 1, 11, 8, 0, 0))
+        self.assertEqual(self.device.ingest_attendance(), (1, 3))
+        self.assertEqual(self.device.attendance_hwm_timestamp, datetime(2026, 1, 11, 5, 0, 0))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import ZKFakeDeviceCase
+
+
+@tagged('post_install', '-at_install')
+class TestDeviceSnapshot(ZKFakeDeviceCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # جهاز بديل من نوع ZK6 (سجل مستخدم 28 بايت) عبر TCP، حيث يفترض pyzk حجم 72 بايت عند الاتصال
+        cls.target_fake = cls._start_fake(protocol='tcp', packet_size=28)
+        cls.target = cls._create_device(cls.target_fake, 'Fake ZK replacement')
+
+    def setUp(self):
+        super().setUp()
+        self._reset_fake(self.target_fake)
+        self.fake.add_users([(str(900 + index), 'Member %d' % index) for index in range(30)])
+        uids = sorted(self.fake.users)
+        self.fake.templates[(uids[0], 0)] = (1, b'A' * 400)
+        self.fake.templates[(uids[1], 6)] = (1, b'B' * 500)
+
+    def test_restore_snapshot_on_empty_replacement_device(self):
+        """استعادة لقطة على جهاز بديل فارغ بحجم سجل مختلف تنقل المستخدمين وقوالبهم كما هي"""
+        attachment = self.device.export_snapshot()
+        written, present, overwritten = self.target.restore_snapshot(attachment.raw)
+
+        self.assertEqual((written, present, overwritten), (30, 30, []))
+        self.assertEqual(self._device_users(self.target_fake), self._device_users(self.fake))
+        self.assertEqual(self.target_fake.templates, self.fake.templates)
+
+    def test_restore_snapshot_on_non_empty_device_requires_overwrite(self):
+        """الاستعادة على جهاز غير فارغ ترفض دون تأكيد، ومع التأكيد يتم الإبلاغ عن المستخدمين المستبدلين"""
+        self.target_fake.add_users([('1', 'Old admin')])
+        attachment = self.device.export_snapshot()
+
+        with self.assertRaises(UserError):
+            self.target.restore_snapshot(attachment.raw)
+        self.assertEqual(self._device_users(self.target_fake), {'1': (1, 'Old admin')})
+
+        written, present, overwritten = self.target.restore_snapshot(attachment.raw, overwrite=True)
+        self.assertEqual((written, present), (30, 30))
+        self.assertEqual([user.user_id for user in overwritten], ['1'])
+        self.assertEqual(self._device_users(self.target_fake), self._device_users(self.fake))
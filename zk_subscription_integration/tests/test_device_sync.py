@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from zk import const
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from ..models.zk_device import BREAKER_TRIAL_SECONDS
+from ..tools.fake_device import CMD_PREPARE_BUFFER
+from .common import ZKFakeDeviceCase
+
+
+@tagged('post_install', '-at_install')
+class TestDeviceSync(ZKFakeDeviceCase):
+
+    def test_full_reconcile_applies_minimal_diff(self):
+        """المطابقة الكاملة تضيف الناقص وتحذف المنتهي فقط، ولا تلمس مستخدمي الجهاز غير المعروفين"""
+        active = self._create_member('100')
+        expired = self._create_member('101', active=False)
+        missing = self._create_member('102')
+        self.fake.add_users([('100', 'Member 100'), ('101', 'Member 101'), ('1', 'Admin')])
+
+        self.device.sync_all_users(full=True)
+
+        self.assertEqual(set(self._device_users()), {'1', '100', '102'})
+        self.assertEqual(self.fake.commands.get(const.CMD_USER_WRQ), 1)
+        self.assertEqual(self.fake.commands.get(const.CMD_DELETE_USER), 1)
+        self.assertTrue(active.fingerprint_active)
+        self.assertTrue(missing.fingerprint_active)
+        self.assertFalse(expired.fingerprint_active)
+        # كتابات المزامنة نفسها لا تعتبر تغييرًا تعيد المزامنة التزايدية معالجته
+        self.assertFalse((active | expired | missing).filtered('zk_state_changed_at'))
+
+    def test_incremental_sync_only_touches_changed_members(self):
+        """المزامنة التزايدية تقتصر على من تغيرت حالته، والمطابقة الكاملة تصحح ما سواه"""
+        leaving = self._create_member('100')
+        self._create_member('101')
+        self._create_member('102', active=False)
+        self.fake.add_users([('100', 'Member 100'), ('101', 'Member 101')])
+        self.device.write({'sync_mode': 'incremental'})
+        self.device.sync_all_users(full=True)
+        self.assertTrue(self.device.sync_watermark)
+
+        # تعديل يدوي على الجهاز لعضو لم تتغير حالته، ثم انتهاء صلاحية عضو آخر دون أي تعديل عليه
+        self.fake.add_users([('102', 'Member 102')])
+        self._set_access(leaving, False, until=fields.Datetime.now() - timedelta(seconds=1))
+        self.device.sync_all_users(full=False)
+
+        self.assertEqual(set(self._device_users()), {'101', '102'})
+        self.assertFalse(leaving.fingerprint_active)
+
+        self.device.sync_all_users(full=True)
+        self.assertEqual(set(self._device_users()), {'101'})
+
+    def test_incremental_sync_without_changes_skips_device(self):
+        """لا اتصال بالجهاز إذا لم يتغير أي عضو منذ آخر مزامنة"""
+        self._create_member('100')
+        self.device.write({'sync_mode': 'incremental'})
+        self.device.sync_all_users(full=True)
+        self.fake.reset_counters()
+
+        self.device.sync_all_users(full=False)
+
+        self.assertEqual(self.fake.round_trips, 0)
+
+    def test_cached_user_table_never_allocates_used_uid(self):
+        """اختلاف عدد مستخدمي الجهاز عن الجدول المحفوظ يفرض قراءة جديدة، فلا يستبدل مستخدم سجل على الجهاز بعد حفظه"""
+        self._create_member('100')
+        self.fake.add_users([('100', 'Member 100')])
+        self.device.write({'sync_mode': 'incremental', 'user_cache_ttl': 300})
+        self.device.sync_all_users(full=True)
+
+        # تسجيل مستخدم على الجهاز من خارج Odoo بعد حفظ الجدول مؤقتًا، ثم تسجيل بصمة عضو جديد
+        self.fake.add_users([('555', 'Walk-in')])
+        newcomer = self.env['res.partner'].create({'name': 'Member 200', 'has_fingerprint': True})
+        self._set_access(newcomer, True)
+        newcomer.write({'fingerprint_id': '200'})
+        self.device.sync_all_users(full=False)
+
+        users = self._device_users()
+        self.assertEqual(set(users), {'100', '200', '555'})
+        self.assertEqual(users['555'][1], 'Walk-in')
+        self.assertEqual(len({uid for uid, _name in users.values()}), 3)
+
+    def test_cached_user_table_reused_after_own_writes(self):
+        """كتاباتنا تحدث الجدول المحفوظ، فالجلسة التالية تتحقق من عدد المستخدمين فقط دون قراءة الجدول"""
+        member = self._create_member('100')
+        self._create_member('101')
+        self.fake.add_users([('100', 'Member 100'), ('101', 'Member 101')])
+        self.device.sync_all_users(full=True)
+        member.with_user(self.salesman).action_disable_zk_biometric()
+        self.fake.reset_counters()
+
+        member.with_user(self.salesman).action_enable_zk_biometric()
+
+        self.assertEqual(set(self._device_users()), {'100', '101'})
+        self.assertEqual(self.fake.commands.get(const.CMD_GET_FREE_SIZES), 1)
+        self.assertFalse(self.fake.commands.get(CMD_PREPARE_BUFFER))
+
+    def test_revoked_member_templates_stored_before_delete(self):
+        """حذف المستخدم من الجهاز يحذف قوالبه، فيتم حفظها في المخزن المركزي قبل الحذف"""
+        member = self._create_member('100', active=False)
+        self.fake.add_users([('100', 'Member 100')])
+        uid = self._device_users()['100'][0]
+        self.fake.templates[(uid, 0)] = (1, b'T' * 400)
+
+        self.device.sync_all_users(full=True)
+
+        self.assertNotIn('100', self._device_users())
+        self.assertEqual(member.zk_template_ids.mapped('fid'), [0])
+        self.assertEqual(member.zk_template_ids._get_raw_template(), b'T' * 400)
+
+    def test_drift_follows_device_group_assignment(self):
+        """العضو النشط غير المخصص لمجموعة الجهاز يجب ألا يكون فيه، فلا يعتبر غيابه اختلافًا"""
+        group = self.env['zk.device.group'].create({'name': 'Branch A'})
+        other = self.env['zk.device.group'].create({'name': 'Branch B'})
+        self.device.write({'device_group_id': group.id})
+        inside = self._create_member('100')
+        outside = self._create_member('101')
+        outside.write({'zk_device_group_ids': [(6, 0, other.ids)]})
+        self.fake.add_users([('101', 'Member 101')])
+
+        self.device.sync_all_users(full=True)
+
+        self.assertEqual(set(self._device_users()), {'100'})
+        mirror = self.env['zk.device.user'].search([('device_id', '=', self.device.id)])
+        self.assertFalse(mirror.filtered('drift'))
+        self.assertTrue(inside.fingerprint_active)
+        self.assertTrue(outside.fingerprint_active)
+
+    def test_salesman_can_disable_member(self):
+        """مستخدم المبيعات (قراءة فقط على نماذج الأجهزة) يمكنه تعطيل عضو، وتحفظ السجلات التقنية للجلسة"""
+        member = self._create_member('100')
+        self._create_member('101')
+        self.fake.add_users([('100', 'Member 100'), ('101', 'Member 101')])
+        uid = self._device_users()['100'][0]
+        self.fake.templates[(uid, 0)] = (1, b'T' * 400)
+
+        member.with_user(self.salesman).action_disable_zk_biometric()
+
+        self.assertEqual(set(self._device_users()), {'101'})
+        self.assertFalse(member.fingerprint_active)
+        self.assertEqual(member.zk_template_ids.mapped('fid'), [0])
+        mirror = self.env['zk.device.user'].search([('device_id', '=', self.device.id), ('enabled', '=', True)])
+        self.assertEqual(mirror.mapped('user_id'), ['101'])
+        self.assertTrue(self.device.last_session_date)
+
+    def test_breaker_admits_single_trial(self):
+        """بعد انتهاء مدة الإيقاف يسمح باتصال تجريبي واحد، وباقي المتصلين يعاملون الجهاز كمتوقف"""
+        now = fields.Datetime.now()
+        self.device.write({'breaker_state': 'open', 'breaker_failures': 3, 'breaker_trips': 1,
+                           'breaker_open_until': now - timedelta(seconds=1)})
+
+        self.assertTrue(self.device._breaker_allows(now))
+        self.assertEqual(self.device.breaker_state, 'half_open')
+        self.assertFalse(self.device._breaker_allows(now))
+        with self.assertRaises(UserError):
+            self.device.sync_all_users(full=True)
+        # اختبار لم تسجل نتيجته ينتهي حجزه
+        self.assertTrue(self.device._breaker_allows(now + timedelta(seconds=BREAKER_TRIAL_SECONDS + 1)))
+
+        # الاتصال التجريبي الناجح يغلق القاطع
+        self.device.write({'breaker_state': 'open', 'breaker_open_until': now - timedelta(seconds=1)})
+        self.device.sync_all_users(full=True)
+        self.assertEqual(self.device.breaker_state, 'closed')
+
+    def test_transport_measurement_skips_session_bookkeeping(self):
+        """جلسات قياس البروتوكولات لا تحجز اتصالاً تجريبيًا ولا تسجل توقيتًا أو نسخة جدول أو نتيجة في القاطع"""
+        self.fake.add_users([('100', 'Member 100')])
+        self.device.write({'breaker_state': 'open', 'breaker_failures': 3, 'breaker_trips': 1,
+                           'breaker_open_until': fields.Datetime.now() - timedelta(seconds=1)})
+
+        measured = self.device._measure_transports()
+
+        self.assertEqual(measured[self.device.id]['tcp'][0], 1)
+        self.assertEqual((self.device.breaker_state, self.device.breaker_failures), ('open', 3))
+        self.assertFalse(self.device.last_session_date)
+        self.assertFalse(self.device.latency_profile)
+        self.assertFalse(self.env['zk.device.user'].search([('device_id', '=', self.device.id)]))
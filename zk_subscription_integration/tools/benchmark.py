@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""قياس أداء المزامنة مقابل أجهزة بصمة وهمية (N جهاز × M عضو)
+
+يتم التشغيل من داخل odoo shell على قاعدة بيانات تجريبية:
+
+    from odoo.addons.zk_subscription_integration.tools.benchmark import run_benchmark
+    run_benchmark(env, devices=4, members=2000, latency=0.005)
+
+يتم تنفيذ كل شيء داخل نقطة حفظ (savepoint) يتم التراجع عنها في النهاية، ويتم إيقاف الأجهزة الحقيقية
+مؤقتًا داخلها حتى لا تصلها أي عملية. لكل مرحلة يتم قياس الزمن الكلي وعدد الرحلات (طلب/رد) مع الأجهزة.
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from odoo import fields
+
+from .fake_device import FakeZKDevice
+
+_logger = logging.getLogger(__name__)
+
+# بداية معرفات البصمة للأعضاء الوهميين (أرقام لتوافق أجهزة ZK6)
+MEMBER_ID_OFFSET = 900000
+
+
+def _round_trips(fakes):
+    return sum(fake.round_trips for fake in fakes)
+
+
+def _phase(results, name, fakes, func):
+    """تنفيذ مرحلة واحدة وتسجيل زمنها وعدد رحلاتها"""
+    for fake in fakes:
+        fake.reset_counters()
+    start = time.monotonic()
+    func()
+    wall = time.monotonic() - start
+    trips = _round_trips(fakes)
+    results.append({
+        'phase': name,
+        'wall_time': wall,
+        'round_trips': trips,
+        'round_trips_per_device': trips / float(len(fakes) or 1),
+    })
+    _logger.info("مرحلة %s: %.2f ثانية، %d رحلة", name, wall, trips)
+
+
+def run_benchmark(env, devices=2, members=500, protocol='tcp', latency=0.002, jitter=0.0, loss=0.0,
+                  expired_ratio=0.1, sample_actions=10, max_workers=None):
+    """تشغيل سيناريوهات المزامنة على أجهزة وهمية وإرجاع قائمة نتائج لكل مرحلة
+
+    devices: عدد الأجهزة الوهمية
+    members: عدد الأعضاء، جميعهم موجودون في جدول كل جهاز في البداية
+    expired_ratio: نسبة الأعضاء الذين انتهت صلاحية وصولهم (لمرحلة الاشتراكات المنتهية)
+    sample_actions: عدد الأعضاء الذين يتم تنفيذ زر التعطيل ثم التفعيل عليهم واحدًا تلو الآخر
+    max_workers: قيمة مؤقتة لعدد الأجهزة التي تعالج بالتوازي
+    """
+    fakes = [
+        FakeZKDevice(protocol=protocol, latency=latency, jitter=jitter, loss=loss, seed=index,
+                     name='Bench %d' % index).start()
+        for index in range(devices)
+    ]
+    member_ids = [str(MEMBER_ID_OFFSET + index) for index in range(members)]
+    for fake in fakes:
+        fake.add_users([(user_id, 'Bench %s' % user_id) for user_id in member_ids])
+
+    results = []
+    env.cr.execute('SAVEPOINT zk_benchmark')
+    try:
+        Device = env['zk.device']
+        Device.search([]).write({'active': False})
+        if max_workers:
+            env['ir.config_parameter'].sudo().set_param('zk_subscription_integration.max_workers', max_workers)
+        zk_devices = Device.create([{
+            'name': fake.name,
+            'ip_address': '127.0.0.1',
+            'port': fake.port,
+            'protocol': protocol,
+            'ommit_ping': True,
+            'time_out': 10,
+        } for fake in fakes])
+        partners = env['res.partner'].create([{
+            'name': 'Bench %s' % user_id,
+            'fingerprint_id': user_id,
+            'has_fingerprint': True,
+            'fingerprint_active': True,
+            'zk_status': 'active',
+        } for user_id in member_ids])
+
+        # صلاحية الوصول حقل محسوب من الاشتراكات، نكتبها مباشرة لمحاكاة أعضاء منتهين وأعضاء فعالين
+        env.flush_all()
+        now = fields.Datetime.now()
+        expired_count = int(members * expired_ratio)
+        expired, valid = partners[:expired_count], partners[expired_count:]
+        if expired:
+            env.cr.execute('UPDATE res_partner SET access_valid_until = %s WHERE id IN %s',
+                           (now - timedelta(days=1), tuple(expired.ids)))
+        if valid:
+            env.cr.execute('UPDATE res_partner SET access_valid_until = %s WHERE id IN %s',
+                           (now + timedelta(days=30), tuple(valid.ids)))
+        partners.invalidate_recordset(['access_valid_until'])
+
+        sample = valid[:sample_actions]
+        _phase(results, 'partner_disable', fakes,
+               lambda: [partner.action_disable_zk_biometric() for partner in sample])
+        _phase(results, 'partner_enable', fakes,
+               lambda: [partner.action_enable_zk_biometric() for partner in sample])
+        _phase(results, 'check_expired_subscriptions', fakes,
+               lambda: env['sale.order'].check_expired_subscriptions())
+        _phase(results, 'sync_all_users', fakes,
+               lambda: [device.sync_all_users() for device in zk_devices])
+    finally:
+        env.flush_all()
+        env.cr.execute('ROLLBACK TO SAVEPOINT zk_benchmark')
+        env.invalidate_all(flush=False)
+        for fake in fakes:
+            fake.stop()
+
+    _logger.info("نتائج قياس الأداء (%d جهاز × %d عضو، %s، زمن استجابة %.1f ms):",
+                 devices, members, protocol, latency * 1000)
+    for result in results:
+        _logger.info("  %-30s %8.2f ثانية %8d رحلة (%.0f لكل جهاز)",
+                     result['phase'], result['wall_time'], result['round_trips'],
+                     result['round_trips_per_device'])
+    return results
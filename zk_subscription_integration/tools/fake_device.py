@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""جهاز بصمة ZK وهمي يعمل داخل نفس العملية لتجربة المزامنة وقياس أدائها دون أجهزة حقيقية
+
+يتحدث الجهاز الوهمي الجزء المستخدم في هذه الوحدة من بروتوكول ZK عبر TCP أو UDP:
+الاتصال وقطعه، قفل الجهاز وإعادة تفعيله، قراءة الأحجام، قراءة جدول المستخدمين والقوالب
+وسجل الحضور، كتابة المستخدمين (مع القوالب) وحذفهم، ومسح سجل الحضور.
+يمكن ضبط زمن الاستجابة ونسبة فقد الحزم وحجم الجدول الابتدائي، ويتم عدّ الرحلات (طلب/رد).
+
+مثال:
+    with FakeZKDevice(protocol='tcp', latency=0.005) as device:
+        device.add_users([(str(i), 'Member %d' % i) for i in range(1, 1001)])
+        zk = ZK('127.0.0.1', port=device.port, ommit_ping=True)
+"""
+
+import logging
+import random
+import socket
+import socketserver
+import threading
+import time
+from struct import pack, unpack
+
+_logger = logging.getLogger(__name__)
+
+CMD_DB_RRQ = 7
+CMD_USER_WRQ = 8
+CMD_USERTEMP_RRQ = 9
+CMD_OPTIONS_RRQ = 11
+CMD_ATTLOG_RRQ = 13
+CMD_CLEAR_ATTLOG = 15
+CMD_DELETE_USER = 18
+CMD_GET_FREE_SIZES = 50
+CMD_SAVE_USERTEMPS = 110
+CMD_CONNECT = 1000
+CMD_EXIT = 1001
+CMD_ENABLEDEVICE = 1002
+CMD_DISABLEDEVICE = 1003
+CMD_REFRESHDATA = 1013
+CMD_AUTH = 1102
+CMD_PREPARE_DATA = 1500
+CMD_DATA = 1501
+CMD_FREE_DATA = 1502
+CMD_PREPARE_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+CMD_ACK_OK = 2000
+CMD_ACK_ERROR = 2001
+CMD_ACK_UNAUTH = 2005
+
+FCT_FINGERTMP = 2
+FCT_USER = 5
+
+MACHINE_PREPARE_DATA_1 = 20560
+MACHINE_PREPARE_DATA_2 = 32130
+USHRT_MAX = 65535
+
+# حجم بيانات كل حزمة UDP عند إرسال محتوى ذاكرة القراءة
+UDP_CHUNK = 1024
+
+
+def _encode_time(t):
+    """ترميز الوقت بنفس صيغة ساعة الجهاز"""
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) * (24 * 60 * 60)
+        + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+
+def _commkey(key, session_id, ticks=50):
+    """مفتاح المصادقة المتوقع لكلمة مرور وجلسة (نفس خوارزمية الجهاز)"""
+    k = 0
+    for i in range(32):
+        k = (k << 1 | 1) if int(key) & (1 << i) else k << 1
+    k += int(session_id)
+    k = unpack('BBBB', pack('I', k))
+    k = pack('BBBB', k[0] ^ ord('Z'), k[1] ^ ord('K'), k[2] ^ ord('S'), k[3] ^ ord('O'))
+    k = unpack('HH', k)
+    k = unpack('BBBB', pack('HH', k[1], k[0]))
+    b = 0xff & ticks
+    return pack('BBBB', k[0] ^ b, k[1] ^ b, b, k[3] ^ b)
+
+
+def _cstr(value):
+    return value.split(b'\x00')[0].decode('utf-8', errors='ignore')
+
+
+class FakeZKDevice(object):
+    """جهاز ZK وهمي يستمع على 127.0.0.1
+
+    protocol: 'tcp' أو 'udp'
+    packet_size: حجم سجل المستخدم في الجهاز (72 لأجهزة ZK8 و28 لأجهزة ZK6)، افتراضيًا حسب البروتوكول
+    latency: زمن ثابت (ثانية) يضاف قبل كل رد
+    jitter: تذبذب عشوائي إضافي (ثانية) لزمن الرد
+    loss: احتمال فقد الرد (UDP يتم إسقاط الرد فتنتهي مهلة العميل، وTCP يتأخر الرد بزمن إعادة الإرسال)
+    password: كلمة مرور الجهاز (صفر بدون مصادقة)
+    """
+
+    def __init__(self, protocol='tcp', port=0, packet_size=None, latency=0.0, jitter=0.0, loss=0.0,
+                 retransmit_delay=0.2, password=0, seed=None, name='FakeZK'):
+        self.protocol = protocol
+        self.packet_size = packet_size or (72 if protocol == 'tcp' else 28)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.retransmit_delay = retransmit_delay
+        self.password = password
+        self.name = name
+        self.serial = 'FAKE%06d' % random.randint(0, 999999)
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        # uid -> (uid, privilege, password, name, card, group_id, user_id)
+        self.users = {}
+        # (uid, fid) -> (valid, template)
+        self.templates = {}
+        # [(uid, user_id, status, timestamp, punch)]
+        self.attendance = []
+        self.enabled = True
+        self.round_trips = 0
+        self.commands = {}
+        self._sessions = 0
+        # عنوان العميل -> حالة جلسة UDP
+        self._udp_states = {}
+        self._server = None
+        self._thread = None
+        self.port = port
+
+    # ---------------------------------------------------------------
+    # إدارة البيانات
+    # ---------------------------------------------------------------
+
+    def add_users(self, users):
+        """إضافة مستخدمين إلى الجدول: قائمة (user_id, الاسم)"""
+        with self._lock:
+            uid = max(self.users or [0])
+            for user_id, name in users:
+                uid += 1
+                self.users[uid] = (uid, 0, '', name, 0, '', str(user_id))
+
+    def add_attendance(self, user_id, timestamp, status=1, punch=0):
+        with self._lock:
+            uid = next((u[0] for u in self.users.values() if u[6] == str(user_id)), 0)
+            self.attendance.append((uid, str(user_id), status, timestamp, punch))
+
+    def user_ids(self):
+        """معرفات البصمة الموجودة حاليًا في الجدول"""
+        with self._lock:
+            return {user[6] for user in self.users.values()}
+
+    def reset_counters(self):
+        with self._lock:
+            self.round_trips = 0
+            self.commands = {}
+
+    # ---------------------------------------------------------------
+    # تشغيل الخادم
+    # ---------------------------------------------------------------
+
+    def start(self):
+        device = self
+
+        if self.protocol == 'tcp':
+            class Handler(socketserver.BaseRequestHandler):
+                def handle(self):
+                    device._serve_tcp(self.request)
+
+            server_class = socketserver.ThreadingTCPServer
+        else:
+            class Handler(socketserver.BaseRequestHandler):
+                def handle(self):
+                    data, sock = self.request
+                    device._serve_udp(data, sock, self.client_address)
+
+            server_class = socketserver.ThreadingUDPServer
+        server_class.allow_reuse_address = True
+        server_class.daemon_threads = True
+        self._server = server_class(('127.0.0.1', self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake_zk_%d' % self.port,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------------------------------------------------------------
+    # طبقة النقل
+    # ---------------------------------------------------------------
+
+    def _serve_tcp(self, sock):
+        # كل اتصال TCP له حالة جلسة خاصة (ذاكرة القراءة والكتابة)
+        state = {}
+        while True:
+            top = self._recv_exact(sock, 8)
+            if not top:
+                return
+            magic1, magic2, length = unpack('<HHI', top)
+            if (magic1, magic2) != (MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2):
+                return
+            packet = self._recv_exact(sock, length)
+            if not packet:
+                return
+            replies, close = self._dispatch(packet, state)
+            for reply in replies:
+                if self._drop():
+                    time.sleep(self.retransmit_delay)
+                sock.sendall(pack('<HHI', MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2, len(reply)) + reply)
+            if close:
+                return
+
+    def _serve_udp(self, packet, sock, address):
+        with self._lock:
+            state = self._udp_states.setdefault(address, {})
+        replies, close = self._dispatch(packet, state)
+        for reply in replies:
+            if self._drop():
+                # الرد مفقود، ستنتهي مهلة العميل
+                return
+            sock.sendto(reply, address)
+        if close:
+            with self._lock:
+                self._udp_states.pop(address, None)
+
+    @staticmethod
+    def _recv_exact(sock, size):
+        data = b''
+        while len(data) < size:
+            try:
+                chunk = sock.recv(size - len(data))
+            except (ConnectionError, socket.timeout):
+                return None
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _drop(self):
+        return self.loss and self._random.random() < self.loss
+
+    # ---------------------------------------------------------------
+    # معالجة الأوامر
+    # ---------------------------------------------------------------
+
+    def _dispatch(self, packet, state):
+        """معالجة طلب واحد وإرجاع (قائمة الردود, إغلاق الجلسة)"""
+        command, _checksum, session_id, reply_id = unpack('<4H', packet[:8])
+        payload = packet[8:]
+        with self._lock:
+            self.round_trips += 1
+            self.commands[command] = self.commands.get(command, 0) + 1
+        delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        def reply(code, data=b''):
+            return pack('<4H', code, 0, state.get('session', session_id), reply_id) + data
+
+        handler = getattr(self, '_cmd_%d' % command, None)
+        if command == CMD_CONNECT:
+            with self._lock:
+                self._sessions += 1
+                state['session'] = self._sessions % USHRT_MAX
+            code = CMD_ACK_UNAUTH if self.password else CMD_ACK_OK
+            return [reply(code)], False
+        if command == CMD_AUTH:
+            ok = payload == _commkey(self.password, state.get('session', session_id))
+            return [reply(CMD_ACK_OK if ok else CMD_ACK_UNAUTH)], False
+        if command == CMD_EXIT:
+            return [reply(CMD_ACK_OK)], True
+        if handler is None:
+            # أوامر غير مدعومة تعامل كأوامر ناجحة بلا بيانات
+            return [reply(CMD_ACK_OK)], False
+        try:
+            with self._lock:
+                result = handler(payload, state)
+        except Exception as e:
+            _logger.warning("خطأ في الجهاز الوهمي أثناء تنفيذ الأمر %s: %s", command, str(e))
+            return [reply(CMD_ACK_ERROR)], False
+        if isinstance(result, list):
+            return [reply(code, data) for code, data in result], False
+        code, data = result if isinstance(result, tuple) else (CMD_ACK_OK, b'')
+        return [reply(code, data)], False
+
+    def _cmd_1002(self, payload, state):
+        self.enabled = True
+
+    def _cmd_1003(self, payload, state):
+        self.enabled = False
+
+    def _cmd_11(self, payload, state):
+        key = _cstr(payload)
+        values = {'~DeviceName': self.name, '~SerialNumber': self.serial}
+        return CMD_ACK_OK, ('%s=%s' % (key, values.get(key, ''))).encode() + b'\x00'
+
+    def _cmd_50(self, payload, state):
+        fields = [0] * 20
+        fields[4] = len(self.users)
+        fields[6] = len(self.templates)
+        fields[8] = len(self.attendance)
+        fields[14] = 3000
+        fields[15] = 10000
+        fields[16] = 100000
+        fields[17] = fields[14] - fields[6]
+        fields[18] = fields[15] - fields[4]
+        fields[19] = fields[16] - fields[8]
+        return CMD_ACK_OK, pack('20i', *fields) + pack('3i', 0, 0, 0)
+
+    def _cmd_1502(self, payload, state):
+        state.pop('read_buffer', None)
+        state.pop('write_buffer', None)
+
+    def _cmd_1013(self, payload, state):
+        pass
+
+    def _cmd_15(self, payload, state):
+        self.attendance = []
+
+    def _cmd_18(self, payload, state):
+        uid = unpack('h', payload[:2])[0]
+        if uid not in self.users:
+            return CMD_ACK_ERROR, b''
+        del self.users[uid]
+        for key in [key for key in self.templates if key[0] == uid]:
+            del self.templates[key]
+
+    def _cmd_8(self, payload, state):
+        if len(payload) >= 72:
+            uid, privilege, password, name, card, group_id, user_id = unpack('<HB8s24s4sx7sx24s', payload[:72])
+            card = unpack('<I', card)[0]
+            group_id = _cstr(group_id)
+        else:
+            uid, privilege, password, name, card, group_id, _tz, user_id = unpack('<HB5s8sIxBHI', payload[:28])
+            group_id = str(group_id)
+            user_id = str(user_id).encode()
+        self._store_user(uid, privilege, _cstr(password), _cstr(name), card, group_id, _cstr(user_id))
+
+    def _store_user(self, uid, privilege, password, name, card, group_id, user_id):
+        # معرف البصمة فريد في الجهاز، مستخدم آخر بنفس المعرف يتم استبداله
+        for other_uid in [u[0] for u in self.users.values() if u[6] == user_id and u[0] != uid]:
+            del self.users[other_uid]
+        self.users[uid] = (uid, privilege, password, name, card, group_id, user_id)
+
+    def _cmd_1500(self, payload, state):
+        state['write_buffer'] = b''
+        state['write_size'] = unpack('I', payload[:4])[0]
+
+    def _cmd_1501(self, payload, state):
+        state['write_buffer'] = state.get('write_buffer', b'') + payload
+
+    def _cmd_110(self, payload, state):
+        """حفظ مستخدم أو أكثر مع قوالب بصماتهم من ذاكرة الكتابة (save_user_template أو دفعة كاملة)"""
+        buffer = state.pop('write_buffer', b'')
+        upack_size, table_size, fpack_size = unpack('III', buffer[:12])
+        upack = buffer[12:12 + upack_size]
+        table = buffer[12 + upack_size:12 + upack_size + table_size]
+        fpack = buffer[12 + upack_size + table_size:]
+        record_size = 29 if self.packet_size == 28 else 73
+        for offset in range(0, len(upack), record_size):
+            record = upack[offset:offset + record_size]
+            if record_size == 29:
+                _m, uid, privilege, password, name, card, group_id, _tz, user_id = unpack('<BHB5s8sIxBhI', record)
+                self._store_user(uid, privilege, _cstr(password), _cstr(name), card, str(group_id), str(user_id))
+            else:
+                _m, uid, privilege, password, name, card, _x, group_id, user_id = unpack('<BHB8s24sIB7sx24s', record)
+                self._store_user(uid, privilege, _cstr(password), _cstr(name), card, _cstr(group_id),
+                                 _cstr(user_id))
+        for offset in range(0, len(table), 8):
+            _t, tuid, fnum, start = unpack('<bHbI', table[offset:offset + 8])
+            size = unpack('H', fpack[start:start + 2])[0]
+            self.templates[(tuid, fnum - 0x10)] = (1, fpack[start + 2:start + 2 + size])
+
+    def _cmd_1503(self, payload, state):
+        """تجهيز ذاكرة قراءة لجدول كامل (read_with_buffer)"""
+        _one, command, fct, _ext = unpack('<bhii', payload[:11])
+        if command == CMD_USERTEMP_RRQ and fct == FCT_USER:
+            data = self._pack_users()
+        elif command == CMD_DB_RRQ and fct == FCT_FINGERTMP:
+            data = self._pack_templates()
+        elif command == CMD_ATTLOG_RRQ:
+            data = self._pack_attendance()
+        else:
+            return CMD_ACK_ERROR, b''
+        if self.protocol == 'tcp':
+            # عبر TCP يتم إرسال الجدول كاملاً في رد واحد
+            return CMD_DATA, data
+        state['read_buffer'] = data
+        return CMD_ACK_OK, b'\x00' + pack('I', len(data)) + b'\x00' * 4
+
+    def _cmd_1504(self, payload, state):
+        """قراءة جزء من ذاكرة القراءة عبر UDP: تجهيز ثم حزم بيانات ثم تأكيد"""
+        start, size = unpack('<ii', payload[:8])
+        data = state.get('read_buffer', b'')[start:start + size]
+        replies = [(CMD_PREPARE_DATA, pack('I', len(data)))]
+        for offset in range(0, len(data), UDP_CHUNK):
+            replies.append((CMD_DATA, data[offset:offset + UDP_CHUNK]))
+        replies.append((CMD_ACK_OK, b''))
+        return replies
+
+    def _pack_users(self):
+        records = []
+        for uid, privilege, password, name, card, group_id, user_id in sorted(self.users.values()):
+            if self.packet_size == 28:
+                records.append(pack('<HB5s8sIxBhI', uid, privilege, password.encode(), name.encode(), card,
+                                    int(group_id or 0), 0, int(user_id)))
+            else:
+                records.append(pack('<HB8s24sIx7sx24s', uid, privilege, password.encode(), name.encode(), card,
+                                    str(group_id).encode(), user_id.encode()))
+        body = b''.join(records)
+        return pack('I', len(body)) + body
+
+    def _pack_templates(self):
+        records = []
+        for (uid, fid), (valid, template) in sorted(self.templates.items()):
+            records.append(pack('HHbb', len(template) + 6, uid, fid, valid) + template)
+        body = b''.join(records)
+        return pack('i', len(body)) + body
+
+    def _pack_attendance(self):
+        records = []
+        for uid, user_id, status, timestamp, punch in self.attendance:
+            records.append(pack('<H24sB4sB8s', uid, user_id.encode(), status,
+                                pack('<I', _encode_time(timestamp)), punch, b''))
+        body = b''.join(records)
+        return pack('I', len(body)) + body
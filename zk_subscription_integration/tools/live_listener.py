@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from collections import deque
+
+_logger = logging.getLogger(__name__)
+
+
+class LiveCaptureListener(threading.Thread):
+    """خيط يحتفظ باتصال التقاط مباشر مع جهاز بصمة ويضع كل بصمة في ذاكرة محدودة
+
+    لا يصل الخيط إلى قاعدة البيانات إطلاقًا؛ يقوم الخيط المالك بتفريغ الذاكرة وحفظها على دفعات.
+    عند انقطاع الاتصال يعيد الخيط الاتصال تلقائيًا مع تأخير متزايد.
+    """
+
+    def __init__(self, name, zk, buffer_size, poll_timeout=1, max_backoff=60):
+        super(LiveCaptureListener, self).__init__(name='zk_live_%s' % name, daemon=True)
+        self.device_name = name
+        self.zk = zk
+        self.poll_timeout = poll_timeout
+        self.max_backoff = max_backoff
+        self.events = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.reconnects = 0
+        self._stop_event = threading.Event()
+        self._conn = None
+
+    def stop(self):
+        """طلب إيقاف الخيط، ويتوقف خلال مهلة الانتظار (poll_timeout)"""
+        self._stop_event.set()
+        conn = self._conn
+        if conn:
+            conn.end_live_capture = True
+
+    def drain(self):
+        """سحب جميع البصمات المتراكمة في الذاكرة"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.popleft())
+            except IndexError:
+                return events
+
+    def run(self):
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self._conn = self.zk.connect()
+                backoff = 1
+                _logger.info("بدأ الالتقاط المباشر من جهاز %s", self.device_name)
+                for attendance in self._conn.live_capture(new_timeout=self.poll_timeout):
+                    if self._stop_event.is_set():
+                        self._conn.end_live_capture = True
+                    if attendance is None:
+                        continue
+                    if len(self.events) == self.events.maxlen:
+                        self.dropped += 1
+                    self.events.append(attendance)
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                self.reconnects += 1
+                _logger.warning("انقطع الالتقاط المباشر من جهاز %s (%s)، إعادة الاتصال بعد %s ثانية",
+                                self.device_name, str(e), backoff)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                conn, self._conn = self._conn, None
+                if conn:
+                    try:
+                        conn.disconnect()
+                    except Exception:
+                        pass
+        _logger.info("توقف الالتقاط المباشر من جهاز %s", self.device_name)
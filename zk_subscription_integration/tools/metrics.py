@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import os
+import tempfile
+import threading
+import time
+
+from .timeouts import apply_socket_timeout
+
+# حدود فئات المدرج التكراري لمدة العمليات (بالثانية)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# عمليات مكتبة ZK التي يتم قياس زمنها
+INSTRUMENTED_OPERATIONS = (
+    'connect', 'disconnect', 'disable_device', 'enable_device',
+    'get_users', 'set_user', 'delete_user', 'save_user_template',
+    'get_templates', 'get_attendance', 'clear_attendance',
+)
+
+
+class _Series(object):
+    """مدرج تكراري وعدادات نجاح/فشل لعملية واحدة على جهاز واحد"""
+
+    __slots__ = ('buckets', 'total', 'count', 'success', 'failure', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.success = 0
+        self.failure = 0
+        self.max = 0.0
+
+    def observe(self, duration, ok):
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+        self.total += duration
+        self.count += 1
+        self.max = max(self.max, duration)
+        if ok:
+            self.success += 1
+        else:
+            self.failure += 1
+
+
+class DeviceMetrics(object):
+    """سجل قياسات زمن عمليات أجهزة البصمة مصنفة حسب الجهاز والعملية
+
+    السجل خاص بكل عملية (process) من عمليات Odoo وآمن للاستخدام من عدة خيوط.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (اسم الجهاز, العملية) -> _Series
+        self._series = {}
+
+    def observe(self, device, operation, duration, ok=True):
+        """تسجيل مدة عملية واحدة بالثانية"""
+        with self._lock:
+            series = self._series.get((device, operation))
+            if series is None:
+                series = self._series[(device, operation)] = _Series()
+            series.observe(duration, ok)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render_prometheus(self):
+        """إخراج جميع القياسات بتنسيق Prometheus النصي
+
+        يتم إضافة رقم العملية (pid) لكل سلسلة لأن كل عامل من عمال Odoo يحتفظ بقياساته الخاصة.
+        """
+        pid = os.getpid()
+        lines = [
+            '# HELP zk_device_operation_duration_seconds مدة عمليات أجهزة البصمة',
+            '# TYPE zk_device_operation_duration_seconds histogram',
+        ]
+        counters = [
+            '# HELP zk_device_operation_total عدد عمليات أجهزة البصمة حسب النتيجة',
+            '# TYPE zk_device_operation_total counter',
+        ]
+        with self._lock:
+            items = sorted(self._series.items())
+            for (device, operation), series in items:
+                labels = 'device="%s",operation="%s",pid="%d"' % (_escape(device), operation, pid)
+                for bound, count in zip(DURATION_BUCKETS, series.buckets):
+                    lines.append('zk_device_operation_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+                lines.append('zk_device_operation_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, series.count))
+                lines.append('zk_device_operation_duration_seconds_sum{%s} %.6f' % (labels, series.total))
+                lines.append('zk_device_operation_duration_seconds_count{%s} %d' % (labels, series.count))
+                counters.append('zk_device_operation_total{%s,result="success"} %d' % (labels, series.success))
+                counters.append('zk_device_operation_total{%s,result="failure"} %d' % (labels, series.failure))
+        return '\n'.join(lines + counters) + '\n'
+
+    def write_textfile(self, directory):
+        """كتابة القياسات في ملف خاص بالعملية الحالية داخل directory (لمجمّع ملفات Prometheus النصية)
+
+        تتم الكتابة في ملف مؤقت ثم استبداله لكي لا يقرأ المجمّع ملفًا ناقصًا.
+        """
+        path = os.path.join(directory, 'zk_device_%d.prom' % os.getpid())
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.zk_device_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+                handle.write(self.render_prometheus())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return path
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def instrument(zk, device, timeouts=None, default_timeout=None):
+    """تغليف عمليات كائن ZK واحد لقياس زمن كل استدعاء
+
+    يتم التغليف على مستوى الكائن نفسه، لذلك يبقى الكائن من نفس النوع ويستمر القياس
+    على الاتصال الذي يعيده connect(). آخر القياسات متاحة في zk.operation_timings
+    كقائمة (العملية, المدة بالثانية, نجاح) لعرضها بعد انتهاء الجلسة.
+    timeouts: قاموس {العملية: مهلة بالثانية} تضبط على المقبس قبل كل عملية،
+    وباقي العمليات تستخدم default_timeout. تتم استعادة المهلة السابقة بعد كل عملية حتى عند الفشل،
+    فلا تبقى مهلة عملية قصيرة على الأوامر غير المقاسة التي تليها.
+    """
+    zk.operation_timings = []
+
+    def wrap(operation, method):
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            previous = apply_socket_timeout(zk, timeouts.get(operation, default_timeout)) if timeouts else None
+            start = time.monotonic()
+            ok = False
+            try:
+                result = method(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                duration = time.monotonic() - start
+                if previous is not None:
+                    apply_socket_timeout(zk, previous)
+                device_metrics.observe(device, operation, duration, ok)
+                zk.operation_timings.append((operation, duration, ok))
+        return timed
+
+    for operation in INSTRUMENTED_OPERATIONS:
+        method = getattr(zk, operation, None)
+        if method is not None:
+            setattr(zk, operation, wrap(operation, method))
+    return zk
+
+
+def summarize_timings(timings):
+    """ملخص نصي لقياسات جلسة واحدة: عدد الاستدعاءات والمتوسط والأقصى والفشل لكل عملية"""
+    grouped = {}
+    for operation, duration, ok in timings:
+        calls, total, worst, failed = grouped.get(operation, (0, 0.0, 0.0, 0))
+        grouped[operation] = (calls + 1, total + duration, max(worst, duration), failed + (not ok))
+    lines = []
+    for operation, (calls, total, worst, failed) in sorted(grouped.items(), key=lambda item: -item[1][1]):
+        lines.append('%s: %d × متوسط %.0f ms، أقصى %.0f ms، المجموع %.0f ms%s' % (
+            operation, calls, total / calls * 1000, worst * 1000, total * 1000,
+            ('، فشل %d' % failed) if failed else ''))
+    return '\n'.join(lines)
+
+
+device_metrics = DeviceMetrics()
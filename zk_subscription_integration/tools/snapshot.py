@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""لقطة مضغوطة لجدول مستخدمي جهاز البصمة وقوالبه، لتجهيز جهاز بديل دفعة واحدة
+
+التنسيق: JSON مضغوط بـ gzip يحتوي على المستخدمين كقوائم
+[uid, user_id, name, privilege, password, group_id, card] والقوالب كقوائم [uid, fid, valid, base64].
+"""
+
+import base64
+import gzip
+import json
+from struct import pack
+
+from zk.exception import ZKErrorResponse
+from zk.finger import Finger
+from zk.user import User
+
+SNAPSHOT_VERSION = 1
+# عدد المستخدمين في كل ذاكرة كتابة عند الاستعادة (يحد من حجم الذاكرة المطلوبة في الجهاز)
+RESTORE_BATCH_SIZE = 500
+# أمر حفظ المستخدمين مع قوالبهم من ذاكرة الكتابة (CMD_SAVE_USERTEMPS)
+CMD_SAVE_USERTEMPS = 110
+# أحجام سجل المستخدم المعروفة: 28 بايت لأجهزة ZK6 و72 بايت لأجهزة ZK8
+USER_PACKET_SIZES = (28, 72)
+# مستخدم الاختبار المؤقت لتحديد حجم السجل في جهاز فارغ (معرف رقمي ليتوافق مع أجهزة ZK6)
+PROBE_UID = 1
+PROBE_USER_ID = '999999'
+
+
+def dump_snapshot(users, fingers, meta=None):
+    """تحويل جدول المستخدمين والقوالب (كائنات pyzk) إلى لقطة مضغوطة (bytes)"""
+    payload = dict(meta or {})
+    payload.update({
+        'version': SNAPSHOT_VERSION,
+        'users': [
+            [user.uid, str(user.user_id), user.name, user.privilege, user.password, user.group_id, user.card]
+            for user in users
+        ],
+        'templates': [
+            [finger.uid, finger.fid, finger.valid, base64.b64encode(finger.template).decode('ascii')]
+            for finger in fingers
+        ],
+    })
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return gzip.compress(data)
+
+
+def load_snapshot(data):
+    """قراءة لقطة مضغوطة وإرجاع (بيانات اللقطة, قائمة [(مستخدم, [قوالب])])"""
+    payload = json.loads(gzip.decompress(data).decode('utf-8'))
+    if payload.get('version') != SNAPSHOT_VERSION:
+        raise ValueError("unsupported snapshot version: %s" % payload.get('version'))
+    fingers_by_uid = {}
+    for uid, fid, valid, template in payload.pop('templates'):
+        fingers_by_uid.setdefault(uid, []).append(Finger(uid, fid, valid, base64.b64decode(template)))
+    user_templates = [
+        (User(uid, name, privilege, password, group_id, user_id, card), fingers_by_uid.get(uid, []))
+        for uid, user_id, name, privilege, password, group_id, card in payload.pop('users')
+    ]
+    return payload, user_templates
+
+
+def detect_user_packet_size(conn, hint=None):
+    """تحديد حجم سجل المستخدم في جهاز متصل قبل الكتابة بالدفعات، وإرجاع جدول المستخدمين الحالي
+
+    pyzk يحدد الحجم فقط عند قراءة جدول غير فارغ، أما في الجهاز الفارغ (الجهاز البديل عادةً) فيبقى
+    الافتراضي الذي ضبطه connect() وقد لا يطابق الجهاز. لذلك يتم في الجهاز الفارغ كتابة مستخدم اختبار
+    بكل حجم محتمل (بدءًا بـ hint، حجم الجهاز المصدر) ثم قراءة الجدول لمعرفة الحجم الفعلي من رد الجهاز،
+    وحذف كل ما ظهر في الجدول بعدها لأنه كان فارغًا.
+    إذا تعذر التحديد يتم رفع ZKErrorResponse قبل كتابة أي بيانات.
+    يعيد قائمة مستخدمي الجهاز قبل الكتابة
+    """
+    users = conn.get_users()
+    if users:
+        if conn.user_packet_size not in USER_PACKET_SIZES:
+            raise ZKErrorResponse("Unknown user packet size %s" % conn.user_packet_size)
+        conn.user_packet_size = int(conn.user_packet_size)
+        return users
+    candidates = []
+    for size in (hint, conn.user_packet_size) + USER_PACKET_SIZES:
+        if size in USER_PACKET_SIZES and size not in candidates:
+            candidates.append(int(size))
+    for size in candidates:
+        conn.user_packet_size = size
+        found = []
+        try:
+            conn.set_user(uid=PROBE_UID, name='probe', user_id=PROBE_USER_ID)
+            found = conn.get_users()
+        except ZKErrorResponse:
+            pass
+        detected = conn.user_packet_size
+        for user in found:
+            conn.delete_user(uid=user.uid)
+        if found and detected in USER_PACKET_SIZES:
+            conn.user_packet_size = int(detected)
+            return []
+    raise ZKErrorResponse("Can't determine user packet size of an empty device")
+
+
+def save_user_templates(conn, user_templates, batch_size=RESTORE_BATCH_SIZE):
+    """كتابة مستخدمين مع قوالبهم على جهاز متصل بذاكرات كتابة كبيرة بدلاً من أمر لكل مستخدم
+
+    نفس تنسيق save_user_template في pyzk لكن لعدة مستخدمين في ذاكرة واحدة،
+    مع تحديث بيانات الجهاز مرة واحدة في النهاية. يعيد عدد المستخدمين المكتوبين.
+    يجب تحديد حجم سجل المستخدم (detect_user_packet_size) في نفس الجلسة قبل الاستدعاء، لأن القيمة
+    الافتراضية عند الاتصال قد لا تطابق الجهاز.
+    """
+    if conn.user_packet_size not in USER_PACKET_SIZES:
+        raise ZKErrorResponse("Unknown user packet size %s" % conn.user_packet_size)
+    written = 0
+    for start in range(0, len(user_templates), batch_size):
+        upack = b''
+        table = b''
+        fpack = b''
+        for user, fingers in user_templates[start:start + batch_size]:
+            upack += user.repack29() if conn.user_packet_size == 28 else user.repack73()
+            for finger in fingers:
+                template = finger.repack_only()
+                table += pack('<bHbI', 2, user.uid, 0x10 + finger.fid, len(fpack))
+                fpack += template
+        conn._send_with_buffer(pack('III', len(upack), len(table), len(fpack)) + upack + table + fpack)
+        response = conn._ZK__send_command(CMD_SAVE_USERTEMPS, pack('<IHH', 12, 0, 8))
+        if not response.get('status'):
+            raise ZKErrorResponse("Can't save user batch at %d" % start)
+        written += len(user_templates[start:start + batch_size])
+    conn.refresh_data()
+    return written
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""مهلات تكيفية لكل عملية على جهاز البصمة، مشتقة من أزمنة الاستجابة المسجلة
+
+تحتفظ كل جهاز بآخر عينات ناجحة لكل عملية (بالثانية)، وتحسب مهلة كل عملية من نسبة مئوية عالية
+للعينات مضروبة في معامل أمان، ضمن حد أدنى وأعلى. الأوامر الصغيرة تفشل بسرعة، والقراءات الكبيرة
+(مثل جدول المستخدمين) تأخذ الوقت الذي تحتاجه فعليًا.
+"""
+
+import math
+import threading
+
+# عدد العينات المحفوظة لكل عملية
+MAX_SAMPLES = 50
+# أقل عدد عينات قبل الاعتماد على المهلة المشتقة
+MIN_SAMPLES = 5
+# النسبة المئوية المستخدمة من العينات
+PERCENTILE = 0.95
+# معامل الأمان فوق النسبة المئوية وهامش ثابت (ثانية) لتذبذب الشبكة
+SAFETY_FACTOR = 3.0
+SAFETY_MARGIN = 0.5
+# التغير النسبي في مهلة أي عملية الذي يعتبر ملموسًا ويستدعي حفظ ملف الأزمنة فورًا
+MATERIAL_CHANGE = 0.2
+
+
+def percentile(samples, q):
+    """النسبة المئوية q (بين 0 و1) لقائمة عينات بطريقة أقرب رتبة"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, int(math.ceil(q * len(ordered))))
+    return ordered[rank - 1]
+
+
+def record_samples(profile, timings, max_samples=MAX_SAMPLES):
+    """إضافة أزمنة العمليات الناجحة لجلسة إلى ملف الأزمنة وإرجاع نسخة محدثة
+
+    profile: قاموس {العملية: [أزمنة بالثانية]}
+    timings: قائمة (العملية, المدة, نجاح) من جلسة واحدة
+    """
+    profile = {operation: list(samples) for operation, samples in (profile or {}).items()}
+    for operation, duration, ok in timings:
+        if not ok:
+            continue
+        samples = profile.setdefault(operation, [])
+        samples.append(round(duration, 4))
+        del samples[:-max_samples]
+    return profile
+
+
+def derive_timeouts(profile, floor, ceiling):
+    """حساب مهلة كل عملية لديها عينات كافية: قاموس {العملية: مهلة بالثانية}"""
+    timeouts = {}
+    for operation, samples in (profile or {}).items():
+        if len(samples) < MIN_SAMPLES:
+            continue
+        value = percentile(samples, PERCENTILE) * SAFETY_FACTOR + SAFETY_MARGIN
+        timeouts[operation] = min(max(value, floor), ceiling)
+    return timeouts
+
+
+def timeouts_changed(old, new, tolerance=MATERIAL_CHANGE):
+    """هل تغيرت المهلات المشتقة تغيرًا ملموسًا: عملية أصبحت لها مهلة أو فقدتها، أو تغير نسبي أكبر من tolerance"""
+    if set(old) != set(new):
+        return True
+    return any(abs(new[operation] - value) > tolerance * value for operation, value in old.items())
+
+
+class PendingSamples(object):
+    """أزمنة الجلسات التي لم تحفظ بعد في ملف أزمنة الجهاز
+
+    يتم تجميع الأزمنة في الذاكرة وحفظها في قاعدة البيانات فقط عند تغير ملموس في المهلات أو بعد
+    تجمع نافذة عينات كاملة، بدلاً من كتابة سجل الجهاز بعد كل جلسة.
+    الذاكرة خاصة بكل عملية (process) من عمليات Odoo وآمنة للاستخدام من عدة خيوط.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # المفتاح -> قائمة (العملية, المدة, نجاح)
+        self._timings = {}
+
+    def add(self, key, timings):
+        """إضافة أزمنة جلسة وإرجاع جميع الأزمنة غير المحفوظة للمفتاح"""
+        with self._lock:
+            pending = self._timings.setdefault(key, [])
+            pending.extend(timings)
+            del pending[:-MAX_SAMPLES * 10]
+            return list(pending)
+
+    def clear(self, key=None):
+        """مسح أزمنة جهاز واحد بعد حفظها، أو جميع الأجهزة إذا لم يحدد المفتاح"""
+        with self._lock:
+            if key is None:
+                self._timings.clear()
+            else:
+                self._timings.pop(key, None)
+
+
+def supports_socket_timeout(zk):
+    """هل يسمح إصدار pyzk المثبت بتغيير مهلة الاتصال بعد إنشائه
+
+    المهلة محفوظة في متغير خاص (ZK.__timeout) تم اختباره مع pyzk 0.9، فإذا تغير اسمه في إصدار آخر
+    يتم الاكتفاء بالمهلة الثابتة بدلاً من ضبط متغير لا تستخدمه المكتبة.
+    """
+    return hasattr(zk, '_ZK__timeout')
+
+
+def apply_socket_timeout(zk, seconds):
+    """ضبط مهلة مقبس الاتصال الحالي لكائن ZK، ومهلة المقابس التي ينشئها لاحقًا عند connect
+
+    يعيد المهلة السابقة لاستعادتها بعد العملية، أو None إذا كان إصدار pyzk لا يدعم ذلك.
+    """
+    if not supports_socket_timeout(zk):
+        return None
+    previous = zk._ZK__timeout
+    zk._ZK__timeout = seconds
+    sock = getattr(zk, '_ZK__sock', None)
+    if sock is not None and sock.fileno() != -1:
+        sock.settimeout(seconds)
+    return previous
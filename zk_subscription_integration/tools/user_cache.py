@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class UserTableCache(object):
+    """ذاكرة مؤقتة لجداول مستخدمي أجهزة البصمة مفهرسة بمعرف البصمة (user_id)
+
+    كل جدول محفوظ لمدة صلاحية (TTL) محددة، ويتم تحديثه مباشرة عند كل كتابة نقوم بها على الجهاز.
+    الذاكرة خاصة بكل عملية (process) من عمليات Odoo وآمنة للاستخدام من عدة خيوط.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # المفتاح -> (وقت انتهاء الصلاحية, {user_id: مستخدم الجهاز}, حجم حزمة المستخدم)
+        self._tables = {}
+
+    def get(self, key):
+        """إرجاع نسخة من الجدول إذا كان صالحًا، وإلا None"""
+        with self._lock:
+            entry = self._tables.get(key)
+            if not entry:
+                return None
+            expires_at, users, _packet_size = entry
+            if expires_at < time.monotonic():
+                del self._tables[key]
+                return None
+            return dict(users)
+
+    def packet_size(self, key):
+        """حجم حزمة المستخدم (28 أو 72 بايت) الذي قرئ به الجدول المحفوظ"""
+        with self._lock:
+            entry = self._tables.get(key)
+            return entry[2] if entry else None
+
+    def set(self, key, users, ttl, packet_size=None):
+        """حفظ جدول كامل لمدة ttl ثانية (صفر يعني عدم التخزين)"""
+        with self._lock:
+            if not ttl or ttl <= 0:
+                self._tables.pop(key, None)
+                return
+            self._tables[key] = (time.monotonic() + ttl, dict(users), packet_size)
+
+    def put(self, key, user):
+        """تحديث مستخدم واحد في جدول محفوظ بعد كتابته على الجهاز"""
+        with self._lock:
+            entry = self._tables.get(key)
+            if entry:
+                entry[1][str(user.user_id)] = user
+
+    def discard(self, key, user_id):
+        """إزالة مستخدم واحد من جدول محفوظ بعد حذفه من الجهاز"""
+        with self._lock:
+            entry = self._tables.get(key)
+            if entry:
+                entry[1].pop(str(user_id), None)
+
+    def invalidate(self, key=None):
+        """إلغاء جدول جهاز واحد، أو جميع الجداول إذا لم يحدد المفتاح"""
+        with self._lock:
+            if key is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(key, None)
+
+
+user_table_cache = UserTableCache()